@@ -22,94 +22,195 @@ NOT retained)
 '''
 
 
+import argparse
 import os
-from typing import Sequence
+from itertools import islice
+from typing import Sequence, Tuple
 import numpy as np
 import pandas as pd
-from features import User
-from loader import UserDict, load_data
-from lib.progress_counter import ProgressCounter, human_readable
-from lib.utils import tcols, log_odds
-from statsmodels.api import Logit, add_constant
-
-
-def user_to_vec(user_dict: UserDict):
+from batch_features import compute_features
+from dataset_cache import load_dataset, open_dataset
+from features import FEATURES, User, vectorize_users
+from lib import instrument
+from lib.bootstrap import bootstrap_logit
+from lib.id_set import IdSet
+from lib.logit import CONST, fit_logit_chunked, fit_subsets
+from lib.parallel import bounded_map
+from loader import (DEFAULT_CHUNK_SIZE, UserDict, decoder_settings, load_data, plan_chunks,
+                    raw_files, read_chunk, set_decoder)
+from lib.progress_counter import Progress, init_worker, worker_tally
+from lib.running_stats import RunningStats
+from lib.utils import log_odds
+
+
+def user_to_vec(user_dict: UserDict, columns: Sequence[str] = None):
     '''
     Converts user data into a vector for analysis. Some 
     features may be None if that feature does not apply 
     to this user
+
+    Only the given feature columns (default: F_ALL) are computed, and
+    they share the user's helper aggregates
     '''
 
     user = User(user_dict)
 
-    return {
-        #######
-        # CVs #
-        #######
+    return {column: FEATURES[column].fget(user) for column in columns or F_ALL}
+
+
+def vectorize(user_data: Sequence[UserDict], verbose=True, batch_size=None,
+              columns: Sequence[str] = None):
+    '''
+    Convert the user data into an array, with each row representing
+    the feature vector for a single user, replacing any columns that 
+    are not applicable/invalid for that user with nan
+
+    Only the given columns (default: F_ALL) are computed. If batch_size
+    is given, users are vectorized batch_size at a time with the batch
+    feature engine instead of one by one. To vectorize in parallel, use
+    vectorize_raw, which has each worker decode its own users
+    '''
 
-        "age_at_first_post": user.f_age_at_first_post,
-        "num_init_posts": user.f_num_init_posts,
-        "prop_qs": user.f_prop_qs,
-        "avg_init_post_len": user.f_avg_init_post_len,
-        # avg. readability?
-        # other text features?
+    columns = tuple(columns or F_ALL)
 
-        #######
-        # IVs #
-        #######
+    if batch_size:
+        return vectorize_chunked(user_data, batch_size, verbose=verbose, columns=columns,
+                                 batch=True)
 
-        "avg_num_edits": user.f_avg_num_edits,
-        "avg_rep_editors": user.f_avg_rep_editors,
-        "avg_age_editors": user.f_avg_age_editors,
+    if verbose:
+        print('Vectorizing data...')
 
-        "avg_num_answers": user.f_avg_num_answers,
-        "avg_rep_top_answerers": user.f_avg_rep_top_answerers,
-        "avg_age_top_answerers": user.f_avg_age_top_answerers,
+    with Progress('Vectorized', 'data points', enabled=verbose) as progress:
+        tally = progress.tally()
+        data = []
+        for u in instrument.timed_iter('vectorize.load', user_data):
+            with instrument.timer('vectorize.features'):
+                data.append(user_to_vec(u, columns))
+            tally()
 
-        "avg_num_upvotes": user.f_avg_num_upvotes,
-        "avg_num_downvotes": user.f_avg_num_downvotes,
-        "avg_num_bookmarkers": user.f_avg_num_bookmarkers,
+    return pd.DataFrame(data, columns=columns, dtype=float)
 
-        "prop_accepted_answers": user.f_prop_accepted_answers,
 
-        ######
-        # DV #
-        ######
+def vectorize_chunk(user_dicts: Sequence[UserDict], columns: Sequence[str], batch=False) \
+        -> np.ndarray:
+    '''
+    Vectorizes one chunk of users into a (users, columns) float64 array
+    '''
+    with instrument.timer('vectorize.features'):
+        if not batch:
+            return vectorize_users(user_dicts, columns)
 
-        "retention": user.f_retention,
-    }
+        out = np.empty((len(user_dicts), len(columns)))
+        for j, values in enumerate(compute_features(user_dicts, columns).values()):
+            out[:, j] = values
+        return out
 
 
-def vectorize(user_data: Sequence[UserDict], verbose=True):
+def vectorize_chunked(user_data: Sequence[UserDict], chunk_size=1000, verbose=True,
+                      columns: Sequence[str] = None, batch=False):
     '''
-    Convert the user data into an array, with each row representing
-    the feature vector for a single user, replacing any columns that 
-    are not applicable/invalid for that user with nan
+    Same as vectorize, but splits the users into chunks of chunk_size
+    that are each vectorized straight into a float64 array. With batch,
+    chunks are vectorized with batch_features.compute_features
     '''
 
+    columns = tuple(columns or F_ALL)
+
     if verbose:
         print('Vectorizing data...')
-        pc = ProgressCounter(lambda i: print(
-            f'> Vectorized {human_readable(i)} data points so far'.ljust(tcols()), end='\r'))
 
-        data = []
-        for u in user_data:
-            data.append(user_to_vec(u))
-            pc.increment()
+    users = iter(instrument.timed_iter('vectorize.load', user_data))
+    with Progress('Vectorized', 'data points', enabled=verbose) as progress:
+        tally = progress.tally(batch=1)
+        arrays = []
+        for chunk in iter(lambda: list(islice(users, chunk_size)), []):
+            arrays.append(vectorize_chunk(chunk, columns, batch))
+            tally(len(chunk))
+
+    data = np.concatenate(arrays) if arrays else np.empty((0, len(columns)))
+    return pd.DataFrame(data, columns=columns, copy=False)
+
+
+def _init_range_worker(progress_value, decoder_settings):
+    init_worker(progress_value)
+    set_decoder(*decoder_settings)
 
-        print(f'> Done! Vectorized {pc.count} data points!'.ljust(tcols()))
-    else:
-        data = [user_to_vec(u) for u in user_data]
 
-    return pd.DataFrame(data, dtype=float)
+def vectorize_range(task) -> Tuple[np.ndarray, np.ndarray]:
+    '''
+    Decodes the users of one byte range of a raw file (see
+    loader.plan_chunks) and vectorizes them, returning their UserIds and
+    a (users, columns) float64 array. Only these arrays go back to the
+    parent process, never the decoded users
+    '''
+    chunk, columns, batch = task
+    with instrument.timer('vectorize.load'):
+        user_dicts = read_chunk(chunk)
+    user_ids = np.fromiter((u["UserId"] for u in user_dicts), np.int64, len(user_dicts))
+    out = vectorize_chunk(user_dicts, columns, batch)
+
+    tally = worker_tally()
+    if tally is not None:
+        tally(len(user_dicts))
+        tally.flush()
 
+    return user_ids, out
 
-def prepare_dataset(filename="cache/vectorized_dataset.csv", force_recompute=False, verbose=True) -> pd.DataFrame:
+
+def vectorize_raw(raw_dir=None, verbose=True, columns: Sequence[str] = None, workers=None,
+                  batch=False, chunk_size=DEFAULT_CHUNK_SIZE):
+    '''
+    Same as vectorize(load_data(raw_dir)), with the same rows in the same
+    order, but the raw files are split into byte ranges of chunk_size
+    bytes that a pool of worker processes (None means one per core) each
+    decode and vectorize. With batch, the batch feature engine is used
+    '''
+
+    columns = tuple(columns or F_ALL)
+
+    if verbose:
+        print('Vectorizing data...')
+
+    chunks = plan_chunks(raw_files(raw_dir), chunk_size)
+    tasks = ((chunk, columns, batch) for chunk in chunks)
+
+    with Progress('Vectorized', 'data points', enabled=verbose) as progress:
+        results = bounded_map(vectorize_range, tasks, workers=workers,
+                              initializer=_init_range_worker,
+                              initargs=(progress.value, decoder_settings()))
+
+        # Keep the first row of each UserId, as load_data does
+        seen = IdSet()
+        arrays = []
+        for user_ids, array in results:
+            keep = [not seen.check_add(user_id) for user_id in user_ids.tolist()]
+            arrays.append(array[keep])
+
+    data = np.concatenate(arrays) if arrays else np.empty((0, len(columns)))
+    return pd.DataFrame(data, columns=columns, copy=False)
+
+
+def prepare_dataset(filename=None, force_recompute=False, verbose=True, backend="npy",
+                    columns: Sequence[str] = None, raw_dir=None, workers=1) -> pd.DataFrame:
     '''
     Loads vectorized dataset from specified file (if exists), or
     computes the dataset and writes it to the specified file
+
+    With backend="npy" (the default), filename is a directory holding a
+    typed binary cache that is updated incrementally when raw files or
+    feature definitions change (see dataset_cache), and rows are indexed
+    by UserId. Only the given columns (default: F_ALL) are computed or
+    loaded. backend="csv" is the original all-or-nothing CSV cache,
+    computed across workers processes (see vectorize_raw) unless
+    workers=1. raw_dir is where the raw files are read from (default:
+    raw_data/)
     '''
 
+    if backend == "npy":
+        return load_dataset(filename or "cache/vectorized_dataset", columns or F_ALL,
+                            raw_dir=raw_dir, force_recompute=force_recompute, verbose=verbose)
+
+    filename = filename or "cache/vectorized_dataset.csv"
     if os.path.exists(filename) and not force_recompute:
         if verbose:
             print(f'Loading dataset from {filename}...')
@@ -119,7 +220,10 @@ def prepare_dataset(filename="cache/vectorized_dataset.csv", force_recompute=Fal
         if verbose:
             print(f'> Done! Loaded {dataset.shape[0]} data points!')
     else:
-        dataset = vectorize(load_data(), verbose=verbose)
+        if workers == 1:
+            dataset = vectorize(load_data(raw_dir=raw_dir), verbose=verbose, columns=columns)
+        else:
+            dataset = vectorize_raw(raw_dir, verbose=verbose, columns=columns, workers=workers)
 
         if verbose:
             print(f'Saving vectorized dataset to {filename}...')
@@ -150,24 +254,43 @@ def union_cols(*cols_seq: Sequence[tuple[str]]) -> tuple[str]:
 
 
 F_ALL = (
+    #######
+    # CVs #
+    #######
+
     "age_at_first_post",
     "num_init_posts",
     "prop_qs",
     "avg_init_post_len",
+    # avg. readability?
+    # other text features?
+
+    #######
+    # IVs #
+    #######
+
     "avg_num_edits",
     "avg_rep_editors",
     "avg_age_editors",
+
     "avg_num_answers",
     "avg_rep_top_answerers",
     "avg_age_top_answerers",
+
     "avg_num_upvotes",
     "avg_num_downvotes",
     "avg_num_bookmarkers",
+
     "prop_accepted_answers",
+
+    ######
+    # DV #
+    ######
+
     "retention"
 )
 '''
-All feature names
+All feature names (see features.FEATURES for their definitions)
 '''
 
 
@@ -225,43 +348,184 @@ on all users that have posted at least one answer
 '''
 
 
-def analyze_subset(dataset: np.ndarray, cols: tuple[int]):
-    sub = select_columns(dataset, cols)
+def balanced_rows(dataset: pd.DataFrame, cols: Sequence[str], rng: np.random.Generator = None) \
+        -> np.ndarray:
+    '''
+    Row positions of a class-balanced sample of the rows that have every
+    column in cols: m rows of each retention class, where m is the size
+    of the smaller class, drawn without replacement
+    '''
+    rng = rng or np.random.default_rng()
+    complete = ~np.isnan(dataset[list(cols)].to_numpy(dtype=np.float64)).any(axis=1)
+    retention = dataset["retention"].to_numpy()
 
-    n = sub.shape[0]
-    print(f'Running analysis with cols:')
-    for col in cols:
-        print(f"    {col}")
+    c0 = np.flatnonzero(complete & (retention == 0))
+    c1 = np.flatnonzero(complete & (retention == 1))
+    m = min(len(c0), len(c1))
+    return np.concatenate([rng.choice(c0, m, replace=False), rng.choice(c1, m, replace=False)])
 
-    print(f'> n (before balancing): {n}')
+
+def analyze_subsets(dataset: pd.DataFrame, subsets: Sequence[tuple[str]], seed=None, draws=0,
+                    workers=None):
+    '''
+    Balances classes and fits a logistic regression for each subset of
+    columns, all in one call to lib.logit.fit_subsets, then reports each
+    model. With draws > 0, each subset is also refitted on that many
+    class-balanced bootstrap resamples (see lib.bootstrap, workers
+    processes) and the percentile intervals of the odds ratios are shown
+    next to the log odds.
+    Returns the models
+    '''
+    seeds = np.random.SeedSequence(seed).spawn(2)
+    rng = np.random.default_rng(seeds[0])
 
     # Step 1: Balance classes
-    m = min((sub["retention"] == 0).sum(), (sub["retention"] == 1).sum())
-    c0 = sub.loc[sub['retention'] == 0].sample(m)
-    c1 = sub.loc[sub['retention'] == 1].sample(m)
-    sample = pd.concat([c0, c1])
+    rows = []
+    with instrument.timer('balance'):
+        for cols in subsets:
+            rows.append(balanced_rows(dataset, cols, rng))
+
+    # Step 2: Fit logistic regression models
+    with instrument.timer('fit'):
+        models = fit_subsets(dataset, "retention",
+                             [[col for col in cols if col != "retention"] for cols in subsets],
+                             rows)
+    instrument.count('fit.rows', sum(map(len, rows)))
+
+    # Step 3: Report
+    for cols, sample, model in zip(subsets, rows, models):
+        print(f'Running analysis with cols:')
+        for col in cols:
+            print(f"    {col}")
 
-    print(f'> n (after balancing): {2 * m}\n')
+        print(f'> n (before balancing): {select_columns(dataset, cols).shape[0]}')
+        print(f'> n (after balancing): {len(sample)}\n')
 
-    # Step 2: Prepare x and y
-    X = sample.drop(columns=["retention"])
-    y = sample[["retention"]]
+        print(model.summary())
 
-    # Step 3: Create logistic regression model
-    model = Logit(y, add_constant(X)).fit(disp=False)
+        odds = log_odds(model)
+        if draws:
+            with instrument.timer('bootstrap'):
+                boot = bootstrap_subset(dataset, cols, model, draws, seeds[1], workers)
+            odds = odds.join(boot.odds_table())
 
-    # Step 4: Report
-    print(model.summary())
+        print("\n" + " "*30 + "Log Odds" + (f" ({draws} bootstrap resamples)" if draws else ""))
+        print(odds.to_string())
+        print()
 
-    print("\n" + " "*30 + "Log Odds")
-    print(log_odds(model))
+    return models
 
 
-def analyze_all():
-    dataset = prepare_dataset()
+def bootstrap_subset(dataset: pd.DataFrame, cols: Sequence[str], model, draws: int,
+                     seed: np.random.SeedSequence, workers=None):
+    '''
+    Refits the model for cols on draws class-balanced bootstrap resamples
+    of the rows that have every column in cols, warm-started from model
+    '''
+    complete = select_columns(dataset, cols)
+    X = complete[list(model.params.index[1:])].to_numpy(dtype=np.float64)
+    X = np.column_stack([np.ones(len(X)), X])
+    return bootstrap_logit(X, complete["retention"].to_numpy(), model.params.index, draws,
+                           seed=seed.spawn(1)[0], workers=workers,
+                           start=model.params.to_numpy())
+
+
+def analyze_subset(dataset: pd.DataFrame, cols: tuple[str]):
+    return analyze_subsets(dataset, [cols])[0]
+
+
+def analyze_streaming(subsets: Sequence[tuple[str]], chunk_size=100_000, cache_dir=None,
+                      raw_dir=None):
+    '''
+    Same analysis as analyze_all, for datasets that don't fit in memory:
+    the cached dataset is read chunk_size rows at a time, first to get the
+    mean/stddev of every column, then once per Newton step of each model
+    (see lib.logit.fit_logit_chunked), normalizing each chunk on the fly.
+    Returns the models
+
+    Instead of subsampling the larger retention class, each class is
+    weighted down to the size of the smaller one (balanced class
+    weights), which needs only the class counts rather than the
+    positions of a sample
+    '''
+    with instrument.timer('prepare_dataset'):
+        dataset = open_dataset(cache_dir or "cache/vectorized_dataset", F_ALL, raw_dir=raw_dir)
+    columns = dataset.columns
+    retention = columns.index("retention")
+    col_idx = [[columns.index(col) for col in cols if col != "retention"] for cols in subsets]
+
+    # Step 1: Mean/stddev of all columns, and the retention classes of the
+    # complete rows of each subset
+    with instrument.timer('normalize'):
+        stats = RunningStats(len(columns))
+        class_counts = np.zeros((len(subsets), 2))
+        for chunk in dataset.chunks(chunk_size=chunk_size):
+            stats.update(chunk)
+            for i, idx in enumerate(col_idx):
+                y = chunk[~np.isnan(chunk[:, idx + [retention]]).any(axis=1), retention]
+                class_counts[i] += np.bincount(y.astype(np.int64), minlength=2)
+
+    # Step 2: Fit logistic regression models on normalized chunks
+    models = []
+    for cols, idx, counts in zip(subsets, col_idx, class_counts):
+        mean, std = stats.mean[idx], stats.std[idx]
+        class_weights = counts.min() / counts
+
+        def chunks():
+            for chunk in dataset.chunks(chunk_size=chunk_size):
+                chunk = chunk[~np.isnan(chunk[:, idx + [retention]]).any(axis=1)]
+                X = np.empty((len(chunk), len(idx) + 1))
+                X[:, 0] = 1
+                X[:, 1:] = (chunk[:, idx] - mean) / std
+                y = chunk[:, retention]
+                yield X, y, class_weights[y.astype(np.int64)]
+
+        with instrument.timer('fit'):
+            model = fit_logit_chunked(chunks, [CONST] + [columns[j] for j in idx])
+        instrument.count('fit.rows', int(counts.sum()))
+        models.append(model)
+
+        print(f'Running analysis with cols:')
+        for col in cols:
+            print(f"    {col}")
+
+        print(f'> n (before balancing): {int(counts.sum())}')
+        print(f'> n (after balancing, weighted): {model.nobs:g}\n')
+
+        print(model.summary())
+
+        print("\n" + " "*30 + "Log Odds")
+        print(log_odds(model))
+        print()
+
+    print()
+    print('--- MEAN ---')
+    print(pd.Series(stats.mean, index=columns))
+    print('\n--- STD ---')
+    print(pd.Series(stats.std, index=columns))
+
+    return models
+
+
+def analyze_all(draws=0, workers=None, seed=0, streaming=False, chunk_size=100_000,
+                raw_dir=None):
+    '''
+    Fits and reports the models, with bootstrap intervals from draws
+    resamples if draws > 0 (see analyze_subsets). With streaming=True the
+    dataset is never loaded whole (see analyze_streaming), and draws is
+    ignored
+    '''
+    if streaming:
+        analyze_streaming([F_EDITED], chunk_size=chunk_size, raw_dir=raw_dir)
+        instrument.report()
+        return
+
+    with instrument.timer('prepare_dataset'):
+        dataset = prepare_dataset(raw_dir=raw_dir)
 
     # Step 1: Normalize all columns by mean/stddev
-    normed_dataset = (dataset - dataset.mean(skipna=True)) / dataset.std()
+    with instrument.timer('normalize'):
+        normed_dataset = (dataset - dataset.mean(skipna=True)) / dataset.std()
 
     # Restore retention values to 0, 1
     normed_dataset[["retention"]] = dataset[["retention"]]
@@ -269,7 +533,7 @@ def analyze_all():
     # Step 2: Analyze subsets of features
     # analyze_subset(normed_dataset, F_BASIC)
     # analyze_subset(normed_dataset, F_ANSWERED)
-    analyze_subset(normed_dataset, F_EDITED)
+    analyze_subsets(normed_dataset, [F_EDITED], seed=seed, draws=draws, workers=workers)
 
     print()
     print('--- MEAN ---')
@@ -277,6 +541,16 @@ def analyze_all():
     print('\n--- STD ---')
     print(dataset.std())
 
+    instrument.report()
+
 
 if __name__ == "__main__":
-    analyze_all()
+    parser = argparse.ArgumentParser(description='Logistic regression of retention')
+    parser.add_argument('--bootstrap', type=int, default=0, metavar='DRAWS',
+                        help='also fit DRAWS class-balanced bootstrap resamples per model')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='bootstrap processes (default: one per core)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    analyze_all(draws=args.bootstrap, workers=args.workers, seed=args.seed)
@@ -0,0 +1,245 @@
+'''
+Computes the f_* features of features.User for many users at once.
+
+The posts, votes, edits and answers of a batch of users are flattened
+into NumPy arrays tagged with the index of the user they belong to, and
+each feature is then a segmented reduction (bincount) over those arrays.
+Results match the per-user properties exactly, with nan wherever the
+property would return None.
+
+Each part of a batch is only flattened when a requested feature needs
+it, and is then shared by every feature that does.
+'''
+
+from functools import cached_property
+from typing import Callable, Dict, List, Sequence
+import numpy as np
+from features import FEATURES
+from loader import UserDict
+
+FEATURE_NAMES = tuple(FEATURES)
+'''
+Names of the computed features, i.e. the f_* properties of features.User
+without the f_ prefix
+'''
+
+VOTE_CODES = {"UpMod": 0, "DownMod": 1, "Bookmark": 2, "AcceptedByOriginator": 3}
+
+
+class FlatBatch:
+    '''
+    A batch of users flattened into parallel arrays. Each child array has
+    a matching *_user array holding the index of the user it belongs to
+    '''
+
+    def __init__(self, user_dicts: List[UserDict]):
+        self.user_dicts = user_dicts
+        self.num_users = len(user_dicts)
+
+    def sum(self, seg: np.ndarray, weights: np.ndarray = None) -> np.ndarray:
+        '''
+        Per-user sum of weights (or count, if no weights) over a segment array
+        '''
+        return np.bincount(seg, weights=weights, minlength=self.num_users).astype(np.float64)
+
+    @cached_property
+    def age(self) -> np.ndarray:
+        return np.asarray([(u["FirstPostDate"] - u["AccountCreationDate"]).days
+                           for u in self.user_dicts], dtype=np.float64)
+
+    @cached_property
+    def num_future(self) -> np.ndarray:
+        return np.asarray([u["NumFuturePosts"] for u in self.user_dicts], dtype=np.int64)
+
+    #############
+    ### POSTS ###
+    #############
+
+    @cached_property
+    def _posts(self):
+        post_user, is_q, is_a, length, num_edits, num_answers = [], [], [], [], [], []
+        for i, user in enumerate(self.user_dicts):
+            for post in user["Posts"]:
+                post_user.append(i)
+                is_q.append(post["PostType"] == "Question")
+                is_a.append(post["PostType"] == "Answer")
+                length.append(len(post["Body"]) if "Body" in post else np.nan)
+                num_edits.append(len(post["Edits"]) if "Edits" in post else 0)
+                num_answers.append(len(post["Answers"]) if "Answers" in post else 0)
+
+        return (np.asarray(post_user, dtype=np.int64),
+                np.asarray(is_q, dtype=bool),
+                np.asarray(is_a, dtype=bool),
+                np.asarray(length, dtype=np.float64),
+                np.asarray(num_edits, dtype=np.float64),
+                np.asarray(num_answers, dtype=np.float64))
+
+    @property
+    def post_user(self):
+        return self._posts[0]
+
+    @property
+    def post_is_q(self):
+        return self._posts[1]
+
+    @property
+    def post_is_a(self):
+        return self._posts[2]
+
+    @property
+    def post_len(self):
+        if np.isnan(self._posts[3]).any():
+            # Loaded without bodies (see loader.load_data's fields)
+            raise KeyError("Body")
+        return self._posts[3]
+
+    @property
+    def post_num_edits(self):
+        return self._posts[4]
+
+    @property
+    def post_num_answers(self):
+        return self._posts[5]
+
+    @cached_property
+    def num_posts(self):
+        return self.sum(self.post_user)
+
+    @cached_property
+    def num_qs(self):
+        return self.sum(self.post_user[self.post_is_q])
+
+    @cached_property
+    def num_as(self):
+        return self.sum(self.post_user[self.post_is_a])
+
+    #############
+    ### EDITS ###
+    #############
+
+    @cached_property
+    def _edits(self):
+        edit_user, rep, age = [], [], []
+        for i, user in enumerate(self.user_dicts):
+            for post in user["Posts"]:
+                if "Edits" in post:
+                    for edit in post["Edits"]:
+                        edit_user.append(i)
+                        rep.append(edit["EditorRep"])
+                        age.append(edit["EditorAge"])
+
+        return (np.asarray(edit_user, dtype=np.int64),
+                np.asarray(rep, dtype=np.float64),
+                np.asarray(age, dtype=np.float64))
+
+    @cached_property
+    def num_edits(self):
+        return self.sum(self._edits[0])
+
+    #############
+    ### VOTES ###
+    #############
+
+    @cached_property
+    def votes(self) -> Dict[int, np.ndarray]:
+        '''
+        Per-user number of votes of each type in VOTE_CODES
+        '''
+        vote_user, vote_code = [], []
+        for i, user in enumerate(self.user_dicts):
+            for post in user["Posts"]:
+                if "Votes" in post:
+                    for vote in post["Votes"]:
+                        vote_user.append(i)
+                        vote_code.append(VOTE_CODES.get(vote["VoteType"], -1))
+
+        vote_user = np.asarray(vote_user, dtype=np.int64)
+        vote_code = np.asarray(vote_code, dtype=np.int64)
+        return {code: self.sum(vote_user[vote_code == code]) for code in VOTE_CODES.values()}
+
+    ###############
+    ### ANSWERS ###
+    ###############
+
+    @cached_property
+    def _top_answers(self):
+        '''
+        User, AnswererRep and AnswererAge of the top answer of each post
+        that has answers, which is the first answer maximizing
+        (IsAcceptedAnswer, Score)
+        '''
+        answer_post, answer_user, accepted, score, rep, age = [], [], [], [], [], []
+        p = 0
+        for i, user in enumerate(self.user_dicts):
+            for post in user["Posts"]:
+                if "Answers" in post:
+                    for answer in post["Answers"]:
+                        answer_post.append(p)
+                        answer_user.append(i)
+                        accepted.append(answer["IsAcceptedAnswer"])
+                        score.append(answer["Score"])
+                        rep.append(answer["AnswererRep"])
+                        age.append(answer["AnswererAge"])
+                p += 1
+
+        answer_post = np.asarray(answer_post, dtype=np.int64)
+        order = np.lexsort((np.arange(len(answer_post)),
+                            -np.asarray(score, dtype=np.int64),
+                            -np.asarray(accepted, dtype=np.int64),
+                            answer_post))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = answer_post[order][1:] != answer_post[order][:-1]
+        top = order[first]
+
+        return (np.asarray(answer_user, dtype=np.int64)[top],
+                np.asarray(rep, dtype=np.float64)[top],
+                np.asarray(age, dtype=np.float64)[top])
+
+    @cached_property
+    def num_top_answers(self):
+        return self.sum(self._top_answers[0])
+
+
+def _avg(total: np.ndarray, count: np.ndarray) -> np.ndarray:
+    '''
+    Segmented version of features.maybe_avg/maybe_div: nan where count is 0
+    '''
+    out = np.full(len(total), np.nan)
+    np.divide(total, count, out=out, where=count != 0)
+    return out
+
+
+BATCH_FEATURES: Dict[str, Callable[[FlatBatch], np.ndarray]] = {
+    "age_at_first_post": lambda b: b.age,
+    "num_init_posts": lambda b: b.num_posts,
+    "prop_qs": lambda b: b.num_qs / b.num_posts,
+    "avg_init_post_len": lambda b: b.sum(b.post_user, b.post_len) / b.num_posts,
+    "avg_num_edits": lambda b: b.sum(b.post_user, b.post_num_edits) / b.num_posts,
+    "avg_rep_editors": lambda b: _avg(b.sum(b._edits[0], b._edits[1]), b.num_edits),
+    "avg_age_editors": lambda b: _avg(b.sum(b._edits[0], b._edits[2]), b.num_edits),
+    "avg_num_answers": lambda b: _avg(b.sum(b.post_user[b.post_is_q],
+                                            b.post_num_answers[b.post_is_q]), b.num_qs),
+    "avg_rep_top_answerers": lambda b: _avg(b.sum(b._top_answers[0], b._top_answers[1]),
+                                            b.num_top_answers),
+    "avg_age_top_answerers": lambda b: _avg(b.sum(b._top_answers[0], b._top_answers[2]),
+                                            b.num_top_answers),
+    "avg_num_upvotes": lambda b: b.votes[VOTE_CODES["UpMod"]] / b.num_posts,
+    "avg_num_downvotes": lambda b: b.votes[VOTE_CODES["DownMod"]] / b.num_posts,
+    "avg_num_bookmarkers": lambda b: b.votes[VOTE_CODES["Bookmark"]] / b.num_posts,
+    "prop_accepted_answers": lambda b: _avg(b.votes[VOTE_CODES["AcceptedByOriginator"]],
+                                            b.num_as),
+    "retention": lambda b: (b.num_future > 0).astype(np.float64),
+}
+'''
+Batch version of every registered feature
+'''
+
+
+def compute_features(user_dicts: List[UserDict], columns: Sequence[str] = FEATURE_NAMES) \
+        -> Dict[str, np.ndarray]:
+    '''
+    Computes the given features (default: all) for a batch of users, as
+    a dict from feature name to a float64 array with one entry per user
+    '''
+    b = FlatBatch(user_dicts)
+    return {column: BATCH_FEATURES[column](b) for column in columns}
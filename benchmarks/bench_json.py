@@ -0,0 +1,46 @@
+'''
+Decoding speed of the PostsX payloads of synthetic users with each
+installed JSON backend, with and without validation against PostDict
+
+    python -m benchmarks.bench_json [num_users]
+'''
+
+import json
+import sys
+import time
+from typing import List
+from benchmarks.synthetic import make_users
+from lib.json_backend import available_backends, get_decoder
+from loader import PostDict
+
+
+def throughput(decode, payloads, repeat=5):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for payload in payloads:
+            decode(payload)
+        best = min(best, time.perf_counter() - start)
+    return len(payloads) / best, sum(map(len, payloads)) / best
+
+
+def main(num_users=5000):
+    users = make_users(num_users)
+    payloads = [json.dumps(u["Posts"]).encode() for u in users]
+    print(f'{num_users} synthetic PostsX payloads, {sum(map(len, payloads)) / 2**20:.1f} MB')
+
+    baseline = None
+    for backend in available_backends():
+        for validate in (False, True):
+            decode = get_decoder(backend, List[PostDict] if validate else None)
+            assert [decode(p) for p in payloads] == [u["Posts"] for u in users]
+
+            rows, size = throughput(decode, payloads)
+            baseline = baseline or rows
+            name = backend + (' (validated)' if validate else '')
+            print(f'> {name:<20} {rows:>10,.0f} rows/s {size / 2**20:>8.1f} MB/s '
+                  f'({rows / baseline:.2f}x)')
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
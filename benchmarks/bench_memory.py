@@ -0,0 +1,111 @@
+'''
+Peak RSS of loading every synthetic user into memory, with the original
+loader (set of UserId strings, stdlib json, no interning) and with the
+current one, plus the memory used by the dedup set alone
+
+    python -m benchmarks.bench_memory [num_users]
+
+Each variant runs in a fresh process, so peaks don't carry over
+'''
+
+import csv
+import json
+import resource
+import subprocess
+import sys
+import tracemalloc
+from base64 import b64decode
+from datetime import datetime
+from gzip import decompress
+
+VARIANTS = ("original", "no interning", "current", "current, METADATA_FIELDS")
+
+
+def original_load_data(raw_dir):
+    '''
+    loader.load_data as it was before ids were deduplicated with an IdSet
+    and strings interned
+    '''
+    from loader import raw_files
+
+    user_ids = set()
+    for filename in raw_files(raw_dir):
+        with open(filename) as csv_file:
+            for row in csv.DictReader(csv_file):
+                if row["UserId"] in user_ids:
+                    continue
+                user_ids.add(row["UserId"])
+                yield {
+                    "UserId": int(row["UserId"]),
+                    "AccountCreationDate": datetime.fromisoformat(row["AccountCreationDate"]),
+                    "FirstPostDate": datetime.fromisoformat(row["FirstPostDate"]),
+                    "NumFuturePosts": int(row["NumFuturePosts"]),
+                    "Posts": json.loads(decompress(b64decode(row["PostsX"])))
+                }
+
+
+def max_rss_mb() -> float:
+    '''
+    Peak RSS of this process. ru_maxrss carries over from the parent
+    through fork/exec, so VmHWM is read instead where available (Linux)
+    '''
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 2**10
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10
+
+
+def child(variant: str, raw_dir: str):
+    import loader
+
+    before = max_rss_mb()
+    if variant == "original":
+        users = list(original_load_data(raw_dir))
+    else:
+        loader.set_decoder(intern=variant != "no interning")
+        fields = loader.METADATA_FIELDS if "METADATA_FIELDS" in variant else None
+        users = list(loader.load_data(raw_dir=raw_dir, fields=fields))
+
+    print(json.dumps({"users": len(users), "before": before, "peak": max_rss_mb()}))
+
+
+def dedup_memory(num_ids: int, max_id=20_000_000):
+    from lib.id_set import IdSet
+
+    ids = list(range(1, max_id, max_id // num_ids))[:num_ids]
+    for name, make in (("set of str", lambda: set(map(str, ids))),
+                       ("set of int", lambda: set(ids)),
+                       ("IdSet", lambda: IdSet(ids))):
+        tracemalloc.start()
+        s = make()
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del s
+        print(f'> {name:<12} {size / 2**20:8.1f} MB for {num_ids:,} ids up to {max_id:,}')
+
+
+def main(num_users=20000):
+    from benchmarks.run import raw_dir
+
+    path = raw_dir(num_users)
+    print(f'Loading {num_users} synthetic users from {path}')
+    for variant in VARIANTS:
+        out = subprocess.run([sys.executable, '-m', 'benchmarks.bench_memory', '--child',
+                              variant, path], capture_output=True, text=True, check=True)
+        result = json.loads(out.stdout.strip().splitlines()[-1])
+        print(f'> {variant:<26} peak RSS {result["peak"]:8.1f} MB '
+              f'({result["peak"] - result["before"]:8.1f} MB for {result["users"]} users)')
+
+    print('Dedup set alone:')
+    dedup_memory(1_000_000)
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ['--child']:
+        child(*sys.argv[2:4])
+    else:
+        main(*map(int, sys.argv[1:]))
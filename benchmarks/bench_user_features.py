@@ -0,0 +1,242 @@
+'''
+Per-user cost of the features.User properties, which read from per-helper
+aggregates (one pass over the posts per helper), against the original
+User, which made a pass over the posts for every property
+
+    python -m benchmarks.bench_user_features [num_users]
+'''
+
+import sys
+import time
+from benchmarks.synthetic import make_users
+from features import User, has_vote, maybe_avg, maybe_div
+
+F_PROPS = [name for name in dir(User) if name.startswith('f_')]
+
+COMPAT_PROPS = ["AvgEditorRep", "AvgTopAnswererRep", "AvgEditorAge",
+                "AvgTopAnswererAge", "TotalUpVotes", "TotalDownVotes",
+                "NumInitialPosts", "NumFuturePosts", "NumQuestions",
+                "NumAnswers", "TotalAnswersAccepted", "TotalBookmarked",
+                "TotalClosed", "TotalSuggestedEdits", "AvgNumAnswers",
+                "AvgViewCount"]
+
+
+class OriginalUser:
+    '''
+    The properties of features.User as they were before the aggregates,
+    each computed with its own pass over the posts. Kept as the reference
+    that User must match
+    '''
+
+    def __init__(self, user_dict):
+        self.raw_data = user_dict
+
+    @property
+    def AvgEditorRep(self):
+        return maybe_avg([edit["EditorRep"]
+                          for edit in self.get_edits()])
+
+    @property
+    def AvgTopAnswererRep(self):
+        return maybe_avg([answer["AnswererRep"]
+                          for answer in self.get_top_answers()])
+
+    @property
+    def AvgEditorAge(self):
+        return maybe_avg([edit["EditorAge"]
+                          for edit in self.get_edits()])
+
+    @property
+    def AvgTopAnswererAge(self):
+        return maybe_avg([answer["AnswererAge"]
+                          for answer in self.get_top_answers()])
+
+    @property
+    def TotalUpVotes(self):
+        return len([vote
+                    for vote in self.get_votes()
+                    if vote["VoteType"] == "UpMod"])
+
+    @property
+    def TotalDownVotes(self):
+        return len([vote
+                    for vote in self.get_votes()
+                    if vote["VoteType"] == "DownMod"])
+
+    @property
+    def NumInitialPosts(self):
+        return len(self.raw_data["Posts"])
+
+    @property
+    def NumFuturePosts(self):
+        return self.raw_data["NumFuturePosts"]
+
+    @property
+    def NumQuestions(self):
+        return len([post
+                    for post in self.raw_data["Posts"]
+                    if post["PostType"] == "Question"])
+
+    @property
+    def NumAnswers(self):
+        return len([post
+                    for post in self.raw_data["Posts"]
+                    if post["PostType"] == "Answer"])
+
+    @property
+    def TotalAnswersAccepted(self):
+        return len([post
+                    for post in self.raw_data["Posts"]
+                    if post["PostType"] == "Answer"
+                    and has_vote(post, "AcceptedByOriginator")])
+
+    @property
+    def TotalBookmarked(self):
+        return len([post
+                    for post in self.raw_data["Posts"]
+                    if has_vote(post, "Bookmark")])
+
+    @property
+    def TotalClosed(self):
+        return len([post
+                    for post in self.raw_data["Posts"]
+                    if has_vote(post, "Close")])
+
+    @property
+    def TotalSuggestedEdits(self):
+        return len(self.get_edits())
+
+    @property
+    def AvgNumAnswers(self):
+        return maybe_avg([len(post["Answers"])
+                          for post in self.raw_data["Posts"]
+                          if post["PostType"] == "Question" and "Answers" in post])
+
+    @property
+    def AvgViewCount(self):
+        return maybe_avg([post["ViewCount"]
+                          for post in self.raw_data["Posts"]
+                          if "ViewCount" in post])
+
+    @property
+    def f_age_at_first_post(self):
+        return (self.raw_data["FirstPostDate"] - self.raw_data["AccountCreationDate"]).days
+
+    @property
+    def f_num_init_posts(self):
+        return len(self.raw_data["Posts"])
+
+    @property
+    def f_prop_qs(self):
+        return sum(1 for post in self.raw_data["Posts"]
+                   if post["PostType"] == "Question") \
+            / self.f_num_init_posts
+
+    @property
+    def f_avg_init_post_len(self):
+        return sum(len(post["Body"])
+                   for post in self.raw_data["Posts"]) \
+            / self.f_num_init_posts
+
+    @property
+    def f_avg_num_edits(self):
+        return sum(len(post["Edits"]) if "Edits" in post else 0
+                   for post in self.raw_data["Posts"]) \
+            / self.f_num_init_posts
+
+    @property
+    def f_avg_rep_editors(self):
+        return maybe_avg([edit["EditorRep"] for edit in self.get_edits()])
+
+    @property
+    def f_avg_age_editors(self):
+        return maybe_avg([edit["EditorAge"] for edit in self.get_edits()])
+
+    @property
+    def f_avg_num_answers(self):
+        return maybe_avg([len(post["Answers"]) if "Answers" in post else 0
+                          for post in self.raw_data["Posts"]
+                          if post["PostType"] == "Question"])
+
+    @property
+    def f_avg_rep_top_answerers(self):
+        return maybe_avg([answer["AnswererRep"] for answer in self.get_top_answers()])
+
+    @property
+    def f_avg_age_top_answerers(self):
+        return maybe_avg([answer["AnswererAge"] for answer in self.get_top_answers()])
+
+    @property
+    def f_avg_num_upvotes(self):
+        return sum(1 for vote in self.get_votes()
+                   if vote["VoteType"] == "UpMod") \
+            / self.f_num_init_posts
+
+    @property
+    def f_avg_num_downvotes(self):
+        return sum(1 for vote in self.get_votes()
+                   if vote["VoteType"] == "DownMod") \
+            / self.f_num_init_posts
+
+    @property
+    def f_avg_num_bookmarkers(self):
+        return sum(1 for vote in self.get_votes()
+                   if vote["VoteType"] == "Bookmark") \
+            / self.f_num_init_posts
+
+    @property
+    def f_prop_accepted_answers(self):
+        return maybe_div(sum(1 for vote in self.get_votes()
+                             if vote["VoteType"] == "AcceptedByOriginator"),
+                         self.NumAnswers)
+
+    @property
+    def f_retention(self):
+        return 1 if self.NumFuturePosts > 0 else 0
+
+    def get_edits(self):
+        return [edit
+                for post in self.raw_data["Posts"] if "Edits" in post
+                for edit in post["Edits"]]
+
+    def get_top_answers(self):
+        return [max(post["Answers"], key=lambda a: (a["IsAcceptedAnswer"], a["Score"]))
+                for post in self.raw_data["Posts"]
+                if "Answers" in post]
+
+    def get_votes(self):
+        return [vote
+                for post in self.raw_data["Posts"] if "Votes" in post
+                for vote in post["Votes"]]
+
+
+def all_props(user):
+    return [getattr(user, name) for name in F_PROPS + COMPAT_PROPS]
+
+
+def per_user_cost(user_dicts, user_class, repeat=5):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for u in user_dicts:
+            all_props(user_class(u))
+        best = min(best, time.perf_counter() - start)
+    return best / len(user_dicts)
+
+
+def main(num_users=5000):
+    user_dicts = make_users(num_users)
+
+    for u in user_dicts:
+        assert all_props(OriginalUser(u)) == all_props(User(u))
+
+    before = per_user_cost(user_dicts, OriginalUser)
+    after = per_user_cost(user_dicts, User)
+    print(f'{len(F_PROPS)} f_* + {len(COMPAT_PROPS)} backward-compatible properties, '
+          f'{num_users} synthetic users')
+    print(f'> per-property pass: {before * 1e6:8.1f} us/user')
+    print(f'> aggregates:        {after * 1e6:8.1f} us/user ({before / after:.1f}x)')
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
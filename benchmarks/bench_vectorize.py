@@ -0,0 +1,77 @@
+'''
+Throughput of analysis2's vectorize modes, in users per second, on
+synthetic users: the serial modes on users already in memory, and
+decoding plus vectorizing straight from raw files, serially and with
+vectorize_raw's worker pool
+
+    python -m benchmarks.bench_vectorize [num_users] [workers]
+'''
+
+import os
+import sys
+import time
+from analysis2 import vectorize, vectorize_chunked, vectorize_raw
+from benchmarks.run import raw_dir
+from loader import load_data
+
+TARGET_USERS_PER_SEC = 50_000
+'''
+Throughput the fastest mode should reach, even on a single core (the
+serial batch engine ran at ~90k users/s on synthetic users when this was
+set)
+'''
+
+MODES = {
+    "dicts (serial)": (vectorize, dict()),
+    "arrays (serial)": (vectorize_chunked, dict(chunk_size=1000)),
+    "batch (serial)": (vectorize, dict(batch_size=10000)),
+}
+'''
+Function and arguments of each mode run on users in memory. The arrays
+mode calls vectorize_chunked directly, since vectorize without a
+batch_size takes the per-user dict path
+'''
+
+RAW_MODES = {
+    "load + batch (serial)":
+        lambda path, workers: vectorize(load_data(raw_dir=path), False, batch_size=10000),
+    "arrays (parallel)":
+        lambda path, workers: vectorize_raw(path, False, workers=workers),
+    "batch (parallel)":
+        lambda path, workers: vectorize_raw(path, False, workers=workers, batch=True),
+}
+'''
+Modes run from the raw files, including the decoding, given the raw data
+directory and the number of workers
+'''
+
+
+def timed(fn, *args, **kwargs) -> float:
+    start = time.perf_counter()
+    fn(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def main(num_users=20000, workers=None):
+    workers = workers or os.cpu_count()
+    path = raw_dir(num_users)
+    user_dicts = list(load_data(raw_dir=path))
+    print(f'{len(user_dicts)} synthetic users, {workers} worker(s)')
+
+    best = 0
+    for name, (fn, kwargs) in MODES.items():
+        rate = len(user_dicts) / timed(fn, user_dicts, verbose=False, **kwargs)
+        best = max(best, rate)
+        print(f'> {name:<22} {rate:>10,.0f} users/s')
+
+    for name, fn in RAW_MODES.items():
+        rate = len(user_dicts) / timed(fn, path, workers)
+        best = max(best, rate)
+        print(f'> {name:<22} {rate:>10,.0f} users/s (from raw files)')
+
+    status = 'OK' if best >= TARGET_USERS_PER_SEC else 'BELOW TARGET'
+    print(f'Best: {best:,.0f} users/s (target {TARGET_USERS_PER_SEC:,}) {status}')
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
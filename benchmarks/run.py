@@ -0,0 +1,188 @@
+'''
+Benchmark suite over synthetic raw data at several scales. Each benchmark
+is timed `repeat` times and the results are saved as JSON, one record per
+(benchmark, scale), so runs on different commits can be compared
+
+    python -m benchmarks.run [--scales 1000 10000] [--only load_data vectorize]
+    python -m benchmarks.run --compare benchmarks/results/OLD.json
+
+Synthetic raw data is written once per scale under benchmarks/data/
+'''
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+from datetime import datetime
+import numpy as np
+from analysis2 import F_BASIC, analyze_subset, user_to_vec, vectorize
+from benchmarks.synthetic import write_raw_data
+from features import tokenize_body
+from loader import load_data
+from ngram_model import count_ngrams
+
+BENCH_DIR = os.path.dirname(os.path.realpath(__file__))
+DATA_DIR = os.path.join(BENCH_DIR, 'data')
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+
+DEFAULT_SCALES = (1000, 10000)
+
+
+def raw_dir(scale: int) -> str:
+    '''
+    Directory of synthetic raw data with `scale` rows, written on first use
+    '''
+    path = os.path.join(DATA_DIR, str(scale))
+    if not os.path.isdir(path):
+        print(f'Writing {scale} synthetic users to {path}...')
+        write_raw_data(path + '.tmp', scale, num_files=max(1, scale // 50000))
+        os.replace(path + '.tmp', path)
+    return path
+
+
+class Data:
+    '''
+    The inputs of the benchmarks at one scale, built once and shared
+    '''
+
+    def __init__(self, scale: int):
+        self.raw_dir = raw_dir(scale)
+        self.users = list(load_data(raw_dir=self.raw_dir))
+        self.bodies = [post["Body"] for u in self.users for post in u["Posts"]]
+
+        dataset = vectorize(self.users, verbose=False, batch_size=10000)
+        normed = (dataset - dataset.mean(skipna=True)) / dataset.std()
+        normed[["retention"]] = dataset[["retention"]]
+        self.dataset = normed
+
+
+def bench_load_data(data: Data):
+    return len(list(load_data(raw_dir=data.raw_dir))), 'users'
+
+
+def bench_load_data_parallel(data: Data):
+    return len(list(load_data(raw_dir=data.raw_dir, workers=None, chunk_size=2**20))), 'users'
+
+
+def bench_tokenize_body(data: Data):
+    for body in data.bodies:
+        tokenize_body(body)
+    return len(data.bodies), 'bodies'
+
+
+def bench_user_features(data: Data):
+    for u in data.users:
+        user_to_vec(u)
+    return len(data.users), 'users'
+
+
+def bench_vectorize(data: Data):
+    vectorize(data.users, verbose=False)
+    return len(data.users), 'users'
+
+
+def bench_vectorize_batch(data: Data):
+    vectorize(data.users, verbose=False, batch_size=10000)
+    return len(data.users), 'users'
+
+
+def bench_ngram_counting(data: Data):
+    with count_ngrams(data.bodies, n=3, workers=1):
+        pass
+    return len(data.bodies), 'bodies'
+
+
+def bench_analyze_subset(data: Data):
+    with contextlib.redirect_stdout(io.StringIO()):
+        analyze_subset(data.dataset, F_BASIC)
+    return len(data.dataset), 'users'
+
+
+BENCHMARKS = {
+    "load_data": bench_load_data,
+    "load_data_parallel": bench_load_data_parallel,
+    "tokenize_body": bench_tokenize_body,
+    "user_features": bench_user_features,
+    "vectorize": bench_vectorize,
+    "vectorize_batch": bench_vectorize_batch,
+    "ngram_counting": bench_ngram_counting,
+    "analyze_subset": bench_analyze_subset,
+}
+
+
+def run(scales=DEFAULT_SCALES, names=None, repeat=3) -> dict:
+    results = []
+    for scale in scales:
+        data = Data(scale)
+        for name in names or BENCHMARKS:
+            times = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                items, unit = BENCHMARKS[name](data)
+                times.append(time.perf_counter() - start)
+
+            seconds = statistics.median(times)
+            results.append({"benchmark": name, "scale": scale, "items": items, "unit": unit,
+                            "seconds": seconds, "best_seconds": min(times),
+                            "rate": items / seconds})
+            print(f'> {name:<20} {scale:>8} {items / seconds:>12,.0f} {unit}/s')
+
+    return {"meta": environment(), "repeat": repeat, "results": results}
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCH_DIR,
+                                capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+
+    return {"time": datetime.now().isoformat(timespec='seconds'), "commit": commit,
+            "python": platform.python_version(), "numpy": np.__version__,
+            "platform": platform.platform(), "cpu_count": os.cpu_count()}
+
+
+def compare(old: dict, new: dict, threshold=0.1):
+    '''
+    Prints the speedup of each benchmark in new over old, flagging any
+    that got more than `threshold` slower
+    '''
+    before = {(r["benchmark"], r["scale"]): r for r in old["results"]}
+    print(f'Compared to {old["meta"]["commit"]} ({old["meta"]["time"]}):')
+    for r in new["results"]:
+        prev = before.get((r["benchmark"], r["scale"]))
+        if prev is None:
+            continue
+        speedup = r["rate"] / prev["rate"]
+        flag = '  REGRESSION' if speedup < 1 - threshold else ''
+        print(f'> {r["benchmark"]:<20} {r["scale"]:>8} {speedup:>6.2f}x{flag}')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run the benchmark suite')
+    parser.add_argument('--scales', type=int, nargs='+', default=DEFAULT_SCALES)
+    parser.add_argument('--only', nargs='+', choices=BENCHMARKS, default=None,
+                        help='benchmarks to run (default: all)')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', default=None,
+                        help='results file (default: benchmarks/results/<time>.json)')
+    parser.add_argument('--compare', default=None, help='earlier results file to compare to')
+    args = parser.parse_args()
+
+    report = run(args.scales, args.only, args.repeat)
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, datetime.now().strftime('%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Saved results to {output}')
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
@@ -0,0 +1,161 @@
+'''
+Synthetic users matching the UserDict/PostDict schema in loader.py, for
+benchmarking without access to the real raw data. write_raw_data() writes
+them out as raw_data CSV files that loader.load_data can read
+
+    python -m benchmarks.synthetic RAW_DIR [--users N] [--files K]
+'''
+
+import argparse
+import csv
+import json
+import os
+import random
+from base64 import b64encode
+from datetime import datetime, timedelta
+from gzip import compress
+from loader import UserDict
+
+VOTE_TYPES = ("UpMod", "UpMod", "UpMod", "DownMod", "Bookmark",
+              "AcceptedByOriginator", "Close", "Favorite")
+
+TAG_NAMES = ("python", "javascript", "java", "c#", "php", "android", "html",
+             "jquery", "c++", "css", "ios", "sql", "mysql", "r", "reactjs",
+             "node.js", "arrays", "python-3.x", "pandas", "django", "json",
+             "git-merge", "ruby-on-rails", "string", "list", "excel-vba")
+
+WORDS = ("the", "a", "to", "is", "i", "and", "in", "it", "of", "this", "how",
+         "function", "error", "value", "file", "using", "code", "data",
+         "list", "array", "string", "object", "return", "class", "trying",
+         "get", "when", "what", "but", "with", "not", "can't", "doesn't",
+         "I'm", "&quot;hello&quot;", "3.14", "1,000", "v2", "x=0;")
+
+
+def make_body(rng: random.Random, mean_words=120) -> str:
+    '''
+    An HTML post body with paragraphs, links, inline code and code blocks
+    '''
+    paragraphs = []
+    for _ in range(rng.randint(1, 5)):
+        words = [rng.choice(WORDS) for _ in range(int(rng.expovariate(1 / mean_words) / 3) + 3)]
+        if rng.random() < 0.3:
+            words.insert(rng.randrange(len(words)), '<a href="https://example.com/q">this</a>')
+        if rng.random() < 0.4:
+            words.insert(rng.randrange(len(words)), '<code>foo(bar)</code>')
+        paragraphs.append('<p>' + ' '.join(words) + '</p>')
+
+    if rng.random() < 0.5:
+        lines = '\n'.join(f'x{i} = {rng.randint(0, 999)}' for i in range(rng.randint(1, 20)))
+        paragraphs.append(f'<pre><code>{lines}\n</code></pre>')
+
+    return '\n\n'.join(paragraphs)
+
+
+def make_post(rng: random.Random):
+    is_question = rng.random() < 0.6
+    post = {
+        "PostId": rng.randint(1, 70_000_000),
+        "PostType": "Question" if is_question else "Answer",
+        "Body": make_body(rng),
+    }
+
+    if is_question:
+        post["ViewCount"] = int(rng.expovariate(1 / 200))
+
+    if rng.random() < 0.8:
+        types = rng.sample(VOTE_TYPES, rng.randint(1, 4))
+        post["Votes"] = [{"VoteType": t, "Count": rng.randint(1, 5)} for t in types]
+
+    if rng.random() < 0.2:
+        post["Edits"] = [{"EditorId": rng.randint(1, 20_000_000),
+                          "EditorRep": int(rng.expovariate(1 / 5000)) + 1,
+                          "EditorAge": rng.randint(0, 5000)}
+                         for _ in range(rng.randint(1, 2))]
+
+    if is_question and rng.random() < 0.7:
+        post["Answers"] = [{"AnswererId": rng.randint(1, 20_000_000),
+                            "AnswererRep": int(rng.expovariate(1 / 20000)) + 1,
+                            "AnswererAge": rng.randint(0, 5000),
+                            "Body": make_body(rng, mean_words=150),
+                            "IsAcceptedAnswer": int(rng.random() < 0.3),
+                            "Score": rng.randint(-2, 15)}
+                           for _ in range(rng.randint(1, 4))]
+
+    post["Tags"] = [{"TagName": t, "Count": 1}
+                    for t in rng.sample(TAG_NAMES, rng.randint(1, 5))]
+
+    return post
+
+
+def make_user(rng: random.Random, user_id=None) -> UserDict:
+    created = datetime(2015, 1, 1) + timedelta(seconds=rng.randint(0, 5 * 365 * 86400))
+    first_post = max(created, datetime(2020, 1, 1)) + \
+        timedelta(seconds=rng.randint(0, 365 * 86400))
+    return {
+        "UserId": rng.randint(1, 15_000_000) if user_id is None else user_id,
+        "AccountCreationDate": created,
+        "FirstPostDate": first_post,
+        "NumFuturePosts": 0 if rng.random() < 0.7 else int(rng.expovariate(1 / 5)),
+        "Posts": [make_post(rng) for _ in range(min(1 + int(rng.expovariate(1 / 1.5)), 20))],
+    }
+
+
+def make_users(n: int, seed=0):
+    rng = random.Random(seed)
+    return [make_user(rng, user_id=i + 1) for i in range(n)]
+
+
+RAW_COLUMNS = ("UserId", "AccountCreationDate", "FirstPostDate", "NumFuturePosts", "PostsX")
+
+
+def encode_row(user: UserDict) -> list:
+    '''
+    The inverse of loader.parse_row: a raw CSV row with the posts as a
+    base64 encoded, gzipped JSON blob
+    '''
+    return [user["UserId"], str(user["AccountCreationDate"]), str(user["FirstPostDate"]),
+            user["NumFuturePosts"], b64encode(compress(json.dumps(user["Posts"]).encode())).decode()]
+
+
+def write_raw_data(raw_dir: str, num_users: int, num_files=2, duplicate_rate=0.02, seed=0) \
+        -> list:
+    '''
+    Writes num_users rows split over num_files CSV files in raw_dir and
+    returns their filenames. About duplicate_rate of the rows repeat the
+    UserId of an earlier row (possibly in an earlier file) with different
+    data, which load_data is expected to skip
+    '''
+    rng = random.Random(seed)
+    os.makedirs(raw_dir, exist_ok=True)
+
+    filenames = []
+    next_id = 1
+    per_file = -(-num_users // num_files)
+    for k in range(num_files):
+        filename = os.path.join(raw_dir, f'synthetic_{k:03d}.csv')
+        with open(filename, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(RAW_COLUMNS)
+            for _ in range(min(per_file, num_users - k * per_file)):
+                if next_id > 1 and rng.random() < duplicate_rate:
+                    user_id = rng.randint(1, next_id - 1)
+                else:
+                    user_id, next_id = next_id, next_id + 1
+                writer.writerow(encode_row(make_user(rng, user_id)))
+        filenames.append(filename)
+
+    return filenames
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Write synthetic raw data files')
+    parser.add_argument('raw_dir')
+    parser.add_argument('--users', type=int, default=10000, help='number of rows in total')
+    parser.add_argument('--files', type=int, default=2)
+    parser.add_argument('--duplicate-rate', type=float, default=0.02)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    for filename in write_raw_data(args.raw_dir, args.users, args.files, args.duplicate_rate,
+                                   args.seed):
+        print(f'Wrote {filename} ({os.path.getsize(filename) / 2**20:.1f} MB)')
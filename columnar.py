@@ -0,0 +1,489 @@
+'''
+Columnar, memory-mappable cache of the decoded raw data.
+
+Each raw file is converted once into a shard directory of .npy arrays:
+
+    users.*     one entry per row (UserId, dates, NumFuturePosts)
+    posts.*     one entry per post, indexed by users.Posts.offsets
+    Votes.*     one entry per child record, indexed by posts.Votes.offsets
+    Edits.*     (and likewise for Edits, Answers and Tags)
+    Answers.*
+    Tags.*
+
+Strings are stored as a single utf-8 byte buffer plus offsets, and low
+cardinality strings (PostType, VoteType, TagName) as integer codes into
+a table kept in the shard's meta.json. Fields missing from a record are
+flagged in the table's `missing` bitmask, so the original dicts can be
+rebuilt exactly (a null field is treated the same as a missing one).
+'''
+
+import json
+import os
+import shutil
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Iterator, List
+import numpy as np
+from lib.column_writer import ColumnWriter
+from lib.parallel import bounded_map
+from loader import DIR, Projection, UserDict, compile_projection, raw_files, read_file
+
+FORMAT_VERSION = 1
+
+DEFAULT_CACHE_DIR = os.path.join(DIR, 'cache', 'columnar')
+
+INT, DATE, STR, CODE = 'int', 'date', 'str', 'code'
+
+SCHEMA = {
+    "users": (("UserId", INT),
+              ("AccountCreationDate", DATE),
+              ("FirstPostDate", DATE),
+              ("NumFuturePosts", INT)),
+    "posts": (("PostId", INT),
+              ("PostType", CODE),
+              ("Body", STR),
+              ("ViewCount", INT)),
+    "Votes": (("VoteType", CODE),
+              ("Count", INT)),
+    "Edits": (("EditorId", INT),
+              ("EditorRep", INT),
+              ("EditorAge", INT)),
+    "Answers": (("AnswererId", INT),
+                ("AnswererRep", INT),
+                ("AnswererAge", INT),
+                ("Body", STR),
+                ("IsAcceptedAnswer", INT),
+                ("Score", INT)),
+    "Tags": (("TagName", CODE),
+             ("Count", INT)),
+}
+'''
+Fields stored for each table, in the order they appear in the raw data
+'''
+
+CHILDREN = {
+    "users": ("Posts",),
+    "posts": ("Votes", "Edits", "Answers", "Tags"),
+}
+'''
+List-valued fields of each table, along with the table their items are
+stored in
+'''
+
+CHILD_TABLES = {"Posts": "posts", "Votes": "Votes", "Edits": "Edits",
+                "Answers": "Answers", "Tags": "Tags"}
+
+FIELD_BITS = {table: {field: i for i, field in
+                      enumerate([field for field, _ in fields] + list(CHILDREN.get(table, ())))}
+              for table, fields in SCHEMA.items()}
+'''
+Bit of each field (and list-valued field) in a table's missing bitmask
+'''
+
+FIELD_KINDS = {table: dict(fields) for table, fields in SCHEMA.items()}
+
+EPOCH = datetime(1970, 1, 1)
+
+
+#################
+### BUILDING  ###
+#################
+
+
+class _TableBuilder:
+    '''
+    Writes the records of one table to its .npy columns in a shard
+    directory. Values are buffered in lists until flush(), so only the
+    records added since the last flush are held in memory
+    '''
+
+    def __init__(self, table: str, builders: Dict[str, '_TableBuilder'], path: str):
+        self.table = table
+        self.fields = SCHEMA[table]
+        self.children = CHILDREN.get(table, ())
+        self.builders = builders
+        self.length = 0
+
+        self.codes = {field: {} for field, kind in self.fields if kind == CODE}
+        # Ends of the strings and child lists written so far
+        self.string_ends = {field: 0 for field, kind in self.fields if kind == STR}
+        self.child_ends = {child: 0 for child in self.children}
+
+        # Keyed by file name, less the "{table}." prefix
+        self.writers = {}
+
+        def add_writer(name, dtype=np.int64):
+            self.writers[name] = ColumnWriter(path, f'{table}.{name}', dtype)
+
+        add_writer('missing', np.uint16)
+        for field, kind in self.fields:
+            if kind == STR:
+                add_writer(f'{field}.bytes', np.uint8)
+                add_writer(f'{field}.offsets')
+                self.writers[f'{field}.offsets'].append([0])
+            else:
+                add_writer(field, np.int32 if kind == CODE else np.int64)
+        for child in self.children:
+            add_writer(f'{child}.offsets')
+            self.writers[f'{child}.offsets'].append([0])
+
+        self._reset()
+
+    def _reset(self):
+        self.missing = []
+        self.columns = {field: [] for field, kind in self.fields if kind != STR}
+        self.strings = {field: (bytearray(), [])
+                        for field, kind in self.fields if kind == STR}
+        self.offsets = {child: [] for child in self.children}
+
+    def append(self, record: dict):
+        mask = 0
+        for i, (field, kind) in enumerate(self.fields):
+            value = record.get(field)
+            if value is None:
+                mask |= 1 << i
+
+            if kind == STR:
+                data, offsets = self.strings[field]
+                if value is not None:
+                    data += value.encode()
+                offsets.append(self.string_ends[field] + len(data))
+            elif kind == CODE:
+                codes = self.codes[field]
+                if value is None:
+                    self.columns[field].append(-1)
+                else:
+                    self.columns[field].append(codes.setdefault(value, len(codes)))
+            elif kind == DATE:
+                self.columns[field].append(
+                    0 if value is None else (value - EPOCH) // timedelta(microseconds=1))
+            else:
+                self.columns[field].append(0 if value is None else value)
+
+        for j, child in enumerate(self.children):
+            items = record.get(child)
+            if items is None:
+                mask |= 1 << (len(self.fields) + j)
+                items = []
+
+            builder = self.builders[CHILD_TABLES[child]]
+            for item in items:
+                builder.append(item)
+            self.child_ends[child] += len(items)
+            self.offsets[child].append(self.child_ends[child])
+
+        self.missing.append(mask)
+        self.length += 1
+
+    def flush(self):
+        '''
+        Writes out the records added since the last flush
+        '''
+        self.writers['missing'].append(self.missing)
+        for field, values in self.columns.items():
+            self.writers[field].append(values)
+        for field, (data, offsets) in self.strings.items():
+            self.writers[f'{field}.bytes'].append(np.frombuffer(data, dtype=np.uint8))
+            self.writers[f'{field}.offsets'].append(offsets)
+            self.string_ends[field] += len(data)
+        for child, offsets in self.offsets.items():
+            self.writers[f'{child}.offsets'].append(offsets)
+        self._reset()
+
+    def close(self, meta: dict):
+        self.flush()
+        for writer in self.writers.values():
+            writer.close()
+        for field, codes in self.codes.items():
+            meta["codes"][f'{self.table}.{field}'] = list(codes)
+
+
+def build_shard(task, batch_size=10_000):
+    '''
+    Converts a single raw file into a shard directory. Users are written
+    out batch_size at a time, so memory doesn't grow with the file
+    '''
+    filename, path = task
+
+    tmp_path = path + '.tmp'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    builders = {}
+    for table in SCHEMA:
+        builders[table] = _TableBuilder(table, builders, tmp_path)
+
+    for i, user in enumerate(read_file(filename), 1):
+        builders["users"].append(user)
+        if i % batch_size == 0:
+            for builder in builders.values():
+                builder.flush()
+
+    meta = {"version": FORMAT_VERSION, "codes": {},
+            "num_users": builders["users"].length}
+    for builder in builders.values():
+        builder.close(meta)
+
+    with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+    return path
+
+
+def build(cache_dir=DEFAULT_CACHE_DIR, raw_dir=None, workers=1, verbose=True) -> List[str]:
+    '''
+    Brings the cache up to date with the raw data, only converting raw
+    files that are new or whose size or mtime changed since the last
+    build, and dropping shards of raw files that no longer exist.
+    Returns the shard directories in load order
+    '''
+    manifest_path = os.path.join(cache_dir, 'manifest.json')
+    old_entries = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if manifest["version"] == FORMAT_VERSION:
+            old_entries = {entry["file"]: entry for entry in manifest["files"]}
+
+    shard_dir = os.path.join(cache_dir, 'shards')
+    os.makedirs(shard_dir, exist_ok=True)
+
+    entries, stale = [], []
+    for filename in raw_files(raw_dir):
+        stat = os.stat(filename)
+        entry = {"file": os.path.basename(filename),
+                 "size": stat.st_size,
+                 "mtime_ns": stat.st_mtime_ns}
+        path = os.path.join(shard_dir, entry["file"])
+        if old_entries.get(entry["file"]) != entry or not os.path.exists(path):
+            stale.append((filename, path))
+        entries.append(entry)
+
+    if verbose and stale:
+        print(f'Converting {len(stale)} of {len(entries)} raw files to columnar format...')
+
+    if workers == 1:
+        for task in stale:
+            build_shard(task)
+    else:
+        for _ in bounded_map(build_shard, stale, workers=workers, ordered=False):
+            pass
+
+    live = set(entry["file"] for entry in entries)
+    for name in os.listdir(shard_dir):
+        if name not in live:
+            shutil.rmtree(os.path.join(shard_dir, name), ignore_errors=True)
+
+    with open(manifest_path + '.tmp', 'w') as f:
+        json.dump({"version": FORMAT_VERSION, "files": entries}, f, indent=2)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+    if verbose and stale:
+        print('> Done!')
+
+    return [os.path.join(shard_dir, entry["file"]) for entry in entries]
+
+
+###############
+### READING ###
+###############
+
+
+class Shard:
+    '''
+    Read-only view over one shard, whose arrays are memory-mapped on
+    first access (e.g. shard["posts.ViewCount"])
+    '''
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self._arrays = {}
+
+    def __len__(self):
+        return self.meta["num_users"]
+
+    def __getitem__(self, key: str) -> np.ndarray:
+        if key not in self._arrays:
+            filename = os.path.join(self.path, key + '.npy')
+            try:
+                self._arrays[key] = np.load(filename, mmap_mode='r')
+            except ValueError:
+                # Empty arrays can't be memory-mapped
+                self._arrays[key] = np.load(filename)
+        return self._arrays[key]
+
+    def records(self, table: str, start: int, stop: int,
+                projection: Projection = None) -> List[dict]:
+        '''
+        Rebuilds the dicts for records [start, stop) of a table, including
+        all of their children. With a projection (see
+        loader.compile_projection), only the fields in it are read
+        '''
+        bits = FIELD_BITS[table]
+        fields = [(field, kind) for field, kind in SCHEMA[table]
+                  if projection is None or field in projection]
+        children = [child for child in CHILDREN.get(table, ())
+                    if projection is None or child in projection]
+        missing = self[f'{table}.missing'][start:stop].tolist()
+
+        columns = []
+        for field, kind in fields:
+            key = f'{table}.{field}'
+            if kind == STR:
+                offsets = self[f'{key}.offsets'][start:stop + 1]
+                data = bytes(self[f'{key}.bytes'][offsets[0]:offsets[-1]])
+                offsets = (offsets - offsets[0]).tolist()
+                values = [data[a:b].decode() for a, b in zip(offsets, offsets[1:])]
+            elif kind == CODE:
+                strings = self.meta["codes"][key]
+                values = [strings[code] for code in self[key][start:stop].tolist()]
+            elif kind == DATE:
+                values = [EPOCH + timedelta(microseconds=v)
+                          for v in self[key][start:stop].tolist()]
+            else:
+                values = self[key][start:stop].tolist()
+            columns.append(values)
+
+        child_values = []
+        for child in children:
+            offsets = self[f'{table}.{child}.offsets'][start:stop + 1].tolist()
+            items = self.records(CHILD_TABLES[child], offsets[0], offsets[-1],
+                                 projection and projection[child])
+            child_values.append([items[a - offsets[0]:b - offsets[0]]
+                                 for a, b in zip(offsets, offsets[1:])])
+
+        records = []
+        for j, mask in enumerate(missing):
+            record = {}
+            for i, (field, _) in enumerate(fields):
+                if not mask >> bits[field] & 1:
+                    record[field] = columns[i][j]
+            for i, child in enumerate(children):
+                if not mask >> bits[child] & 1:
+                    record[child] = child_values[i][j]
+            records.append(record)
+
+        return records
+
+    def users(self, block_size=10000, fields: Iterable[str] = None) -> Iterator[UserDict]:
+        '''
+        Yields every user, with posts keeping only the given fields (see
+        loader.load_data). Columns of dropped fields are never read
+        '''
+        projection = None
+        if fields is not None:
+            projection = {field: None for field, _ in SCHEMA["users"]}
+            projection["Posts"] = compile_projection(fields)
+
+        for start in range(0, len(self), block_size):
+            yield from self.records("users", start, min(start + block_size, len(self)),
+                                    projection)
+
+    def value(self, table: str, field: str, index: int):
+        '''
+        Decodes a single field of one record, raising KeyError if the
+        record doesn't have it. List-valued fields come back as lists of
+        RecordViews
+        '''
+        bit = FIELD_BITS[table].get(field)
+        if bit is None or self[f'{table}.missing'][index] >> bit & 1:
+            raise KeyError(field)
+
+        key = f'{table}.{field}'
+        if field in CHILD_TABLES:
+            start, stop = self[f'{key}.offsets'][index:index + 2].tolist()
+            return [RecordView(self, CHILD_TABLES[field], i) for i in range(start, stop)]
+
+        kind = FIELD_KINDS[table][field]
+        if kind == STR:
+            start, stop = self[f'{key}.offsets'][index:index + 2].tolist()
+            return bytes(self[f'{key}.bytes'][start:stop]).decode()
+        if kind == CODE:
+            return self.meta["codes"][key][self[key][index]]
+        if kind == DATE:
+            return EPOCH + timedelta(microseconds=int(self[key][index]))
+        return int(self[key][index])
+
+    def views(self) -> Iterator['RecordView']:
+        '''
+        Lazily yields a view of each user, which decodes only the fields
+        that are actually read
+        '''
+        for i in range(len(self)):
+            yield RecordView(self, "users", i)
+
+
+class RecordView:
+    '''
+    Read-only, dict-like view of one record of a shard's table, so that
+    features.User/Post/Answer can read straight from the memory-mapped
+    arrays without rebuilding the dicts
+    '''
+
+    __slots__ = ("shard", "table", "index")
+
+    def __init__(self, shard: Shard, table: str, index: int):
+        self.shard = shard
+        self.table = table
+        self.index = index
+
+    def __getitem__(self, field: str):
+        return self.shard.value(self.table, field, self.index)
+
+    def __contains__(self, field: str) -> bool:
+        bit = FIELD_BITS[self.table].get(field)
+        return bit is not None and \
+            not self.shard[f'{self.table}.missing'][self.index] >> bit & 1
+
+    def get(self, field: str, default=None):
+        return self[field] if field in self else default
+
+    def to_dict(self) -> dict:
+        return self.shard.records(self.table, self.index, self.index + 1)[0]
+
+
+def dedup_masks(shards: List[Shard]) -> List[np.ndarray]:
+    '''
+    For each shard, a boolean mask of the users to keep so that the first
+    occurrence of each UserId wins, as in loader.load_data
+    '''
+    user_ids = np.concatenate([shard["users.UserId"] for shard in shards] or [[]])
+    keep = np.zeros(len(user_ids), dtype=bool)
+    keep[np.unique(user_ids, return_index=True)[1]] = True
+
+    bounds = np.cumsum([0] + [len(shard) for shard in shards])
+    return [keep[a:b] for a, b in zip(bounds, bounds[1:])]
+
+
+def load_columns(cache_dir=DEFAULT_CACHE_DIR, raw_dir=None, update=True, workers=1,
+                 verbose=True) -> List[Shard]:
+    '''
+    Returns the shards of the cache for bulk access to the arrays,
+    converting any new or changed raw files first (unless update=False).
+    Use dedup_masks() to drop duplicate users
+    '''
+    if update:
+        paths = build(cache_dir, raw_dir, workers=workers, verbose=verbose)
+    else:
+        with open(os.path.join(cache_dir, 'manifest.json')) as f:
+            paths = [os.path.join(cache_dir, 'shards', entry["file"])
+                     for entry in json.load(f)["files"]]
+
+    return [Shard(path) for path in paths]
+
+
+def load_data(cache_dir=DEFAULT_CACHE_DIR, raw_dir=None, update=True, workers=1,
+              verbose=True, fields: Iterable[str] = None) -> Iterator[UserDict]:
+    '''
+    Drop-in replacement for loader.load_data that reads from the columnar
+    cache instead of decoding the raw files
+    '''
+    shards = load_columns(cache_dir, raw_dir, update, workers, verbose)
+    for shard, keep in zip(shards, dedup_masks(shards)):
+        keep = keep.tolist()
+        for i, user in enumerate(shard.users(fields=fields)):
+            if keep[i]:
+                yield user
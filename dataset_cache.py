@@ -0,0 +1,261 @@
+'''
+Typed, incremental binary cache of the vectorized dataset.
+
+The cache holds one shard per raw data file, with a UserId.npy array and
+one float64 .npy array per feature column. Each shard's meta.json records
+the size and mtime of its raw file and a fingerprint of every column's
+feature definition, so on the next run only shards of changed raw files
+are re-vectorized, and only the columns whose definition changed (or
+that are new) are recomputed for the rest.
+'''
+
+import inspect
+import json
+import os
+import shutil
+from hashlib import sha1
+from itertools import islice
+from typing import Dict, Iterator, List, Sequence
+import numpy as np
+import pandas as pd
+from features import FEATURES, vectorize_users
+from lib import instrument
+from lib.column_writer import ColumnWriter
+from loader import UserDict, raw_files, read_file
+
+FORMAT_VERSION = 1
+
+_fingerprints = {}
+
+
+def column_fingerprint(column: str) -> str:
+    '''
+    Hash of the source code of a feature column and of the helpers it is
+    registered as depending on, so that changing or adding one feature
+    leaves the cached columns of the others valid
+    '''
+    if column not in _fingerprints:
+        h = sha1()
+        for source in FEATURES[column].sources():
+            h.update(inspect.getsource(source).encode())
+        _fingerprints[column] = h.hexdigest()
+    return _fingerprints[column]
+
+
+def vectorize_columns(user_dicts: List[UserDict], columns: Sequence[str]) -> Dict[str, np.ndarray]:
+    '''
+    Computes only the given feature columns, with nan for None
+    '''
+    data = vectorize_users(user_dicts, columns)
+    return {column: np.ascontiguousarray(data[:, j]) for j, column in enumerate(columns)}
+
+
+def update_shard(filename: str, path: str, columns: Sequence[str], force=False,
+                 verbose=True, batch_size=10_000) -> bool:
+    '''
+    Brings the shard of one raw file up to date, returns whether it had
+    to be (partly) recomputed. The raw file is read and vectorized
+    batch_size users at a time, so only one batch is ever in memory
+    '''
+    stat = os.stat(filename)
+    meta_path = os.path.join(path, 'meta.json')
+
+    meta = None
+    if os.path.exists(meta_path) and not force:
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if (meta["version"], meta["size"], meta["mtime_ns"]) != \
+                (FORMAT_VERSION, stat.st_size, stat.st_mtime_ns):
+            meta = None
+
+    if meta is None:
+        shutil.rmtree(path, ignore_errors=True)
+        meta = {"version": FORMAT_VERSION, "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns, "columns": {}}
+
+    stale = [column for column in columns
+             if meta["columns"].get(column) != column_fingerprint(column)]
+    if not stale:
+        return False
+
+    if verbose:
+        print(f'> Vectorizing {len(stale)} column(s) of {os.path.basename(filename)}...')
+
+    os.makedirs(path, exist_ok=True)
+    writers = {column: ColumnWriter(path, column) for column in stale}
+    if not meta["columns"]:
+        writers['UserId'] = ColumnWriter(path, 'UserId', np.int64)
+
+    users = read_file(filename)
+    while True:
+        with instrument.timer('dataset_cache.load'):
+            user_dicts = list(islice(users, batch_size))
+        if not user_dicts:
+            break
+
+        with instrument.timer('vectorize.features'):
+            vectors = vectorize_columns(user_dicts, stale)
+        instrument.count('vectorize.users', len(user_dicts))
+
+        if 'UserId' in writers:
+            writers['UserId'].append(np.asarray([u["UserId"] for u in user_dicts]))
+        for column, values in vectors.items():
+            writers[column].append(values)
+
+    for writer in writers.values():
+        writer.close()
+    for column in stale:
+        meta["columns"][column] = column_fingerprint(column)
+
+    with open(meta_path + '.tmp', 'w') as f:
+        json.dump(meta, f, indent=2)
+    os.replace(meta_path + '.tmp', meta_path)
+    return True
+
+
+def update_dataset(cache_dir: str, columns: Sequence[str], raw_dir=None, force_recompute=False,
+                   verbose=True) -> List[str]:
+    '''
+    Brings the shard of every raw file up to date, removes shards of raw
+    files that are gone, and returns the shard directories in raw file order
+
+    If there are no raw files at all (e.g. raw_data/ isn't on this
+    machine), the cached shards are used as they are and nothing is
+    removed, as long as they hold up-to-date versions of the columns
+    '''
+    shard_dir = os.path.join(cache_dir, 'shards')
+    os.makedirs(shard_dir, exist_ok=True)
+
+    filenames = raw_files(raw_dir)
+    if not filenames:
+        return cached_shards(shard_dir, columns, verbose)
+
+    paths = []
+    for filename in filenames:
+        path = os.path.join(shard_dir, os.path.basename(filename))
+        update_shard(filename, path, columns, force=force_recompute, verbose=verbose)
+        paths.append(path)
+
+    live = set(os.path.basename(path) for path in paths)
+    for name in os.listdir(shard_dir):
+        if name not in live:
+            shutil.rmtree(os.path.join(shard_dir, name), ignore_errors=True)
+
+    return paths
+
+
+def cached_shards(shard_dir: str, columns: Sequence[str], verbose=True) -> List[str]:
+    '''
+    The shards in shard_dir (sorted by name), checking that each has an
+    up-to-date version of every column, since they can't be recomputed
+    without the raw files
+    '''
+    paths = sorted(os.path.join(shard_dir, name) for name in os.listdir(shard_dir))
+    if not paths:
+        raise FileNotFoundError(f'No raw data files and no cached shards in {shard_dir}')
+
+    for path in paths:
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        stale = [column for column in columns
+                 if meta["columns"].get(column) != column_fingerprint(column)]
+        if meta["version"] != FORMAT_VERSION or stale:
+            raise FileNotFoundError(f'No raw data files to recompute {path} '
+                                    f'(stale or missing: {", ".join(stale) or "all"})')
+
+    if verbose:
+        print(f'> No raw data files found, using the {len(paths)} cached shard(s) as they are')
+
+    return paths
+
+
+def first_occurrences(paths: Sequence[str]) -> List[np.ndarray]:
+    '''
+    For each shard, a mask of the rows whose UserId wasn't seen earlier
+    in that shard or in an earlier one
+    '''
+    user_ids = [np.load(os.path.join(path, 'UserId.npy'), mmap_mode='r') for path in paths]
+    keep = np.zeros(sum(map(len, user_ids)), dtype=bool)
+    if len(keep):
+        keep[np.unique(np.concatenate(user_ids), return_index=True)[1]] = True
+    return np.split(keep, np.cumsum(list(map(len, user_ids)))[:-1])
+
+
+def load_dataset(cache_dir: str, columns: Sequence[str], raw_dir=None, force_recompute=False,
+                 verbose=True) -> pd.DataFrame:
+    '''
+    Loads the given feature columns for every user (first occurrence of
+    each UserId wins, as in loader.load_data), indexed by UserId, after
+    updating whatever part of the cache is out of date
+    '''
+    if verbose:
+        print(f'Loading dataset from {cache_dir}...')
+
+    paths = update_dataset(cache_dir, columns, raw_dir, force_recompute, verbose)
+
+    def load(name):
+        return np.concatenate([np.load(os.path.join(path, name + '.npy')) for path in paths]
+                              or [np.zeros(0)])
+
+    keep = np.concatenate(first_occurrences(paths) or [np.zeros(0, dtype=bool)])
+    user_ids = load('UserId').astype(np.int64)
+
+    dataset = pd.DataFrame({column: load(column)[keep] for column in columns},
+                           index=pd.Index(user_ids[keep], name='UserId'), columns=list(columns))
+
+    if verbose:
+        print(f'> Done! Loaded {dataset.shape[0]} data points!')
+
+    return dataset
+
+
+class ShardedDataset:
+    '''
+    The cached feature columns of every user (first occurrence of each
+    UserId), read chunk_size rows at a time from memory-mapped shards, so
+    a pass over the dataset never holds more than one chunk of it. Only
+    the UserIds of all rows (8 bytes per row) are read at once, to find
+    the duplicates
+    '''
+
+    def __init__(self, paths: Sequence[str], columns: Sequence[str]):
+        self.paths = list(paths)
+        self.columns = list(columns)
+        self.keep = first_occurrences(self.paths)
+
+    def __len__(self):
+        return int(sum(keep.sum() for keep in self.keep))
+
+    def chunks(self, columns: Sequence[str] = None, chunk_size=100_000) -> Iterator[np.ndarray]:
+        '''
+        Yields (rows, len(columns)) float64 arrays of the given columns
+        (default: all of them), in cache order
+        '''
+        columns = list(columns or self.columns)
+        for path, keep in zip(self.paths, self.keep):
+            arrays = [np.load(os.path.join(path, column + '.npy'), mmap_mode='r')
+                      for column in columns]
+            for start in range(0, len(keep), chunk_size):
+                rows = keep[start:start + chunk_size]
+                chunk = np.empty((int(rows.sum()), len(columns)))
+                for j, array in enumerate(arrays):
+                    chunk[:, j] = array[start:start + chunk_size][rows]
+                yield chunk
+
+
+def open_dataset(cache_dir: str, columns: Sequence[str], raw_dir=None, force_recompute=False,
+                 verbose=True) -> ShardedDataset:
+    '''
+    Like load_dataset, but returns a ShardedDataset to stream the columns
+    through in chunks instead of loading them
+    '''
+    if verbose:
+        print(f'Opening dataset in {cache_dir}...')
+
+    dataset = ShardedDataset(update_dataset(cache_dir, columns, raw_dir, force_recompute, verbose),
+                             columns)
+
+    if verbose:
+        print(f'> Done! Found {len(dataset)} data points!')
+
+    return dataset
@@ -0,0 +1,209 @@
+'''
+Sparse document-term matrices of post and answer bodies, for use as text
+features alongside analysis2.user_to_vec.
+
+Rows are built incrementally from the load_data() generator, and
+compacted every chunk_size rows, so memory is bounded by the number of
+non-zero entries. Built from load_data() in its default order, rows line
+up one-to-one with the rows of analysis2.prepare_dataset(), and the
+UserId of every row is saved alongside the matrix to check this.
+'''
+
+import argparse
+import os
+from itertools import tee
+from typing import Dict, Iterable, List, Tuple
+from zlib import crc32
+import numpy as np
+import scipy.sparse as sp
+from features import tokenize_many
+from lib import instrument
+from loader import UserDict, load_data
+
+UNITS = ("user", "post")
+SOURCES = ("posts", "answers", "both")
+
+
+class DocumentTermMatrixBuilder:
+    '''
+    Accumulates rows of token counts into CSR arrays.
+
+    With n_features set, tokens are hashed (crc32, so columns are the
+    same in every process and run) into that many columns. Otherwise a
+    vocabulary is grown as tokens are seen and pruned in finish() to
+    terms occurring in at least min_df rows, keeping the max_features
+    most frequent
+    '''
+
+    def __init__(self, n_features=None, min_df=1, max_features=None):
+        self.n_features = n_features
+        self.min_df = min_df
+        self.max_features = max_features
+
+        self.columns: Dict[str, int] = {}
+        self.terms: List[str] = []
+
+        self._indptr = [0]
+        self._indices = []
+        self._data = []
+        self._chunk_indices, self._chunk_data = [], []
+
+    def column(self, token: str) -> int:
+        col = self.columns.get(token)
+        if col is None:
+            if self.n_features:
+                col = crc32(token.encode()) % self.n_features
+            else:
+                col = len(self.terms)
+                self.terms.append(token)
+            self.columns[token] = col
+        return col
+
+    def add_row(self, tokens: Iterable[str]):
+        counts: Dict[int, int] = {}
+        columns = self.columns
+        for token in tokens:
+            col = columns[token] if token in columns else self.column(token)
+            counts[col] = counts.get(col, 0) + 1
+
+        cols = sorted(counts)
+        self._chunk_indices.extend(cols)
+        self._chunk_data.extend(counts[col] for col in cols)
+        self._indptr.append(self._indptr[-1] + len(cols))
+
+    def end_chunk(self):
+        '''
+        Moves the rows added since the last chunk into compact arrays
+        '''
+        if self._chunk_indices:
+            self._indices.append(np.asarray(self._chunk_indices, dtype=np.int32))
+            self._data.append(np.asarray(self._chunk_data, dtype=np.int32))
+            self._chunk_indices, self._chunk_data = [], []
+
+    def finish(self) -> sp.csr_matrix:
+        self.end_chunk()
+        indices = np.concatenate(self._indices or [np.zeros(0, dtype=np.int32)])
+        data = np.concatenate(self._data or [np.zeros(0, dtype=np.int32)])
+        indptr = np.asarray(self._indptr, dtype=np.int64)
+
+        n_cols = self.n_features or len(self.terms)
+        matrix = sp.csr_matrix((data, indices, indptr), shape=(len(indptr) - 1, n_cols))
+
+        if self.n_features:
+            return matrix
+
+        df = np.bincount(indices, minlength=n_cols)
+        keep = np.flatnonzero(df >= self.min_df)
+        if self.max_features is not None and len(keep) > self.max_features:
+            keep = np.sort(keep[np.argsort(-df[keep], kind='stable')[:self.max_features]])
+
+        self.terms = [self.terms[col] for col in keep]
+        return matrix[:, keep]
+
+
+def _documents(user_data: Iterable[UserDict], unit: str, source: str):
+    '''
+    Yields (user_id, post_id, bodies) for each row of the matrix
+    '''
+    for raw_data in user_data:
+        user_id = raw_data["UserId"]
+        rows = []
+        for post in raw_data["Posts"]:
+            bodies = []
+            if source in ("posts", "both"):
+                bodies.append(post["Body"])
+            if source in ("answers", "both"):
+                bodies.extend(answer["Body"] for answer in post.get("Answers", []))
+            rows.append((user_id, post.get("PostId", -1), bodies))
+
+        if unit == "post":
+            yield from rows
+        else:
+            yield user_id, -1, [body for _, _, bodies in rows for body in bodies]
+
+
+def build_dtm(user_data: Iterable[UserDict], unit="user", source="posts", n_features=2**20,
+              min_df=1, max_features=None, chunk_size=10000, workers=None) \
+        -> Tuple[sp.csr_matrix, dict]:
+    '''
+    Builds a document-term matrix with one row per user (or per post,
+    for unit="post") over the bodies of the user's own posts, of the
+    answers they received, or both. Set n_features=None to use a pruned
+    vocabulary instead of hashing.
+
+    Returns the matrix and a dict of row/column metadata: row_user_ids,
+    row_post_ids and, if not hashed, terms
+    '''
+    if unit not in UNITS or source not in SOURCES:
+        raise ValueError(f'unit must be one of {UNITS} and source one of {SOURCES}')
+
+    builder = DocumentTermMatrixBuilder(n_features, min_df, max_features)
+    user_ids, post_ids = [], []
+
+    # One tokenizer stream over every body, so the worker pool is started
+    # once and keeps working ahead while rows are being counted. tee only
+    # buffers the rows whose bodies the pool has read ahead
+    rows, docs = tee(_documents(user_data, unit, source))
+    bodies = (body for _, _, row_bodies in docs for body in row_bodies)
+    tokens = instrument.timed_iter('tokenize', tokenize_many(bodies, workers=workers))
+
+    for i, (user_id, post_id, row_bodies) in enumerate(rows, 1):
+        builder.add_row(token for _ in row_bodies for token in next(tokens))
+        user_ids.append(user_id)
+        post_ids.append(post_id)
+        if i % chunk_size == 0:
+            builder.end_chunk()
+
+    matrix = builder.finish()
+    meta = {"row_user_ids": np.asarray(user_ids, dtype=np.int64),
+            "row_post_ids": np.asarray(post_ids, dtype=np.int64)}
+    if not n_features:
+        meta["terms"] = np.asarray(builder.terms, dtype=str)
+
+    return matrix, meta
+
+
+def save_dtm(filename: str, matrix: sp.csr_matrix, meta: dict):
+    '''
+    Saves the matrix in the same .npz layout as scipy.sparse.save_npz (so
+    scipy.sparse.load_npz can read it) with the metadata arrays added
+    '''
+    np.savez_compressed(filename, format=np.array('csr'), shape=np.array(matrix.shape),
+                        data=matrix.data, indices=matrix.indices, indptr=matrix.indptr,
+                        **meta)
+
+
+def load_dtm(filename: str) -> Tuple[sp.csr_matrix, dict]:
+    with np.load(filename) as f:
+        matrix = sp.csr_matrix((f["data"], f["indices"], f["indptr"]), shape=tuple(f["shape"]))
+        meta = {key: f[key] for key in f.files
+                if key not in ("format", "shape", "data", "indices", "indptr")}
+    return matrix, meta
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Build a document-term matrix of post bodies')
+    parser.add_argument('filename', nargs='?', default='cache/dtm.npz')
+    parser.add_argument('--unit', choices=UNITS, default='user')
+    parser.add_argument('--source', choices=SOURCES, default='posts')
+    parser.add_argument('--n-features', type=int, default=2**20,
+                        help='number of hashed columns, or 0 to use a vocabulary')
+    parser.add_argument('--min-df', type=int, default=5, help='(vocabulary only)')
+    parser.add_argument('--max-features', type=int, default=None, help='(vocabulary only)')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--profile', choices=instrument.MODES, default=None,
+                        help='time each stage (and cProfile the run) and print a JSON summary')
+    args = parser.parse_args()
+
+    if args.profile:
+        instrument.enable(args.profile)
+
+    user_data = load_data(fields=["PostId", "Body", "Answers.Body"])
+    matrix, meta = build_dtm(user_data, args.unit, args.source, args.n_features or None,
+                             args.min_df, args.max_features, workers=args.workers)
+    os.makedirs(os.path.dirname(args.filename) or '.', exist_ok=True)
+    save_dtm(args.filename, matrix, meta)
+    print(f'Saved {matrix.shape[0]} x {matrix.shape[1]} matrix '
+          f'with {matrix.nnz} non-zeros to {args.filename}')
+
+    instrument.report()
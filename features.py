@@ -1,17 +1,122 @@
-from typing import List
+from itertools import islice
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
+import numpy as np
+import scipy.sparse as sp
+from lib.parallel import bounded_map
 from loader import AnswerDict, PostDict, TagDict, UserDict
 import re
 from nltk.corpus import stopwords
 from datetime import date
 
 
+class Feature:
+    '''
+    A registered feature column, computed by a User.f_* property
+    '''
+
+    __slots__ = ("name", "fget", "deps")
+
+    def __init__(self, name: str, fget: Callable, deps: Tuple[str, ...]):
+        self.name = name
+        self.fget = fget
+        self.deps = deps
+
+    def sources(self) -> List[Callable]:
+        '''
+        All the code this feature's value depends on
+        '''
+        return [self.fget] + [helper for dep in self.deps for helper in HELPERS[dep]] \
+            + list(COMMON_HELPERS)
+
+
+FEATURES: Dict[str, Feature] = {}
+'''
+Every feature column, by name (the f_* property name without the f_),
+in definition order
+'''
+
+
+def feature(*deps: str):
+    '''
+    Decorator that turns a User.f_* method into a property and registers
+    it as a feature column. deps names the helper aggregates (see
+    HELPERS) the feature reads, besides the user's scalar fields
+    '''
+    def register(fget):
+        name = fget.__name__[len('f_'):]
+        FEATURES[name] = Feature(name, fget, deps)
+        return property(fget)
+
+    return register
+
+
 class User:
     def __init__(self, user_dict: UserDict):
+        '''
+        The properties below read their counts and sums from per-helper
+        aggregates (see HELPERS), each collected in a single pass over the
+        posts the first time it is needed, so a user only pays for the
+        helpers its features use
+        '''
         self.raw_data = user_dict
+        self._posts = None
+        self._posts_agg = self._edits_agg = self._votes_agg = self._answers_agg = None
 
     @property
-    def Posts(self):
-        return [Post(p) for p in self.raw_data["Posts"]]
+    def posts_agg(self) -> 'PostsAggregate':
+        if self._posts_agg is None:
+            self._posts_agg = PostsAggregate(self.raw_data)
+        return self._posts_agg
+
+    @property
+    def edits_agg(self) -> 'EditsAggregate':
+        if self._edits_agg is None:
+            self._edits_agg = EditsAggregate(self.raw_data)
+        return self._edits_agg
+
+    @property
+    def votes_agg(self) -> 'VotesAggregate':
+        if self._votes_agg is None:
+            self._votes_agg = VotesAggregate(self.raw_data)
+        return self._votes_agg
+
+    @property
+    def answers_agg(self) -> 'AnswersAggregate':
+        if self._answers_agg is None:
+            self._answers_agg = AnswersAggregate(self.raw_data)
+        return self._answers_agg
+
+    @property
+    def Posts(self) -> List['Post']:
+        '''
+        Views of the user's posts, built on first access and then shared
+        '''
+        if self._posts is None:
+            self._posts = [Post(p) for p in self.raw_data["Posts"]]
+        return self._posts
+
+    def iter_posts(self) -> Iterator['Post']:
+        '''
+        Lazily yields views of the user's posts, without building the
+        Posts list if it hasn't been already
+        '''
+        if self._posts is not None:
+            return iter(self._posts)
+        return map(Post, self.raw_data["Posts"])
+
+    def iter_answers(self) -> Iterator['Answer']:
+        '''
+        Lazily yields views of the answers to the user's posts, in the
+        same order as get_answers_by_others
+        '''
+        if self._posts is not None:
+            for post in self._posts:
+                yield from post.iter_answers()
+            return
+
+        for post in self.raw_data["Posts"]:
+            if "Answers" in post:
+                yield from map(Answer, post["Answers"])
 
     ##################################
     ### BACKWARD-COMPATIBLE FIELDS ###
@@ -19,35 +124,29 @@ class User:
 
     @property
     def AvgEditorRep(self):
-        return maybe_avg([edit["EditorRep"]
-                          for edit in self.get_edits()])
+        return maybe_div(self.edits_agg.editor_rep, self.edits_agg.num_edits)
 
     @property
     def AvgTopAnswererRep(self):
-        return maybe_avg([answer["AnswererRep"]
-                          for answer in self.get_top_answers()])
+        return maybe_div(self.answers_agg.top_answerer_rep,
+                         len(self.answers_agg.top_answers))
 
     @property
     def AvgEditorAge(self):
-        return maybe_avg([edit["EditorAge"]
-                          for edit in self.get_edits()])
+        return maybe_div(self.edits_agg.editor_age, self.edits_agg.num_edits)
 
     @property
     def AvgTopAnswererAge(self):
-        return maybe_avg([answer["AnswererAge"]
-                          for answer in self.get_top_answers()])
+        return maybe_div(self.answers_agg.top_answerer_age,
+                         len(self.answers_agg.top_answers))
 
     @property
     def TotalUpVotes(self):
-        return len([vote
-                    for vote in self.get_votes()
-                    if vote["VoteType"] == "UpMod"])
+        return self.votes_agg.num_upvotes
 
     @property
     def TotalDownVotes(self):
-        return len([vote
-                    for vote in self.get_votes()
-                    if vote["VoteType"] == "DownMod"])
+        return self.votes_agg.num_downvotes
 
     @property
     def NumInitialPosts(self):
@@ -59,56 +158,42 @@ class User:
 
     @property
     def NumQuestions(self):
-        return len([post
-                    for post in self.raw_data["Posts"]
-                    if post["PostType"] == "Question"])
+        return self.posts_agg.num_questions
 
     @property
     def NumAnswers(self):
-        return len([post
-                    for post in self.raw_data["Posts"]
-                    if post["PostType"] == "Answer"])
+        return self.posts_agg.num_answers
 
     @property
     def TotalAnswersAccepted(self):
-        return len([post
-                    for post in self.raw_data["Posts"]
-                    if post["PostType"] == "Answer"
-                    and has_vote(post, "AcceptedByOriginator")])
+        return self.votes_agg.num_answers_accepted
 
     @property
     def TotalBookmarked(self):
-        return len([post
-                    for post in self.raw_data["Posts"]
-                    if has_vote(post, "Bookmark")])
+        return self.votes_agg.num_posts_bookmarked
 
     @property
     def TotalClosed(self):
-        return len([post
-                    for post in self.raw_data["Posts"]
-                    if has_vote(post, "Close")])
+        return self.votes_agg.num_posts_closed
 
     @property
     def TotalSuggestedEdits(self):
-        return len(self.get_edits())
+        return self.edits_agg.num_edits
 
     @property
     def AvgNumAnswers(self):
-        return maybe_avg([len(post["Answers"])
-                          for post in self.raw_data["Posts"]
-                          if post["PostType"] == "Question" and "Answers" in post])
+        return maybe_div(self.posts_agg.num_answers_to_qs,
+                         self.posts_agg.num_answered_qs)
 
     @property
     def AvgViewCount(self):
-        return maybe_avg([post["ViewCount"]
-                          for post in self.raw_data["Posts"]
-                          if "ViewCount" in post])
+        return maybe_div(self.posts_agg.view_count, self.posts_agg.num_view_counts)
 
     ###########################
     ### FEATURE COMPUTATION ###
     ###########################
 
-    @property
+    @feature()
     def f_age_at_first_post(self):
         '''
         Age of the account at first post (in days)
@@ -117,78 +202,72 @@ class User:
         '''
         return (self.raw_data["FirstPostDate"] - self.raw_data["AccountCreationDate"]).days
 
-    @property
+    @feature("posts")
     def f_num_init_posts(self):
         '''
         Number of initial posts
 
         int x, x > 0
         '''
-        return len(self.raw_data["Posts"])
+        return self.posts_agg.num_posts
 
-    @property
+    @feature("posts")
     def f_prop_qs(self):
         '''
         Proportion of questions in initial posts
 
         real x, 0 <= x <= 1
         '''
-        return sum(1 for post in self.raw_data["Posts"]
-                   if post["PostType"] == "Question") \
-            / self.f_num_init_posts
+        return self.posts_agg.num_questions / self.posts_agg.num_posts
 
-    @property
+    @feature("posts")
     def f_avg_init_post_len(self):
         '''
         Average length of body of initial posts
 
         real x, x > 0
         '''
-        return sum(len(post["Body"])
-                   for post in self.raw_data["Posts"]) \
-            / self.f_num_init_posts
+        if self.posts_agg.body_len is None:
+            raise KeyError("Body")
+        return self.posts_agg.body_len / self.posts_agg.num_posts
 
-    @property
+    @feature("posts", "edits")
     def f_avg_num_edits(self):
         '''
         Average number of edits received on initial posts
 
         real x, x > 0
         '''
-        return sum(len(post["Edits"]) if "Edits" in post else 0
-                   for post in self.raw_data["Posts"]) \
-            / self.f_num_init_posts
+        return self.edits_agg.num_edits / self.posts_agg.num_posts
 
-    @property
+    @feature("edits")
     def f_avg_rep_editors(self):
         '''
         Average reputation of editors
 
         real x, x > 0 or None if no edits received
         '''
-        return maybe_avg([edit["EditorRep"] for edit in self.get_edits()])
+        return maybe_div(self.edits_agg.editor_rep, self.edits_agg.num_edits)
 
-    @property
+    @feature("edits")
     def f_avg_age_editors(self):
         '''
         Average age of editors (in days)
 
         real x, x > 0 or None if no edits received
         '''
-        return maybe_avg([edit["EditorAge"] for edit in self.get_edits()])
+        return maybe_div(self.edits_agg.editor_age, self.edits_agg.num_edits)
 
-    @property
+    @feature("posts")
     def f_avg_num_answers(self):
         '''
         Average number of answers received for each question posted
 
         real x, x > 0 or None if no questions posted
         '''
-        return maybe_avg([len(post["Answers"]) if "Answers" in post else 0
-                          for post in self.raw_data["Posts"]
-                          if post["PostType"] == "Question"])
+        return maybe_div(self.posts_agg.num_answers_to_qs, self.posts_agg.num_questions)
 
-    @property
+    @feature("answers")
     def f_avg_rep_top_answerers(self):
         '''
         Average reputation of author of the user selected answer or
@@ -196,9 +275,10 @@ class User:
 
         real x, x > 0 or None if no questions posted or no answers received
         '''
-        return maybe_avg([answer["AnswererRep"] for answer in self.get_top_answers()])
+        return maybe_div(self.answers_agg.top_answerer_rep,
+                         len(self.answers_agg.top_answers))
 
-    @property
+    @feature("answers")
     def f_avg_age_top_answerers(self):
         '''
         Average age (in days) of author of the user selected answer or
@@ -206,42 +286,37 @@ class User:
 
         real x, x > 0 or None if no questions posted or no answers received
         '''
-        return maybe_avg([answer["AnswererAge"] for answer in self.get_top_answers()])
+        return maybe_div(self.answers_agg.top_answerer_age,
+                         len(self.answers_agg.top_answers))
 
-    @property
+    @feature("posts", "votes")
     def f_avg_num_upvotes(self):
         '''
         Average number of upvotes received per initial post
 
         real x, x > 0
         '''
-        return sum(1 for vote in self.get_votes()
-                   if vote["VoteType"] == "UpMod") \
-            / self.f_num_init_posts
+        return self.votes_agg.num_upvotes / self.posts_agg.num_posts
 
-    @property
+    @feature("posts", "votes")
     def f_avg_num_downvotes(self):
         '''
         Average number of downvotes received per initial post
 
         real x, x > 0
         '''
-        return sum(1 for vote in self.get_votes()
-                   if vote["VoteType"] == "DownMod") \
-            / self.f_num_init_posts
+        return self.votes_agg.num_downvotes / self.posts_agg.num_posts
 
-    @property
+    @feature("posts", "votes")
     def f_avg_num_bookmarkers(self):
         '''
         Average number of people who bookmarked each initial post
 
         real x, x > 0
         '''
-        return sum(1 for vote in self.get_votes()
-                   if vote["VoteType"] == "Bookmark") \
-            / self.f_num_init_posts 
+        return self.votes_agg.num_bookmarkers / self.posts_agg.num_posts
 
-    @property
+    @feature("posts", "votes")
     def f_prop_accepted_answers(self):
         '''
         Proportion of answers (posted by this user) 
@@ -249,11 +324,9 @@ class User:
 
         real x, 0 <= x <= 1 or None if no answers were posted
         '''
-        return maybe_div(sum(1 for vote in self.get_votes()
-                             if vote["VoteType"] == "AcceptedByOriginator"),
-                         self.NumAnswers)
+        return maybe_div(self.votes_agg.num_accepted_votes, self.posts_agg.num_answers)
 
-    @property
+    @feature()
     def f_retention(self):
         '''
         1 if user makes another post after 6mo, 0 otherwise
@@ -265,14 +338,10 @@ class User:
     ########################
 
     def get_edits(self):
-        return [edit
-                for post in self.raw_data["Posts"] if "Edits" in post
-                for edit in post["Edits"]]
+        return self.edits_agg.edits
 
     def get_top_answers(self):
-        return [max(post["Answers"], key=lambda a: (a["IsAcceptedAnswer"], a["Score"]))
-                for post in self.raw_data["Posts"]
-                if "Answers" in post]
+        return self.answers_agg.top_answers
 
     def get_answers_by_others(self):
         return [answer
@@ -281,9 +350,7 @@ class User:
                 for answer in post["Answers"]]
 
     def get_votes(self):
-        return [vote
-                for post in self.raw_data["Posts"] if "Votes" in post
-                for vote in post["Votes"]]
+        return self.votes_agg.votes
 
     def get_tags(self):
         return merge_tag_counts([post["Tags"]
@@ -291,9 +358,185 @@ class User:
                                  if "Tags" in post])
 
 
-class Post:
+class PostsAggregate:
+    '''
+    Counts and sums over the user's posts themselves ("posts" helper)
+    '''
+
+    __slots__ = (
+        "num_posts",
+        "num_questions",
+        "num_answers",
+        "body_len",
+        "view_count",
+        "num_view_counts",
+        "num_answers_to_qs",
+        "num_answered_qs",
+    )
+
+    def __init__(self, user_dict: UserDict):
+        posts = user_dict["Posts"]
+        self.num_posts = len(posts)
+
+        num_questions = num_answers = body_len = 0
+        view_count = num_view_counts = 0
+        num_answers_to_qs = num_answered_qs = 0
+
+        for post in posts:
+            is_question = post["PostType"] == "Question"
+            num_questions += is_question
+            num_answers += post["PostType"] == "Answer"
+            if body_len is not None and "Body" in post:
+                body_len += len(post["Body"])
+            else:
+                # Loaded without bodies (see loader.load_data's fields)
+                body_len = None
+
+            if "ViewCount" in post:
+                view_count += post["ViewCount"]
+                num_view_counts += 1
+
+            if is_question and "Answers" in post:
+                num_answers_to_qs += len(post["Answers"])
+                num_answered_qs += 1
+
+        self.num_questions = num_questions
+        self.num_answers = num_answers
+        self.body_len = body_len
+        self.view_count = view_count
+        self.num_view_counts = num_view_counts
+        self.num_answers_to_qs = num_answers_to_qs
+        self.num_answered_qs = num_answered_qs
+
+
+class EditsAggregate:
+    '''
+    The edits of all the user's posts, with their editors' total
+    reputation and age ("edits" helper)
+    '''
+
+    __slots__ = ("edits", "num_edits", "editor_rep", "editor_age")
+
+    def __init__(self, user_dict: UserDict):
+        edits = []
+        editor_rep = editor_age = 0
+        for post in user_dict["Posts"]:
+            if "Edits" in post:
+                for edit in post["Edits"]:
+                    edits.append(edit)
+                    editor_rep += edit["EditorRep"]
+                    editor_age += edit["EditorAge"]
+
+        self.edits = edits
+        self.num_edits = len(edits)
+        self.editor_rep = editor_rep
+        self.editor_age = editor_age
+
+
+class VotesAggregate:
+    '''
+    The votes on all the user's posts, counted by type, and the number of
+    posts with at least one vote of some types ("votes" helper)
+    '''
+
+    __slots__ = (
+        "votes",
+        "num_upvotes",
+        "num_downvotes",
+        "num_bookmarkers",
+        "num_accepted_votes",
+        "num_answers_accepted",
+        "num_posts_bookmarked",
+        "num_posts_closed",
+    )
+
+    def __init__(self, user_dict: UserDict):
+        votes = []
+        num_upvotes = num_downvotes = num_bookmarkers = num_accepted_votes = 0
+        num_answers_accepted = num_posts_bookmarked = num_posts_closed = 0
+
+        for post in user_dict["Posts"]:
+            if "Votes" not in post:
+                continue
+
+            accepted = bookmarked = closed = False
+            for vote in post["Votes"]:
+                votes.append(vote)
+                vote_type = vote["VoteType"]
+                if vote_type == "UpMod":
+                    num_upvotes += 1
+                elif vote_type == "DownMod":
+                    num_downvotes += 1
+                elif vote_type == "Bookmark":
+                    num_bookmarkers += 1
+                    bookmarked = True
+                elif vote_type == "AcceptedByOriginator":
+                    num_accepted_votes += 1
+                    accepted = True
+                elif vote_type == "Close":
+                    closed = True
+            num_answers_accepted += post["PostType"] == "Answer" and accepted
+            num_posts_bookmarked += bookmarked
+            num_posts_closed += closed
+
+        self.votes = votes
+        self.num_upvotes = num_upvotes
+        self.num_downvotes = num_downvotes
+        self.num_bookmarkers = num_bookmarkers
+        self.num_accepted_votes = num_accepted_votes
+        self.num_answers_accepted = num_answers_accepted
+        self.num_posts_bookmarked = num_posts_bookmarked
+        self.num_posts_closed = num_posts_closed
+
+
+class AnswersAggregate:
+    '''
+    The accepted (or else top scoring) answer of each of the user's posts
+    that has answers, with their authors' total reputation and age
+    ("answers" helper)
+    '''
+
+    __slots__ = ("top_answers", "top_answerer_rep", "top_answerer_age")
+
+    def __init__(self, user_dict: UserDict):
+        top_answers = []
+        top_answerer_rep = top_answerer_age = 0
+        for post in user_dict["Posts"]:
+            if "Answers" in post:
+                top = max(post["Answers"], key=lambda a: (a["IsAcceptedAnswer"], a["Score"]))
+                top_answers.append(top)
+                top_answerer_rep += top["AnswererRep"]
+                top_answerer_age += top["AnswererAge"]
+
+        self.top_answers = top_answers
+        self.top_answerer_rep = top_answerer_rep
+        self.top_answerer_age = top_answerer_age
+
+
+class _View:
+    '''
+    Read-only attribute access (e.g. post.PostType) over a decoded record,
+    which can be a dict or anything with the same item access, such as a
+    columnar.RecordView. Nothing is copied
+    '''
+
+    __slots__ = ("raw_data",)
+
+    def __getattr__(self, name):
+        if name in _View.__slots__:
+            raise AttributeError(name)
+        try:
+            return self.raw_data[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+
+class Post(_View):
+    __slots__ = ("_answers",)
+
     def __init__(self, post_dict: PostDict):
         self.raw_data = post_dict
+        self._answers = None
 
     @property
     def Body(self):
@@ -304,13 +547,21 @@ class Post:
         if self.raw_data["PostType"] != "Question":
             return None
 
-        if "Answers" not in self.raw_data:
-            return []
+        return self._answer_views()
+
+    def iter_answers(self) -> Iterator['Answer']:
+        return iter(self._answer_views())
 
-        return [Answer(answer) for answer in self.raw_data["Answers"]]
+    def _answer_views(self) -> List['Answer']:
+        if self._answers is None:
+            self._answers = [Answer(answer) for answer in self.raw_data["Answers"]] \
+                if "Answers" in self.raw_data else []
+        return self._answers
 
 
-class Answer:
+class Answer(_View):
+    __slots__ = ()
+
     def __init__(self, answer_dict: AnswerDict):
         self.raw_data = answer_dict
 
@@ -345,6 +596,44 @@ def has_vote(post: PostDict, vote_type: str):
     return False
 
 
+HELPERS = {
+    "posts": (PostsAggregate, User.posts_agg.fget),
+    "edits": (EditsAggregate, User.edits_agg.fget, User.get_edits),
+    "votes": (VotesAggregate, User.votes_agg.fget, User.get_votes),
+    "answers": (AnswersAggregate, User.answers_agg.fget, User.get_top_answers),
+}
+'''
+Helper aggregates that features can depend on, with the code computing
+them. Each is collected in its own pass over the posts, the first time
+a feature of the user needs it, and then shared between features. A
+column's cache fingerprint only covers the helpers it declares, so
+changing one (e.g. adding a field to VotesAggregate) leaves the cached
+columns that don't use it valid
+'''
+
+COMMON_HELPERS = (User.NumFuturePosts.fget, maybe_div)
+
+
+def vectorize_users(user_dicts: List[UserDict], columns: Iterable[str], out=None):
+    '''
+    Computes the given feature columns for each user into a float64 array
+    of shape (len(user_dicts), len(columns)), with nan for None. out can
+    be a preallocated array to fill instead
+    '''
+    fgets = [FEATURES[column].fget for column in columns]
+    if out is None:
+        out = np.empty((len(user_dicts), len(fgets)))
+
+    for i, user_dict in enumerate(user_dicts):
+        user = User(user_dict)
+        row = out[i]
+        for j, fget in enumerate(fgets):
+            value = fget(user)
+            row[j] = np.nan if value is None else value
+
+    return out
+
+
 def merge_tag_counts(tag_counts: List[List[TagDict]]) -> List[TagDict]:
     counter = dict()
     for tags in tag_counts:
@@ -364,51 +653,279 @@ def extract_tag_corpus(users: List[User]):
     return corpus
 
 
-def tokenize_body(body: str, remove_stopwords=True, remove_smallwords=True):
-    # Make everything lowercase
-    body = body.lower()
+GENERIC_TAGS = (
+    'python', 'windows', 'latex', 'sql', 'c++', 'javascript', 'java', 'c#',
+    'swift', 'php', 'ruby', 'powerpoint', 'selenium', 'lisp', 'haskell',
+    'perl', 'fortran', 'julia', 'matlab', 'rust', 'scheme', 'ocaml', 'curl',
+    'wolfram', 'docker', 'bracket', 'tensorflow', 'keras', 'pandas', 'node.js',
+    'html', 'css', 'google', 'apache', 'android', 'macos', 'json', 'facebook',
+    'apple', 'django', 'flask', 'numpy', 'scipy', 'jupyter', 'scikit', 'excel',
+    'ubuntu', 'github', 'git-', 'gitlab', 'powershell', 'amazon', 'photoshop', 'kotlin',
+    'maven', 'adobe', 'azure', 'discord', 'xml', 'chromium', 'chrome', 'bootstrap',
+    'twitter',
+    # not sure about this one:
+    'error', 'exception', 'spring', 'angular',
+    'matplotlib', 'plotly', 'visual-studio', 'ios', 'gradle', 'mongo',
+    'string', 'list'
+)
+'''
+Generic tags that more specific tags are merged into: a tag containing
+one of these becomes it, the first one in this order winning
+'''
+
+
+class TagCanonicalizer:
+    '''
+    Maps a raw tag to its canonical name: lowercased, and merged into the
+    first of the rules (substrings, e.g. GENERIC_TAGS) that it contains.
 
-    # Collapse links into single token
-    body = re.sub(r'\<a.*?\>.*?\</a\>', '<a>', body, flags=re.DOTALL)
+    The rules are compiled once into an Aho-Corasick automaton, so each
+    new tag is matched against all of them in a single scan, and results
+    are memoized since the same tags come up over and over
+    '''
 
-    # Collapse code blocks into single token
-    body = re.sub(r'\<code\>.*?\</code\>', '<code>', body, flags=re.DOTALL)
+    def __init__(self, rules: Iterable[str] = GENERIC_TAGS):
+        self.rules = tuple(rules)
+        self._cache: Dict[str, str] = {}
+
+        # goto[state][char] -> state, best[state] = lowest index of a rule
+        # ending at this state (or at any of its suffixes), len(rules) if none
+        self._goto: List[Dict[str, int]] = [{}]
+        self._best = [len(self.rules)]
+        for i, rule in enumerate(self.rules):
+            state = 0
+            for char in rule:
+                if char not in self._goto[state]:
+                    self._goto.append({})
+                    self._best.append(len(self.rules))
+                    self._goto[state][char] = len(self._goto) - 1
+                state = self._goto[state][char]
+            self._best[state] = min(self._best[state], i)
+
+        self._fail = [0] * len(self._goto)
+        queue = list(self._goto[0].values())
+        for state in queue:
+            for char, child in self._goto[state].items():
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fail = self._goto[fail].get(char, 0)
+                self._fail[child] = fail if fail != child else 0
+                self._best[child] = min(self._best[child], self._best[self._fail[child]])
+                queue.append(child)
+
+    def match(self, tag: str) -> int:
+        '''
+        Index of the first rule that is a substring of tag, or -1
+        '''
+        goto, fail, best = self._goto, self._fail, self._best
+        found = len(self.rules)
+        state = 0
+        for char in tag:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if best[state] < found:
+                found = best[state]
+        return found if found < len(self.rules) else -1
+
+    def __call__(self, tag: str) -> str:
+        canonical = self._cache.get(tag)
+        if canonical is None:
+            lowered = tag.lower()
+            i = self.match(lowered)
+            canonical = self.rules[i] if i >= 0 else lowered
+            self._cache[tag] = canonical
+        return canonical
+
+
+class TagIncidence:
+    '''
+    Sparse users x canonical tags matrix with a 1 wherever any post of
+    the user has the tag, along with each row's UserId and NumFuturePosts
+    and each column's tag name
+    '''
 
-    # Remove ending tags
-    body = re.sub(r'\</.*?\>', ' ', body)
+    def __init__(self, matrix: sp.csr_matrix, user_ids: np.ndarray, tags: List[str],
+                 num_future_posts: np.ndarray):
+        self.matrix = matrix
+        self.user_ids = user_ids
+        self.tags = tags
+        self.num_future_posts = num_future_posts
 
-    # Remove any unkown tags
-    known_tags = {'a', 'code'}
-    body = re.sub(r'\<(.*?)\>', lambda m: m.group(0)
-                  if m.group(1) in known_tags else ' ', body)
+    def users_per_tag(self) -> np.ndarray:
+        return np.bincount(self.matrix.indices, minlength=len(self.tags))
 
-    # Replace numbers with special token
-    body = re.sub(r'[,.]?[0-9][0-9,.]*', '<num>', body)
+    def top_tags(self, n: int) -> List[str]:
+        '''
+        The n tags used by the most users
+        '''
+        order = np.argsort(-self.users_per_tag(), kind='stable')[:n]
+        return [self.tags[j] for j in order]
 
-    # Put space around special tokens
-    body = re.sub(r'\<.*?\>', r' \g<0> ', body)
+    def pairs(self) -> Tuple[np.ndarray, np.ndarray]:
+        '''
+        The (row, column) of every entry, row by row
+        '''
+        rows = np.repeat(np.arange(self.matrix.shape[0]), np.diff(self.matrix.indptr))
+        return rows, self.matrix.indices
 
-    # Remove escape sequences
-    body = re.sub(r'&[a-z]+;', '', body)
 
-    # Remove punctuation
-    body = re.sub(r'[\'`"’‘]', '', body)
+def build_tag_incidence(user_data: Iterable[UserDict],
+                        canonicalize: TagCanonicalizer = None) -> TagIncidence:
+    '''
+    Builds the user x tag incidence matrix in one pass over the users
+    (which only need their posts' Tags, see loader.load_data's fields)
+    '''
+    canonicalize = canonicalize or TagCanonicalizer()
+    columns: Dict[str, int] = {}
+    user_ids, num_future_posts, indptr, indices = [], [], [0], []
 
-    # Remove remaining non-alphabetic chars
-    body = re.sub(r'[^a-z\s<>]', ' ', body)
+    for raw_data in user_data:
+        user_tags = {}
+        for post in raw_data["Posts"]:
+            for tag in post.get("Tags", ()):
+                name = canonicalize(tag["TagName"])
+                if name not in user_tags:
+                    user_tags[name] = columns.setdefault(name, len(columns))
 
-    tokens = body.split()
+        indices.extend(sorted(user_tags.values()))
+        indptr.append(len(indices))
+        user_ids.append(raw_data["UserId"])
+        num_future_posts.append(raw_data["NumFuturePosts"])
 
-    if remove_stopwords:
-        _stopwords = stopwords.words('english')
-        tokens = [token for token in tokens if token not in _stopwords]
+    indices = np.asarray(indices, dtype=np.int32)
+    matrix = sp.csr_matrix((np.ones(len(indices), dtype=np.int8), indices,
+                            np.asarray(indptr, dtype=np.int64)),
+                           shape=(len(user_ids), len(columns)))
 
-    if remove_smallwords:
-        tokens = [token for token in tokens if len(token) >= 3]
+    return TagIncidence(matrix, np.asarray(user_ids, dtype=np.int64), list(columns),
+                        np.asarray(num_future_posts, dtype=np.int64))
 
-    # Collapse identical consecutive tokens
-    for i in range(1, len(tokens))[::-1]:
-        if re.match(r'\<.*\>', tokens[i]) and tokens[i] == tokens[i - 1]:
-            del tokens[i]
 
-    return tokens
+class Tokenizer:
+    '''
+    Splits post bodies into tokens. Patterns are compiled and the stopword
+    table is loaded once, when the tokenizer is built, so reuse a single
+    instance (tokenize_body does this for you). Output is identical to
+    the original step-by-step pipeline, step numbers below refer to it
+    '''
+
+    LINK = re.compile(r'\<a.*?\>.*?\</a\>', flags=re.DOTALL)
+    CODE = re.compile(r'\<code\>.*?\</code\>', flags=re.DOTALL)
+    END_TAG = re.compile(r'\</.*?\>')
+    # Any tag other than <a> and <code>
+    UNKNOWN_TAG = re.compile(r'\<(?!(?:a|code)\>).*?\>')
+    NUMBER = re.compile(r'[,.]?[0-9][0-9,.]*')
+    SPECIAL = re.compile(r'\<.*?\>')
+    ESCAPE = re.compile(r'&[a-z]+;')
+    PUNCTUATION = str.maketrans('', '', '\'`"’‘')
+    NON_ALPHA = re.compile(r'[^a-z\s<>]')
+
+    def __init__(self, remove_stopwords=True, remove_smallwords=True):
+        self.stopwords = frozenset(stopwords.words('english')) \
+            if remove_stopwords else frozenset()
+        self.min_len = 3 if remove_smallwords else 0
+
+    def clean(self, body: str) -> str:
+        '''
+        Lowercases the body, collapses links, code and numbers into special
+        tokens and strips everything else that isn't a letter
+        '''
+        # 1. Make everything lowercase
+        body = body.lower()
+
+        # 2. Collapse links into single token
+        body = self.LINK.sub('<a>', body)
+
+        # 3. Collapse code blocks into single token
+        body = self.CODE.sub('<code>', body)
+
+        # 4. Remove ending tags
+        body = self.END_TAG.sub(' ', body)
+
+        # 5. Remove any unkown tags
+        body = self.UNKNOWN_TAG.sub(' ', body)
+
+        # 6. Replace numbers with special token
+        body = self.NUMBER.sub('<num>', body)
+
+        # 7. Put space around special tokens
+        body = self.SPECIAL.sub(r' \g<0> ', body)
+
+        # 8. Remove escape sequences, then 9. punctuation. Removing
+        # punctuation first could create new escape sequences
+        body = self.ESCAPE.sub('', body).translate(self.PUNCTUATION)
+
+        # 10. Remove remaining non-alphabetic chars
+        return self.NON_ALPHA.sub(' ', body)
+
+    def iter_tokens(self, body: str):
+        '''
+        Yields the tokens of body one at a time
+        '''
+        _stopwords = self.stopwords
+        min_len = self.min_len
+
+        prev = None
+        for token in self.clean(body).split():
+            if token in _stopwords or len(token) < min_len:
+                continue
+
+            # Collapse identical consecutive special tokens
+            if token != prev or token[0] != '<' or '>' not in token:
+                yield token
+            prev = token
+
+    def tokenize(self, body: str) -> List[str]:
+        return list(self.iter_tokens(body))
+
+
+_tokenizers = {}
+
+
+def get_tokenizer(remove_stopwords=True, remove_smallwords=True) -> Tokenizer:
+    '''
+    Returns a shared tokenizer with the given settings, building it on
+    first use
+    '''
+    key = (remove_stopwords, remove_smallwords)
+    if key not in _tokenizers:
+        _tokenizers[key] = Tokenizer(remove_stopwords, remove_smallwords)
+    return _tokenizers[key]
+
+
+def tokenize_body(body: str, remove_stopwords=True, remove_smallwords=True):
+    return get_tokenizer(remove_stopwords, remove_smallwords).tokenize(body)
+
+
+def _tokenize_chunk(task):
+    bodies, remove_stopwords, remove_smallwords = task
+    tokenizer = get_tokenizer(remove_stopwords, remove_smallwords)
+    return [tokenizer.tokenize(body) for body in bodies]
+
+
+def _chunks(items: Iterable, size: int):
+    items = iter(items)
+    while chunk := list(islice(items, size)):
+        yield chunk
+
+
+def tokenize_many(bodies: Iterable[str], workers=None, chunksize=256,
+                  remove_stopwords=True, remove_smallwords=True) -> Iterator[List[str]]:
+    '''
+    Yields tokenize_body(body) for each body, in input order, spreading
+    the work over a pool of worker processes (None means one per core).
+    bodies can be any iterator, it is consumed lazily chunksize bodies at
+    a time with only a few chunks per worker in flight
+    '''
+    if workers == 1:
+        tokenizer = get_tokenizer(remove_stopwords, remove_smallwords)
+        for body in bodies:
+            yield tokenizer.tokenize(body)
+        return
+
+    tasks = ((chunk, remove_stopwords, remove_smallwords)
+             for chunk in _chunks(bodies, chunksize))
+    for tokens in bounded_map(_tokenize_chunk, tasks, workers=workers):
+        yield from tokens
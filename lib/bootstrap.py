@@ -0,0 +1,134 @@
+'''
+Repeated class-balanced resampling of a logistic regression: many
+balanced subsamples (or bootstrap resamples) are drawn as row positions,
+fitted with lib.logit in a process pool, and the coefficients aggregated
+into percentile confidence intervals
+
+Each draw gets its own child of one np.random.SeedSequence, so the
+results depend only on the seed, not on the number of workers or the
+order the draws finish in
+'''
+
+from typing import Optional, Sequence
+import numpy as np
+import pandas as pd
+from lib.logit import fit_logit
+from lib.parallel import bounded_map, num_workers
+
+# Set in each worker by _init_worker, so X is sent once per worker rather
+# than once per draw
+_X: Optional[np.ndarray] = None
+_y: Optional[np.ndarray] = None
+_classes: Sequence[np.ndarray] = ()
+_options: dict = {}
+
+
+def _init_worker(X: np.ndarray, y: np.ndarray, options: dict):
+    global _X, _y, _classes, _options
+    _X, _y, _options = X, y, options
+    _classes = [np.flatnonzero(y == label) for label in np.unique(y)]
+
+
+def balanced_draw(classes: Sequence[np.ndarray], rng: np.random.Generator, replace=False) \
+        -> np.ndarray:
+    '''
+    Row positions of m rows from each class, where m is the size of the
+    smallest class. Without replacement this is the same balancing as
+    analysis2.balanced_rows; with replacement it is a stratified bootstrap
+    '''
+    m = min(map(len, classes))
+    return np.concatenate([rng.choice(rows, m, replace=replace) for rows in classes])
+
+
+def _fit_draws(seeds: Sequence[np.random.SeedSequence]) -> np.ndarray:
+    '''
+    Coefficients of the draw of each seed, one row per seed
+    '''
+    params = []
+    for seed in seeds:
+        rows = balanced_draw(_classes, np.random.default_rng(seed), _options["replace"])
+
+        # A resample with replacement is fitted on its distinct rows,
+        # weighted by how many times each was drawn
+        rows, counts = np.unique(rows, return_counts=True)
+        weights = counts if _options["replace"] else None
+
+        result = fit_logit(_X[rows], _y[rows], weights=weights, start=_options["start"],
+                           tol=_options["tol"])
+        params.append(result.params.to_numpy())
+    return np.array(params)
+
+
+class BootstrapResult:
+    '''
+    Coefficients of every draw (one row per draw) with their percentile
+    confidence intervals
+    '''
+
+    def __init__(self, names: Sequence[str], params: np.ndarray):
+        self.draws = pd.DataFrame(params, columns=list(names))
+
+    @property
+    def num_draws(self) -> int:
+        return len(self.draws)
+
+    @property
+    def mean(self) -> pd.Series:
+        return self.draws.mean()
+
+    @property
+    def std(self) -> pd.Series:
+        return self.draws.std()
+
+    def conf_int(self, alpha=0.05) -> pd.DataFrame:
+        '''
+        Percentile interval of each coefficient, with columns 0 and 1 like
+        LogitResult.conf_int
+        '''
+        return pd.DataFrame({0: self.draws.quantile(alpha / 2),
+                             1: self.draws.quantile(1 - alpha / 2)})
+
+    def odds_table(self, alpha=0.05) -> pd.DataFrame:
+        '''
+        Median odds ratio and its percentile interval, to print next to
+        lib.utils.log_odds
+        '''
+        ci = np.exp(self.conf_int(alpha))
+        ci.columns = [f'Boot {alpha / 2:.1%}', f'Boot {1 - alpha / 2:.1%}']
+        ci['Boot Odds Ratio'] = np.exp(self.draws.median())
+        # Significant if the interval for the odds ratio excludes 1
+        ci['Boot Significant'] = (ci.iloc[:, 0] > 1) | (ci.iloc[:, 1] < 1)
+        return ci
+
+
+def bootstrap_logit(X: np.ndarray, y: np.ndarray, names: Sequence[str], draws=200, seed=None,
+                    replace=True, workers=None, start=None, tol=1e-8) -> BootstrapResult:
+    '''
+    Fits y ~ X (X should include a constant column if one is wanted) on
+    draws class-balanced resamples of the rows. With replace=True (the
+    default) every class is resampled with replacement, which gives
+    bootstrap intervals. With replace=False each draw keeps every row of
+    the smallest class and subsamples the others to match, which only
+    measures how much the estimates depend on the balancing draw.
+
+    seed is an int or a SeedSequence. start (e.g. the full-sample
+    estimate) warm-starts every fit. workers=1 fits in this process
+    '''
+    X = np.asarray(X, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    options = {"replace": replace, "start": start, "tol": tol}
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    seeds = seed.spawn(draws)
+
+    if workers == 1:
+        _init_worker(X, y, options)
+        params = [_fit_draws(seeds)]
+    else:
+        # A few draws per task, so each fit isn't dwarfed by its round trip
+        chunk_size = -(-draws // (4 * num_workers(workers)))
+        chunks = (seeds[i:i + chunk_size] for i in range(0, draws, chunk_size))
+        params = list(bounded_map(_fit_draws, chunks, workers=workers,
+                                  initializer=_init_worker, initargs=(X, y, options)))
+
+    return BootstrapResult(names, np.concatenate(params).reshape(draws, len(names)))
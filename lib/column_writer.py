@@ -0,0 +1,40 @@
+'''
+Append-only writer of 1-d .npy arrays, for building columns that are too
+large to hold in memory at once
+'''
+
+import os
+import shutil
+import numpy as np
+
+
+class ColumnWriter:
+    '''
+    Builds a 1-d .npy array from chunks appended one at a time, without
+    ever holding the whole array: chunks go to a raw file, which is put
+    behind a .npy header on close()
+    '''
+
+    def __init__(self, path: str, name: str, dtype=np.float64):
+        self.path, self.name = path, name
+        self.dtype = np.dtype(dtype)
+        self.length = 0
+        self.raw = open(os.path.join(path, name + '.raw'), 'w+b')
+
+    def append(self, values):
+        np.ascontiguousarray(values, dtype=self.dtype).tofile(self.raw)
+        self.length += len(values)
+
+    def close(self):
+        tmp = os.path.join(self.path, self.name + '.tmp.npy')
+        with open(tmp, 'wb') as f:
+            np.lib.format.write_array_header_1_0(f, {
+                'descr': np.lib.format.dtype_to_descr(self.dtype),
+                'fortran_order': False,
+                'shape': (self.length,),
+            })
+            self.raw.seek(0)
+            shutil.copyfileobj(self.raw, f)
+        self.raw.close()
+        os.remove(self.raw.name)
+        os.replace(tmp, os.path.join(self.path, self.name + '.npy'))
@@ -0,0 +1,79 @@
+'''
+Per-group summary statistics and one-way ANOVA over integer-coded groups,
+computed with a few bincount passes instead of one boolean mask per group
+'''
+
+from collections import namedtuple
+from typing import Sequence
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+AnovaResult = namedtuple('AnovaResult', ['statistic', 'pvalue'])
+
+
+class GroupedStats:
+    '''
+    Count, mean, variance (ddof=1), standard error and t confidence
+    interval of values[codes == g] for each group g in [0, num_groups)
+    '''
+
+    def __init__(self, codes: np.ndarray, values: np.ndarray, num_groups: int = None,
+                 confidence=0.95):
+        self.codes = np.asarray(codes, dtype=np.int64)
+        self.values = np.asarray(values, dtype=np.float64)
+        self.num_groups = num_groups if num_groups is not None else int(self.codes.max()) + 1
+        self.confidence = confidence
+
+        self.count = np.bincount(self.codes, minlength=self.num_groups)
+        self.sum = np.bincount(self.codes, self.values, minlength=self.num_groups)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self.mean = self.sum / self.count
+            # Sum of squared deviations from each group's own mean, which is
+            # more accurate than sum(x^2) - n*mean^2
+            self.ss = np.bincount(self.codes, (self.values - self.mean[self.codes]) ** 2,
+                                  minlength=self.num_groups)
+            self.var = self.ss / (self.count - 1)
+            self.std = np.sqrt(self.var)
+            self.se = self.std / np.sqrt(self.count)
+
+            half_width = stats.t.ppf((1 + confidence) / 2, self.count - 1) * self.se
+        self.ci_low = self.mean - half_width
+        self.ci_high = self.mean + half_width
+
+    @property
+    def ci_half_width(self) -> np.ndarray:
+        return self.mean - self.ci_low
+
+    def anova(self):
+        '''
+        One-way ANOVA across the groups that have values, same result as
+        scipy.stats.f_oneway on each group's values
+        '''
+        present = self.count > 0
+        count, mean, ss = self.count[present], self.mean[present], self.ss[present]
+
+        n, k = count.sum(), len(count)
+        grand_mean = self.sum[present].sum() / n
+        ss_between = (count * (mean - grand_mean) ** 2).sum()
+        ss_within = ss.sum()
+
+        df_between, df_within = k - 1, n - k
+        f = (ss_between / df_between) / (ss_within / df_within)
+        return AnovaResult(f, stats.f.sf(f, df_between, df_within))
+
+    def to_frame(self, labels: Sequence[str] = None, label_name='group') -> pd.DataFrame:
+        '''
+        One row per group, with the same columns as researchpy.summary_cont
+        '''
+        percent = f'{self.confidence:.0%}'
+        return pd.DataFrame({
+            label_name: list(labels) if labels is not None else np.arange(self.num_groups),
+            "N": self.count,
+            "Mean": self.mean,
+            "SD": self.std,
+            "SE": self.se,
+            f"{percent} Conf.": self.ci_low,
+            "Interval": self.ci_high,
+        })
@@ -0,0 +1,57 @@
+'''
+Compact set of non-negative integer ids, for deduplicating millions of
+ids in a fraction of the memory of a Python set
+'''
+
+from typing import Iterable
+
+
+class IdSet:
+    '''
+    A bitmap with one bit per possible id, grown (doubling) to fit the
+    largest id added, so it costs max_id / 8 bytes however many ids are in
+    it. Ids outside [0, max_bitmap_id) go into an ordinary set instead
+    '''
+
+    __slots__ = ("bits", "overflow", "max_bitmap_id", "_len")
+
+    def __init__(self, ids: Iterable[int] = (), max_bitmap_id=2**32):
+        self.bits = bytearray()
+        self.overflow = set()
+        self.max_bitmap_id = max_bitmap_id
+        self._len = 0
+        for i in ids:
+            self.add(i)
+
+    def __contains__(self, i: int) -> bool:
+        if 0 <= i < self.max_bitmap_id:
+            byte = i >> 3
+            return byte < len(self.bits) and bool(self.bits[byte] >> (i & 7) & 1)
+        return i in self.overflow
+
+    def __len__(self):
+        return self._len + len(self.overflow)
+
+    def add(self, i: int):
+        self.check_add(i)
+
+    def check_add(self, i: int) -> bool:
+        '''
+        Adds i, returning whether it was already in the set
+        '''
+        if not 0 <= i < self.max_bitmap_id:
+            if i in self.overflow:
+                return True
+            self.overflow.add(i)
+            return False
+
+        byte, mask = i >> 3, 1 << (i & 7)
+        bits = self.bits
+        if byte >= len(bits):
+            bits.extend(bytes(max(byte + 1, 2 * len(bits)) - len(bits)))
+        elif bits[byte] & mask:
+            return True
+
+        bits[byte] |= mask
+        self._len += 1
+        return False
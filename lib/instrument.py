@@ -0,0 +1,150 @@
+'''
+Named stage timers and counters for finding out where a run spends its
+time, e.g. reading CSVs, decoding PostsX blobs, computing features or
+fitting models.
+
+Off by default, in which case timer() hands back a shared no-op and hot
+paths skip instrumentation entirely by checking `instrument.ENABLED`.
+Turn it on with the CS565_PROFILE environment variable (or enable()):
+
+    CS565_PROFILE=1         stage timers and counters
+    CS565_PROFILE=cprofile  the same, plus a cProfile of the whole run
+
+report() then writes a JSON summary to the path in CS565_PROFILE_OUT,
+or to stderr, and the cProfile stats (if any) next to it as .prof.
+Timings made inside pool worker processes are not collected.
+'''
+
+import cProfile
+import json
+import os
+import sys
+import time
+from collections import defaultdict
+from typing import Iterable, Iterator, TypeVar
+
+T = TypeVar('T')
+
+ENABLED = False
+MODES = ('timers', 'cprofile')
+
+_mode = None
+_start = time.perf_counter()
+_timers = defaultdict(lambda: [0.0, 0])
+_counters = defaultdict(int)
+_profiler = None
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        pass
+
+
+NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *_):
+        record = _timers[self.name]
+        record[0] += time.perf_counter() - self.start
+        record[1] += 1
+
+
+def enable(mode='timers'):
+    '''
+    Turns on instrumentation, mode is 'timers' or 'cprofile'
+    '''
+    global ENABLED, _mode, _profiler
+    if mode not in MODES:
+        raise ValueError(f'mode must be one of {MODES}')
+
+    ENABLED = True
+    _mode = mode
+    if mode == 'cprofile' and _profiler is None:
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+
+
+def timer(name: str):
+    '''
+    Context manager that adds the time spent inside it to stage `name`
+    '''
+    return _Timer(name) if ENABLED else NULL_TIMER
+
+
+def count(name: str, n=1):
+    if ENABLED:
+        _counters[name] += n
+
+
+def timed_iter(name: str, iterable: Iterable[T]) -> Iterable[T]:
+    '''
+    Passes iterable through, adding the time spent producing each item
+    to stage `name`. Returns iterable itself when disabled
+    '''
+    return _timed_iter(name, iterable) if ENABLED else iterable
+
+
+def _timed_iter(name: str, iterable: Iterable[T]) -> Iterator[T]:
+    items = iter(iterable)
+    record = _timers[name]
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(items)
+        except StopIteration:
+            record[0] += time.perf_counter() - start
+            return
+        record[0] += time.perf_counter() - start
+        record[1] += 1
+        yield item
+
+
+def summary() -> dict:
+    return {
+        "mode": _mode,
+        "wall_seconds": time.perf_counter() - _start,
+        "timers": {name: {"seconds": seconds, "calls": calls}
+                   for name, (seconds, calls) in sorted(_timers.items())},
+        "counters": dict(sorted(_counters.items())),
+    }
+
+
+def report(path=None):
+    '''
+    Writes the JSON summary (and cProfile stats) if instrumentation is on
+    '''
+    if not ENABLED:
+        return
+
+    path = path or os.environ.get('CS565_PROFILE_OUT')
+    result = summary()
+
+    if _profiler is not None:
+        _profiler.disable()
+        prof_path = os.path.splitext(path)[0] + '.prof' if path else 'profile.prof'
+        _profiler.dump_stats(prof_path)
+        result["cprofile"] = prof_path
+
+    if path:
+        with open(path, 'w') as f:
+            json.dump(result, f, indent=2)
+    else:
+        print(json.dumps(result, indent=2), file=sys.stderr)
+
+
+_env = os.environ.get('CS565_PROFILE', '').strip().lower()
+if _env and _env not in ('0', 'false', 'no'):
+    enable('cprofile' if _env == 'cprofile' else 'timers')
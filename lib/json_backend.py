@@ -0,0 +1,202 @@
+'''
+Pluggable JSON decoding. Uses the fastest installed backend (msgspec,
+then orjson) and falls back to the stdlib json. Can also check the
+decoded value against a type, e.g. List[SomeTypedDict].
+
+With msgspec, validation happens while decoding, straight into the typed
+containers. With the other backends, the decoded value is checked
+afterwards by validate(). Either way the result is made of plain dicts
+and lists, so callers can't tell which backend was used
+'''
+
+import json
+import os
+from importlib.util import find_spec
+from types import UnionType
+from typing import (Any, Callable, List, Literal, Union, get_args, get_origin, get_type_hints,
+                    is_typeddict)
+
+BACKENDS = ("msgspec", "orjson", "json")
+'''
+Supported backends, fastest first
+'''
+
+
+class ValidationError(ValueError):
+    pass
+
+
+def available_backends() -> List[str]:
+    return [backend for backend in BACKENDS if backend == "json" or find_spec(backend)]
+
+
+def default_backend() -> str:
+    '''
+    The backend named by the CS565_JSON_BACKEND environment variable, or
+    else the fastest one installed
+    '''
+    return os.environ.get('CS565_JSON_BACKEND') or available_backends()[0]
+
+
+def get_decoder(backend: str = None, schema: Any = None) -> Callable[[bytes], Any]:
+    '''
+    Returns a function decoding JSON bytes (or str) with the given backend
+    (default: default_backend()), raising ValidationError if the result
+    doesn't match schema (if given)
+    '''
+    backend = backend or default_backend()
+    if backend not in BACKENDS:
+        raise ValueError(f'backend must be one of {BACKENDS}')
+
+    if backend == "msgspec":
+        import msgspec
+        decoder = msgspec.json.Decoder(schema) if schema is not None else msgspec.json.Decoder()
+        if schema is None:
+            return decoder.decode
+
+        def decode(data):
+            try:
+                return decoder.decode(data)
+            except msgspec.ValidationError as e:
+                raise ValidationError(str(e)) from e
+
+        return decode
+
+    if backend == "orjson":
+        import orjson
+        loads = orjson.loads
+    else:
+        loads = json.loads
+
+    if schema is None:
+        return loads
+
+    check = _checker(schema)
+
+    def decode(data):
+        value = loads(data)
+        if not check(value):
+            validate(value, schema)
+        return value
+
+    return decode
+
+
+def validate(value, tp, path='$'):
+    '''
+    Checks a decoded JSON value against a type built from int, float,
+    str, bool, None, List, Literal, unions and TypedDicts (missing
+    non-required keys and unknown keys are allowed)
+    '''
+    origin = get_origin(tp)
+
+    if tp is Any:
+        return
+
+    if is_typeddict(tp):
+        if not isinstance(value, dict):
+            raise ValidationError(f'Expected `object`, got `{type(value).__name__}` - at `{path}`')
+        for key in tp.__required_keys__:
+            if key not in value:
+                raise ValidationError(f'Object missing required field `{key}` - at `{path}`')
+        for key, field_tp in _hints(tp).items():
+            if key in value:
+                validate(value[key], field_tp, f'{path}.{key}')
+        return
+
+    if origin in (list, List):
+        if not isinstance(value, list):
+            raise ValidationError(f'Expected `array`, got `{type(value).__name__}` - at `{path}`')
+        (item_tp,) = get_args(tp) or (Any,)
+        for i, item in enumerate(value):
+            validate(item, item_tp, f'{path}[{i}]')
+        return
+
+    if origin is Literal:
+        if not any(value == arg and type(value) is type(arg) for arg in get_args(tp)):
+            raise ValidationError(f'Invalid enum value {value!r} - at `{path}`')
+        return
+
+    if origin in (Union, UnionType):
+        errors = []
+        for arg in get_args(tp):
+            try:
+                return validate(value, arg, path)
+            except ValidationError as e:
+                errors.append(e)
+        raise errors[-1]
+
+    if tp is None or tp is type(None):
+        ok = value is None
+    elif tp is float:
+        ok = type(value) in (int, float)
+    else:
+        ok = type(value) is tp
+
+    if not ok:
+        raise ValidationError(f'Expected `{getattr(tp, "__name__", tp)}`, '
+                              f'got `{type(value).__name__}` - at `{path}`')
+
+
+_type_hints = {}
+
+
+def _hints(tp) -> dict:
+    if tp not in _type_hints:
+        _type_hints[tp] = get_type_hints(tp)
+    return _type_hints[tp]
+
+
+def _checker(tp) -> Callable[[Any], bool]:
+    '''
+    Compiles a type into a fast check of whether a value matches it. It
+    only says yes or no; validate() is rerun on failure for the message
+    '''
+    origin = get_origin(tp)
+
+    if tp is Any:
+        return lambda value: True
+
+    if is_typeddict(tp):
+        required = tuple(tp.__required_keys__)
+        fields = {key: _checker(field_tp) for key, field_tp in _hints(tp).items()}
+
+        def check_dict(value):
+            if type(value) is not dict:
+                return False
+            for key in required:
+                if key not in value:
+                    return False
+            for key, item in value.items():
+                check = fields.get(key)
+                if check is not None and not check(item):
+                    return False
+            return True
+
+        return check_dict
+
+    if origin in (list, List):
+        (item_tp,) = get_args(tp) or (Any,)
+        check_item = _checker(item_tp)
+        return lambda value: type(value) is list and all(map(check_item, value))
+
+    if origin is Literal:
+        allowed = {(type(arg), arg) for arg in get_args(tp)}
+
+        def check_literal(value):
+            try:
+                return (type(value), value) in allowed
+            except TypeError:
+                return False
+
+        return check_literal
+
+    if origin in (Union, UnionType):
+        checks = [_checker(arg) for arg in get_args(tp)]
+        return lambda value: any(check(value) for check in checks)
+
+    if tp is None or tp is type(None):
+        return lambda value: value is None
+    if tp is float:
+        return lambda value: type(value) in (int, float)
+    return lambda value: type(value) is tp
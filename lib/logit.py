@@ -0,0 +1,201 @@
+'''
+Logistic regression fit by Newton's method (IRLS) in NumPy, giving the
+same estimates, standard errors, p-values and confidence intervals as
+statsmodels' Logit(...).fit(), so the result works with lib.utils.log_odds.
+
+fit_subsets() fits one model per column subset in a single call. Each
+subset starts from the coefficients of the already-fitted subset that
+overlaps it most, or else from the intercept-only fit
+
+fit_logit_chunked() fits from chunks of rows, one pass over them per
+Newton step, for data that doesn't fit in memory
+'''
+
+from typing import Callable, Iterable, List, Optional, Sequence, Tuple
+import numpy as np
+import pandas as pd
+from scipy import stats
+from scipy.special import expit
+
+CONST = 'const'
+
+
+class LogitResult:
+    '''
+    The parts of a statsmodels LogitResults that the analysis uses
+    '''
+
+    def __init__(self, names: Sequence[str], params: np.ndarray, cov: np.ndarray, llf: float,
+                 nobs: float, iterations: int, converged: bool):
+        self.names = list(names)
+        self.params = pd.Series(params, index=self.names)
+        self.cov = cov
+        self.bse = pd.Series(np.sqrt(np.diag(cov)), index=self.names)
+        self.tvalues = self.params / self.bse
+        self.pvalues = pd.Series(2 * stats.norm.sf(np.abs(self.tvalues)), index=self.names)
+        self.llf = llf
+        self.nobs = nobs
+        self.iterations = iterations
+        self.converged = converged
+
+    def cov_params(self) -> pd.DataFrame:
+        return pd.DataFrame(self.cov, index=self.names, columns=self.names)
+
+    def conf_int(self, alpha=0.05) -> pd.DataFrame:
+        z = stats.norm.ppf(1 - alpha / 2)
+        return pd.DataFrame({0: self.params - z * self.bse, 1: self.params + z * self.bse})
+
+    def summary(self) -> str:
+        table = pd.DataFrame({
+            "coef": self.params,
+            "std err": self.bse,
+            "z": self.tvalues,
+            "P>|z|": self.pvalues,
+        })
+        ci = self.conf_int()
+        table["[0.025"], table["0.975]"] = ci[0], ci[1]
+
+        header = (f'Logit (IRLS)  No. Observations: {self.nobs:g}  '
+                  f'Log-Likelihood: {self.llf:.4f}  '
+                  f'Converged: {self.converged} ({self.iterations} iterations)')
+        return header + '\n' + table.to_string(float_format=lambda x: f'{x:.4f}')
+
+
+def _newton(X: np.ndarray, y: np.ndarray, weights: Optional[np.ndarray], beta: np.ndarray,
+            tol=1e-8, max_iter=35):
+    '''
+    Newton iterations from beta until the largest change in any
+    coefficient is below tol. Returns (beta, covariance, llf, iterations,
+    converged)
+    '''
+    w = 1.0 if weights is None else weights
+    converged = False
+    iterations = 0
+
+    while True:
+        p = expit(X @ beta)
+        hessian = (X * (w * p * (1 - p))[:, None]).T @ X
+        if converged or iterations >= max_iter:
+            break
+
+        step = np.linalg.solve(hessian, X.T @ (w * (y - p)))
+        beta = beta + step
+        iterations += 1
+        converged = np.max(np.abs(step)) < tol
+
+    eta = X @ beta
+    # log(p) = -log(1 + e^-eta), log(1 - p) = -log(1 + e^eta)
+    llf = -np.sum(w * (y * np.logaddexp(0, -eta) + (1 - y) * np.logaddexp(0, eta)))
+    return beta, np.linalg.inv(hessian), llf, iterations, converged
+
+
+def fit_logit(X: np.ndarray, y: np.ndarray, names: Sequence[str] = None, weights=None,
+              start=None, tol=1e-8, max_iter=35) -> LogitResult:
+    '''
+    Fits y ~ X (X should include a constant column if one is wanted).
+    weights are frequency weights, e.g. how many times each row was drawn
+    in a resample. start warm-starts the coefficients
+    '''
+    X = np.asarray(X, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    beta = np.zeros(X.shape[1]) if start is None else np.asarray(start, dtype=np.float64)
+    names = names if names is not None else [f'x{j}' for j in range(X.shape[1])]
+
+    beta, cov, llf, iterations, converged = _newton(X, y, weights, beta, tol=tol,
+                                                    max_iter=max_iter)
+    nobs = len(y) if weights is None else float(np.sum(weights))
+    return LogitResult(names, beta, cov, llf, nobs, iterations, converged)
+
+
+def fit_logit_chunked(chunks: Callable[[], Iterable[Tuple[np.ndarray, np.ndarray, Optional[np.ndarray]]]],
+                      names: Sequence[str], start=None, tol=1e-8, max_iter=35) -> LogitResult:
+    '''
+    Same fit as fit_logit, but the rows come from chunks(), which should
+    return a fresh iterable of (X, y, weights or None) chunks each time
+    it's called. Each Newton step is one pass that only accumulates the
+    Hessian X'WX, the gradient X'(w(y - p)) and the log-likelihood, so
+    memory is bounded by the chunk size
+    '''
+    beta = np.zeros(len(names)) if start is None else np.asarray(start, dtype=np.float64)
+    converged = False
+    iterations = 0
+
+    while True:
+        hessian = np.zeros((len(names), len(names)))
+        gradient = np.zeros(len(names))
+        llf = nobs = 0.0
+        for X, y, weights in chunks():
+            w = 1.0 if weights is None else weights
+            eta = X @ beta
+            p = expit(eta)
+            hessian += (X * (w * p * (1 - p))[:, None]).T @ X
+            gradient += X.T @ (w * (y - p))
+            llf -= np.sum(w * (y * np.logaddexp(0, -eta) + (1 - y) * np.logaddexp(0, eta)))
+            nobs += len(y) if weights is None else np.sum(weights)
+
+        if converged or iterations >= max_iter:
+            break
+
+        step = np.linalg.solve(hessian, gradient)
+        beta = beta + step
+        iterations += 1
+        converged = np.max(np.abs(step)) < tol
+
+    return LogitResult(names, beta, np.linalg.inv(hessian), llf, nobs, iterations, converged)
+
+
+def fit_subsets(data: pd.DataFrame, y: str, subsets: Sequence[Sequence[str]],
+                rows: Sequence[np.ndarray] = None, weights: Sequence[np.ndarray] = None,
+                tol=1e-8, max_iter=35) -> List[LogitResult]:
+    '''
+    Fits y ~ const + subset for each subset of data's columns. Each
+    subset uses the given row positions (default: the rows with no nan
+    in the subset or y, as select_columns does), optionally with
+    frequency weights over them
+    '''
+    columns = list(data.columns)
+    values = data.to_numpy(dtype=np.float64)
+    target = values[:, columns.index(y)]
+
+    if rows is None:
+        rows = [np.flatnonzero(~np.isnan(values[:, [columns.index(c) for c in (*s, y)]])
+                               .any(axis=1)) for s in subsets]
+
+    results: List[LogitResult] = []
+    for i, subset in enumerate(subsets):
+        names = [CONST] + list(subset)
+        sub_rows = np.asarray(rows[i])
+        w = None if weights is None else np.asarray(weights[i], dtype=np.float64)
+
+        X = np.empty((len(sub_rows), len(names)))
+        X[:, 0] = 1
+        X[:, 1:] = values[np.ix_(sub_rows, [columns.index(c) for c in subset])]
+        y_sub = target[sub_rows]
+
+        warm = _closest(results, names)
+        if warm is not None:
+            start = np.asarray([warm.params.get(name, 0.0) for name in names])
+        else:
+            # The intercept-only fit: log odds of the (weighted) mean of y
+            ybar = np.average(y_sub, weights=w)
+            start = np.zeros(len(names))
+            start[0] = np.log(ybar / (1 - ybar))
+        beta, cov, llf, iterations, converged = _newton(X, y_sub, w, start, tol=tol,
+                                                       max_iter=max_iter)
+        nobs = len(sub_rows) if w is None else float(w.sum())
+        results.append(LogitResult(names, beta, cov, llf, nobs, iterations, converged))
+
+    return results
+
+
+def _closest(results: List[LogitResult], names: List[str]) -> Optional[LogitResult]:
+    '''
+    The fitted result sharing the most columns with names, if any share
+    more than the constant
+    '''
+    best, overlap = None, 1
+    for result in results:
+        shared = len(set(result.names) & set(names))
+        if shared > overlap:
+            best, overlap = result, shared
+    return best
@@ -0,0 +1,185 @@
+import heapq
+import os
+import shutil
+import tempfile
+from operator import itemgetter
+from typing import Dict, Iterable, Iterator, List, Tuple
+import numpy as np
+
+ID_BITS = 32
+ID_MASK = (1 << ID_BITS) - 1
+
+
+class Vocabulary:
+    '''
+    Interns tokens to consecutive integer ids
+    '''
+
+    def __init__(self):
+        self.ids: Dict[str, int] = {}
+        self.tokens: List[str] = []
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def id(self, token: str) -> int:
+        tid = self.ids.get(token)
+        if tid is None:
+            tid = self.ids[token] = len(self.tokens)
+            self.tokens.append(token)
+        return tid
+
+    def encode(self, tokens: Iterable[str]) -> List[int]:
+        ids = self.ids
+        return [ids[t] if t in ids else self.id(t) for t in tokens]
+
+
+def pack(ids: Iterable[int]) -> int:
+    '''
+    Packs a sequence of token ids into a single int, ID_BITS bits per id,
+    so that packed keys sort in the same order as the id tuples
+    '''
+    key = 0
+    for tid in ids:
+        key = (key << ID_BITS) | tid
+    return key
+
+
+def unpack(key: int, n: int) -> Tuple[int, ...]:
+    return tuple((key >> (ID_BITS * (n - 1 - j))) & ID_MASK for j in range(n))
+
+
+class NgramCounter:
+    '''
+    Exact n-gram counter whose memory use is bounded by memory_limit
+    (in bytes, approximately). Tokens are interned to integer ids and
+    each n-gram is counted under a packed integer key. Whenever the
+    number of distinct n-grams held in memory exceeds the budget, the
+    counts are sorted and spilled to a run file on disk; most_common()
+    then merges the runs to give exact counts over everything added.
+
+    The vocabulary itself is kept in memory and is not counted against
+    the budget.
+    '''
+
+    BYTES_PER_ENTRY = 150
+    '''
+    Rough size of one dict entry with its packed key and count
+    '''
+
+    BLOCK_SIZE = 2**16
+    '''
+    Number of entries read from each run at a time when merging
+    '''
+
+    def __init__(self, n=3, memory_limit=512 * 2**20, spill_dir=None):
+        self.n = n
+        self.vocab = Vocabulary()
+        self.max_entries = max(1, memory_limit // self.BYTES_PER_ENTRY)
+        self.total = 0
+
+        self.counts: Dict[int, int] = {}
+        self.runs: List[str] = []
+        self.spill_dir = spill_dir
+        self._tmp_dir = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def add(self, tokens: Iterable[str]):
+        '''
+        Counts every n-gram in a single document's tokens
+        '''
+        n = self.n
+        ids = self.vocab.encode(tokens)
+        if len(ids) < n:
+            return
+
+        counts = self.counts
+        window_mask = (1 << (ID_BITS * (n - 1))) - 1
+        key = pack(ids[:n - 1])
+        for tid in ids[n - 1:]:
+            key = ((key & window_mask) << ID_BITS) | tid
+            counts[key] = counts.get(key, 0) + 1
+
+        self.total += len(ids) - n + 1
+        if len(counts) > self.max_entries:
+            self.spill()
+
+    def spill(self):
+        '''
+        Writes the in-memory counts to a sorted run file and clears them
+        '''
+        if not self.counts:
+            return
+
+        if self._tmp_dir is None:
+            self._tmp_dir = tempfile.mkdtemp(prefix='ngrams-', dir=self.spill_dir)
+
+        keys = np.array(sorted(self.counts), dtype=object)
+        run = np.empty(len(keys), dtype=[('ids', np.uint32, (self.n,)), ('count', np.uint64)])
+        for j in range(self.n):
+            run['ids'][:, j] = (keys >> (ID_BITS * (self.n - 1 - j))) & ID_MASK
+        run['count'] = [self.counts[key] for key in keys.tolist()]
+
+        filename = os.path.join(self._tmp_dir, f'run-{len(self.runs)}.npy')
+        np.save(filename, run)
+        self.runs.append(filename)
+        self.counts = {}
+
+    def _read_run(self, filename: str) -> Iterator[Tuple[int, int]]:
+        run = np.load(filename, mmap_mode='r')
+        for start in range(0, len(run), self.BLOCK_SIZE):
+            block = run[start:start + self.BLOCK_SIZE]
+            keys = block['ids'][:, 0].astype(object)
+            for j in range(1, self.n):
+                keys = (keys << ID_BITS) | block['ids'][:, j].astype(object)
+            yield from zip(keys.tolist(), block['count'].tolist())
+
+    def items(self) -> Iterator[Tuple[int, int]]:
+        '''
+        Yields (packed key, count) for every distinct n-gram, merging the
+        spilled runs with the in-memory counts. If anything was spilled,
+        keys come out in sorted order
+        '''
+        if not self.runs:
+            yield from self.counts.items()
+            return
+
+        streams = [self._read_run(filename) for filename in self.runs]
+        streams.append(iter(sorted(self.counts.items())))
+
+        current, total = None, 0
+        for key, count in heapq.merge(*streams, key=itemgetter(0)):
+            if key == current:
+                total += count
+                continue
+            if current is not None:
+                yield current, total
+            current, total = key, count
+
+        if current is not None:
+            yield current, total
+
+    def decode(self, key: int) -> Tuple[str, ...]:
+        return tuple(self.vocab.tokens[tid] for tid in unpack(key, self.n))
+
+    def most_common(self, k=10) -> List[Tuple[Tuple[str, ...], int]]:
+        '''
+        The k most frequent n-grams with their exact counts, like
+        nltk.FreqDist.most_common
+        '''
+        top = heapq.nlargest(k, self.items(), key=itemgetter(1))
+        return [(self.decode(key), count) for key, count in top]
+
+    def close(self):
+        '''
+        Removes any spilled run files
+        '''
+        if self._tmp_dir is not None:
+            shutil.rmtree(self._tmp_dir, ignore_errors=True)
+            self._tmp_dir = None
+        self.runs = []
@@ -0,0 +1,50 @@
+import os
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import islice
+from typing import Callable, Iterable, Iterator, TypeVar
+
+T = TypeVar('T')
+R = TypeVar('R')
+
+
+def num_workers(workers=None) -> int:
+    '''
+    Resolves a worker count, where None (or 0) means one worker per core
+    '''
+    return workers or os.cpu_count() or 1
+
+
+def bounded_map(fn: Callable[[T], R], iterable: Iterable[T], workers=None, ordered=True,
+                max_in_flight=None, initializer=None, initargs=()) -> Iterator[R]:
+    '''
+    Like ProcessPoolExecutor.map, but pulls from iterable lazily and keeps
+    at most max_in_flight tasks (default: 2 per worker) submitted at once,
+    so memory stays bounded no matter how long the input is. Results are
+    yielded in input order, or in completion order if ordered=False
+    '''
+    workers = num_workers(workers)
+    max_in_flight = max_in_flight or 2 * workers
+
+    items = iter(iterable)
+    executor = ProcessPoolExecutor(workers, initializer=initializer, initargs=initargs)
+    try:
+        if ordered:
+            pending = deque(executor.submit(fn, item)
+                            for item in islice(items, max_in_flight))
+            while pending:
+                result = pending.popleft().result()
+                for item in islice(items, 1):
+                    pending.append(executor.submit(fn, item))
+                yield result
+        else:
+            pending = set(executor.submit(fn, item)
+                          for item in islice(items, max_in_flight))
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for item in islice(items, len(done)):
+                    pending.add(executor.submit(fn, item))
+                for future in done:
+                    yield future.result()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
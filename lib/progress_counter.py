@@ -1,4 +1,9 @@
 import math
+import multiprocessing
+import shutil
+import sys
+import threading
+import time
 
 
 def human_readable(n):
@@ -10,6 +15,15 @@ def human_readable(n):
     return '{:.3g}{}'.format(n / 10**(3 * millidx), millnames[millidx])
 
 
+def human_duration(seconds):
+    if seconds < 60:
+        return f'{seconds:.1f}s'
+    seconds = int(seconds)
+    if seconds < 3600:
+        return f'{seconds // 60}m{seconds % 60:02d}s'
+    return f'{seconds // 3600}h{seconds // 60 % 60:02d}m'
+
+
 class ProgressCounter:
     def __init__(self, on_report):
         self.__counter = 0
@@ -31,3 +45,138 @@ class ProgressCounter:
             if self.__milestone == 10 ** (self.__pow + 1):
                 self.__pow += 1
             self.__milestone += 10**max(self.__pow - 2, 0)
+
+
+class Tally:
+    '''
+    Cheap per-producer handle on a shared count: increments are kept
+    locally and only added to the shared value (under its lock) every
+    `batch` increments, or on flush(). Use one per thread or process
+    '''
+
+    def __init__(self, value, batch=64):
+        self.value = value
+        self.batch = batch
+        self.pending = 0
+
+    def __call__(self, n=1):
+        self.pending += n
+        if self.pending >= self.batch:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            with self.value.get_lock():
+                self.value.value += self.pending
+            self.pending = 0
+
+
+_worker_tally = None
+
+
+def init_worker(value, batch=64):
+    '''
+    Process pool initializer that lets worker processes report into a
+    Progress (pass its .value), through worker_tally()
+    '''
+    global _worker_tally
+    _worker_tally = Tally(value, batch)
+
+
+def worker_tally() -> Tally:
+    '''
+    The Tally of this worker process (see init_worker). Flush it at the
+    end of each task
+    '''
+    return _worker_tally
+
+
+class Progress:
+    '''
+    Progress of a long running job that any number of threads, or worker
+    processes (see init_worker), can count into through Tally handles.
+
+    Used as a context manager, a background thread prints the count,
+    throughput and (if total is known) ETA at most once every `interval`
+    seconds, then a final summary on exit. When the stream is not a
+    terminal, a plain log line is printed every `log_interval` seconds
+    instead, or nothing at all if log_interval is None
+    '''
+
+    def __init__(self, label='Processed', unit='items', total=None, interval=0.5,
+                 log_interval=30, stream=None, enabled=True):
+        self.label = label
+        self.unit = unit
+        self.total = total
+        self.enabled = enabled
+        self.stream = stream or sys.stdout
+
+        self.value = multiprocessing.Value('q', 0)
+        self.start_time = None
+        self.elapsed = 0.0
+
+        self._tty = self.stream.isatty()
+        self._interval = interval if self._tty else log_interval
+        self._width = shutil.get_terminal_size().columns
+        self._stop = threading.Event()
+        self._thread = None
+        self._tallies = []
+
+    @property
+    def count(self) -> int:
+        return self.value.value
+
+    def tally(self, batch=64) -> Tally:
+        '''
+        A new handle to count into from the current thread. Handles made
+        here are flushed automatically when the context exits
+        '''
+        tally = Tally(self.value, batch)
+        self._tallies.append(tally)
+        return tally
+
+    def status(self) -> str:
+        count = self.count
+        elapsed = time.perf_counter() - self.start_time
+        rate = count / elapsed if elapsed > 0 else 0.0
+
+        status = f'> {self.label} {human_readable(count)}'
+        if self.total:
+            status += f'/{human_readable(self.total)}'
+        status += f' {self.unit} ({human_readable(rate)}/s'
+        if self.total and rate > 0:
+            status += f', ETA {human_duration(max(self.total - count, 0) / rate)}'
+        return status + ')'
+
+    def _print(self, line, final=False):
+        if self._tty:
+            print(line.ljust(self._width), end='\n' if final else '\r',
+                  file=self.stream, flush=True)
+        else:
+            print(line, file=self.stream, flush=True)
+
+    def _run(self):
+        while not self._stop.wait(self._interval):
+            self._print(self.status())
+
+    def __enter__(self):
+        self.start_time = time.perf_counter()
+        if self.enabled and self._interval is not None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *_):
+        for tally in self._tallies:
+            tally.flush()
+
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+        self.elapsed = time.perf_counter() - self.start_time
+        if self.enabled:
+            rate = self.count / self.elapsed if self.elapsed > 0 else 0.0
+            self._print(f'> Done! {self.label} {self.count} {self.unit} '
+                        f'in {human_duration(self.elapsed)} ({human_readable(rate)}/s)',
+                        final=True)
@@ -0,0 +1,50 @@
+'''
+Column means and standard deviations accumulated one chunk of rows at a
+time, for data that doesn't fit in memory at once
+'''
+
+import numpy as np
+
+
+class RunningStats:
+    '''
+    Per-column count, mean and std (ddof=1) of the non-nan values of every
+    chunk passed to update(), the same as DataFrame.mean() / .std() over
+    all the rows at once. Each chunk is summarised on its own and merged
+    in with Chan et al.'s parallel form of Welford's update, which doesn't
+    lose precision the way accumulating sum(x) and sum(x^2) does
+    '''
+
+    def __init__(self, num_columns: int):
+        self.count = np.zeros(num_columns)
+        self.mean = np.zeros(num_columns)
+        self.m2 = np.zeros(num_columns)
+
+    def update(self, chunk: np.ndarray):
+        '''
+        Adds a (rows, num_columns) chunk
+        '''
+        present = ~np.isnan(chunk)
+        count = present.sum(axis=0)
+        if not count.any():
+            return
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(present, chunk, 0).sum(axis=0) / count
+            m2 = np.where(present, (chunk - mean) ** 2, 0).sum(axis=0)
+
+            total = self.count + count
+            delta = np.nan_to_num(mean - self.mean)
+            fraction = np.nan_to_num(count / total)
+            self.mean = self.mean + delta * fraction
+            self.m2 = self.m2 + np.nan_to_num(m2) + delta ** 2 * self.count * fraction
+        self.count = total
+
+    @property
+    def var(self) -> np.ndarray:
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.count > 1, self.m2 / (self.count - 1), np.nan)
+
+    @property
+    def std(self) -> np.ndarray:
+        return np.sqrt(self.var)
@@ -0,0 +1,312 @@
+import heapq
+import math
+from hashlib import blake2b
+from typing import Dict, Hashable, Iterable, List, Tuple
+import numpy as np
+from lib.ngram_counter import Vocabulary
+
+
+def stable_hash(token: str, seed=0) -> int:
+    '''
+    64-bit hash of a token that, unlike hash(), is the same in every
+    process, so sketches built in different processes can be merged
+    '''
+    return int.from_bytes(blake2b(token.encode(), digest_size=8,
+                                  key=seed.to_bytes(8, 'little')).digest(), 'little')
+
+
+def ngram_hashes(token_hashes: np.ndarray, n: int) -> np.ndarray:
+    '''
+    64-bit hash of every n-gram of a sequence of token hashes, computed
+    for all windows at once (multiply-xor over the window, then the
+    SplitMix64 finalizer), so order matters
+    '''
+    token_hashes = np.asarray(token_hashes, dtype=np.uint64)
+    length = len(token_hashes) - n + 1
+    if length <= 0:
+        return np.zeros(0, dtype=np.uint64)
+
+    h = token_hashes[:length].copy()
+    for j in range(1, n):
+        h *= _MULTIPLIER
+        h ^= token_hashes[j:j + length]
+
+    h ^= h >> np.uint64(30)
+    h *= np.uint64(0xbf58476d1ce4e5b9)
+    h ^= h >> np.uint64(27)
+    h *= np.uint64(0x94d049bb133111eb)
+    h ^= h >> np.uint64(31)
+    return h
+
+
+_MULTIPLIER = np.uint64(0x9e3779b97f4a7c15)
+
+
+class CountMinSketch:
+    '''
+    Count-Min sketch (Cormode & Muthukrishnan). With probability at least
+    1 - delta, every estimate overcounts by at most epsilon * total.
+    Items are given as 64-bit hashes, and the i-th row uses the hash
+    h1 + i * h2 built from its two 32-bit halves
+    '''
+
+    def __init__(self, epsilon=1e-4, delta=1e-3):
+        self.epsilon = epsilon
+        self.delta = delta
+        self.width = math.ceil(math.e / epsilon)
+        self.depth = math.ceil(math.log(1 / delta))
+        self.table = np.zeros((self.depth, self.width), dtype=np.int64)
+        self.total = 0
+
+    def _indices(self, hashes: np.ndarray) -> np.ndarray:
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        h1 = hashes & np.uint64(0xffffffff)
+        h2 = hashes >> np.uint64(32)
+        rows = np.arange(self.depth, dtype=np.uint64)[:, None]
+        return ((h1 + rows * h2) % np.uint64(self.width)).astype(np.int64)
+
+    def update(self, hashes: np.ndarray, counts=1):
+        '''
+        Adds counts (a scalar or one per item) to each hashed item
+        '''
+        idx = self._indices(hashes)
+        counts = np.broadcast_to(np.asarray(counts, dtype=np.int64), idx.shape[1:])
+        for i in range(self.depth):
+            np.add.at(self.table[i], idx[i], counts)
+        self.total += int(counts.sum())
+
+    def estimate(self, hashes: np.ndarray) -> np.ndarray:
+        idx = self._indices(hashes)
+        return self.table[np.arange(self.depth)[:, None], idx].min(axis=0)
+
+    @property
+    def error_bound(self) -> float:
+        '''
+        Maximum overcount of any estimate, with probability 1 - delta
+        '''
+        return self.epsilon * self.total
+
+    def merge(self, other: 'CountMinSketch'):
+        if self.table.shape != other.table.shape:
+            raise ValueError('Can only merge sketches built with the same epsilon and delta')
+        self.table += other.table
+        self.total += other.total
+
+
+class SpaceSaving:
+    '''
+    Space-Saving top-k summary (Metwally et al.) over at most capacity
+    counters. Each counter overestimates its item's count by at most its
+    error, which is at most total / capacity
+    '''
+
+    def __init__(self, capacity=1000):
+        self.capacity = capacity
+        self.counters: Dict[Hashable, List[int]] = {}
+        self.total = 0
+        self._heap = []
+
+    def update(self, item: Hashable, count=1):
+        self.total += count
+        counter = self.counters.get(item)
+        if counter is not None:
+            counter[0] += count
+            return
+
+        if len(self.counters) < self.capacity:
+            self.counters[item] = [count, 0]
+            return
+
+        # Evict the item with the smallest count. The heap holds stale
+        # entries for counters that have grown since, which are skipped
+        if not self._heap:
+            self._heap = [(c, i) for i, (c, _) in self.counters.items()]
+            heapq.heapify(self._heap)
+        while True:
+            c, victim = heapq.heappop(self._heap)
+            if self.counters[victim][0] == c:
+                break
+            heapq.heappush(self._heap, (self.counters[victim][0], victim))
+
+        del self.counters[victim]
+        self.counters[item] = [c + count, c]
+        heapq.heappush(self._heap, (c + count, item))
+
+    @property
+    def min_count(self) -> int:
+        if len(self.counters) < self.capacity:
+            return 0
+        return min(c for c, _ in self.counters.values())
+
+    def top(self, k: int) -> List[Tuple[Hashable, int, int]]:
+        '''
+        The k items with the largest counts, as (item, count, error)
+        '''
+        return heapq.nlargest(k, ((item, c, e) for item, (c, e) in self.counters.items()),
+                              key=lambda x: x[1])
+
+    def merge(self, other: 'SpaceSaving'):
+        '''
+        Combines two summaries (Agarwal et al., Mergeable Summaries). An
+        item missing from one side may have been counted up to that
+        side's smallest count, which is added to its count and error
+        '''
+        self_min, other_min = self.min_count, other.min_count
+        merged = {}
+        for item in set(self.counters) | set(other.counters):
+            c1, e1 = self.counters.get(item, (self_min, self_min))
+            c2, e2 = other.counters.get(item, (other_min, other_min))
+            merged[item] = [c1 + c2, e1 + e2]
+
+        top = heapq.nlargest(self.capacity, merged.items(), key=lambda x: x[1][0])
+        self.counters = dict(top)
+        self.total += other.total
+        self._heap = []
+
+
+class HeavyHitters:
+    '''
+    Approximate top-k n-gram counts in fixed memory: Space-Saving picks
+    the candidates and a Count-Min sketch tightens their counts (both
+    only ever overcount, so the smaller of the two is kept)
+
+    Tokens are interned to vocabulary ids, each with a stable hash. Every
+    FLUSH_SIZE n-grams, the n-gram hashes of all buffered documents are
+    computed at once with numpy and counted with np.unique, so both
+    summaries get one update per distinct n-gram of the batch. As with
+    NgramCounter, the vocabulary itself isn't bounded
+    '''
+
+    FLUSH_SIZE = 2**16
+
+    def __init__(self, n=3, capacity=1000, epsilon=1e-4, delta=1e-3, seed=0):
+        self.n = n
+        self.seed = seed
+        self.cms = CountMinSketch(epsilon, delta)
+        self.space_saving = SpaceSaving(capacity)
+        self.ngrams: Dict[int, Tuple[str, ...]] = {}
+        '''
+        The n-gram of every hash counted by space_saving
+        '''
+
+        self.vocab = Vocabulary()
+        self._id_hashes = np.zeros(1024, dtype=np.uint64)
+        self._num_hashed = 0
+        self._ids: List[int] = []
+        self._doc_ends: List[int] = []
+        self._pending = 0
+
+    def add(self, tokens: Iterable[str]):
+        '''
+        Counts every n-gram in a single document's tokens
+        '''
+        ids = self.vocab.encode(tokens)
+        if len(ids) < self.n:
+            return
+
+        self._ids.extend(ids)
+        self._doc_ends.append(len(self._ids))
+        self._pending += len(ids) - self.n + 1
+        if self._pending >= self.FLUSH_SIZE:
+            self.flush()
+
+    def _hashes_of(self, ids: np.ndarray) -> np.ndarray:
+        '''
+        Stable hashes of vocabulary ids, hashing each token only once
+        '''
+        known = len(self._id_hashes)
+        if len(self.vocab) > known:
+            grown = np.zeros(max(len(self.vocab), 2 * known), dtype=np.uint64)
+            grown[:known] = self._id_hashes
+            self._id_hashes = grown
+        for tid in range(self._num_hashed, len(self.vocab)):
+            self._id_hashes[tid] = stable_hash(self.vocab.tokens[tid], self.seed)
+        self._num_hashed = len(self.vocab)
+        return self._id_hashes[ids]
+
+    def flush(self):
+        if not self._ids:
+            return
+
+        n = self.n
+        ids = np.asarray(self._ids, dtype=np.int64)
+        doc_ends = np.asarray(self._doc_ends, dtype=np.int64)
+        self._ids, self._doc_ends, self._pending = [], [], 0
+
+        # Hash every window of the concatenated documents, then drop the
+        # windows that run past the end of a document
+        hashes = ngram_hashes(self._hashes_of(ids), n)
+        crosses = np.zeros(len(hashes), dtype=bool)
+        for j in range(1, n):
+            crosses[doc_ends[doc_ends - j < len(hashes)] - j] = True
+        starts = np.flatnonzero(~crosses)
+
+        items, first, counts = np.unique(hashes[starts], return_index=True, return_counts=True)
+        self.cms.update(items, counts)
+
+        space_saving = self.space_saving
+        for item, count in zip(items.tolist(), counts.tolist()):
+            space_saving.update(item, count)
+
+        # Name the new candidates, from the position of their first
+        # occurrence in the batch, and forget the evicted ones
+        tokens = self.vocab.tokens
+        named = {}
+        for item in space_saving.counters:
+            ngram = self.ngrams.get(item)
+            if ngram is None:
+                pos = starts[first[np.searchsorted(items, np.uint64(item))]]
+                ngram = tuple(tokens[tid] for tid in ids[pos:pos + n].tolist())
+            named[item] = ngram
+        self.ngrams = named
+
+    def merge(self, other: 'HeavyHitters'):
+        if (self.n, self.seed) != (other.n, other.seed):
+            raise ValueError('Can only merge sketches built with the same n and seed')
+        self.flush()
+        other.flush()
+        self.cms.merge(other.cms)
+        self.space_saving.merge(other.space_saving)
+
+        names = {**other.ngrams, **self.ngrams}
+        self.ngrams = {item: names[item] for item in self.space_saving.counters}
+
+    @property
+    def total(self) -> int:
+        return self.space_saving.total + self._pending
+
+    def most_common(self, k=10) -> List[Tuple[Tuple[str, ...], int]]:
+        '''
+        Approximate k most frequent n-grams with their estimated counts
+        '''
+        self.flush()
+        candidates = self.space_saving.top(self.space_saving.capacity)
+        if not candidates:
+            return []
+
+        hashes = np.array([item for item, _, _ in candidates], dtype=np.uint64)
+        estimates = np.minimum(self.cms.estimate(hashes),
+                               [c for _, c, _ in candidates]).tolist()
+        top = heapq.nlargest(k, zip((self.ngrams[item] for item, _, _ in candidates), estimates),
+                             key=lambda x: x[1])
+        return list(top)
+
+
+def error_report(approx: List[Tuple[Hashable, int]], exact_top: List[Tuple[Hashable, int]],
+                 exact_counts: Dict[Hashable, int]) -> dict:
+    '''
+    Compares an approximate top-k list against the exact one.
+    exact_counts must hold the true count of every item in approx
+    '''
+    k = len(exact_top)
+    found = set(item for item, _ in approx[:k])
+    errors = [abs(estimate - exact_counts.get(item, 0)) for item, estimate in approx]
+    rel_errors = [err / exact_counts[item] for (item, _), err in zip(approx, errors)
+                  if exact_counts.get(item)]
+    return {
+        "k": k,
+        "recall": len(found & set(item for item, _ in exact_top)) / k if k else 1.0,
+        "max_abs_error": max(errors, default=0),
+        "mean_abs_error": sum(errors) / len(errors) if errors else 0.0,
+        "max_rel_error": max(rel_errors, default=0.0),
+    }
@@ -1,11 +1,12 @@
-import os
+import shutil
 import numpy as np
 
 def tcols():
     '''
-    Utility function to get the width of the terminal
+    Utility function to get the width of the terminal (80 if
+    output is not a terminal)
     '''
-    return os.get_terminal_size().columns
+    return shutil.get_terminal_size().columns
 
 def log_odds(model, only_significant=False):
     odds = model.conf_int()
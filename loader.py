@@ -1,12 +1,18 @@
 import csv
 from datetime import datetime
 from glob import glob
-from typing import List, Literal, TypedDict
+from functools import partial
+from typing import (Any, Container, Dict, FrozenSet, Iterable, List, Literal, Optional, Tuple,
+                    TypedDict, get_args, get_type_hints)
 from base64 import b64decode
-from json import loads
 from gzip import decompress
+import io
 import os
 import sys
+from lib import instrument
+from lib.id_set import IdSet
+from lib.json_backend import default_backend, get_decoder
+from lib.parallel import bounded_map
 
 DIR = os.path.dirname(os.path.realpath(__file__))
 
@@ -31,7 +37,7 @@ class AnswerDict(TypedDict):
     Score: int
 
 
-class TagDict:
+class TagDict(TypedDict):
     TagName: str
     Count: int
 
@@ -56,13 +62,184 @@ class UserDict(TypedDict):
     Posts: List[PostDict]
 
 
-def parse_row(row) -> UserDict:
+POST_FIELDS = ("PostId", "PostType", "Body", "ViewCount", "Votes", "Edits", "Answers", "Tags")
+
+METADATA_FIELDS = ("PostId", "PostType", "ViewCount", "Votes", "Edits", "Tags",
+                   "Answers.AnswererId", "Answers.AnswererRep", "Answers.AnswererAge",
+                   "Answers.IsAcceptedAnswer", "Answers.Score")
+'''
+Every post field except the post and answer bodies, for load_data(fields=...)
+'''
+
+Projection = Dict[str, Optional['Projection']]
+
+
+def compile_projection(fields: Iterable[str]) -> Projection:
+    '''
+    Turns a list of field paths like ["PostType", "Votes", "Answers.Score"]
+    into a dict from each kept field to the projection of its items, or to
+    None if they are kept whole
+    '''
+    nested = {}
+    for path in fields:
+        field, _, rest = path.partition('.')
+        if not rest:
+            nested[field] = None
+        elif nested.get(field, []) is not None:
+            nested.setdefault(field, []).append(rest)
+
+    return {field: None if rest is None else compile_projection(rest)
+            for field, rest in nested.items()}
+
+
+def project(records: List[dict], projection: Projection) -> List[dict]:
+    '''
+    Copies of the records with only the fields in the projection
+    '''
+    out = []
+    for record in records:
+        kept = {}
+        for field, sub in projection.items():
+            if field in record:
+                kept[field] = record[field] if sub is None else project(record[field], sub)
+        out.append(kept)
+    return out
+
+
+def _projected_type(td, projection: Projection, validate: bool):
+    '''
+    A TypedDict with only the projected fields of td, so that decoders
+    that support it (msgspec) skip the others without building them
+    '''
+    hints = get_type_hints(td)
+    annotations = {}
+    for field, sub in projection.items():
+        tp = hints.get(field, Any)
+        if sub is not None:
+            tp = List[_projected_type(get_args(tp)[0], sub, validate)]
+        elif not validate:
+            tp = Any
+        annotations[field] = tp
+
+    # Required fields stay required (when validating) by declaring them in
+    # a total base class, since typing.Required is only in Python 3.11+
+    required = {field: tp for field, tp in annotations.items()
+                if validate and field in td.__required_keys__}
+    base = TypedDict(td.__name__, required)
+    optional = {field: tp for field, tp in annotations.items() if field not in required}
+    return type(base)(td.__name__, (base,), {'__annotations__': optional}, total=False)
+
+
+def intern_strings(posts: List[PostDict]) -> List[PostDict]:
+    '''
+    Replaces the low cardinality strings of the posts (PostType, VoteType
+    and TagName) by a single shared copy of each, in place
+    '''
+    for post in posts:
+        if "PostType" in post:
+            post["PostType"] = sys.intern(post["PostType"])
+        if "Votes" in post:
+            for vote in post["Votes"]:
+                if "VoteType" in vote:
+                    vote["VoteType"] = sys.intern(vote["VoteType"])
+        if "Tags" in post:
+            for tag in post["Tags"]:
+                if "TagName" in tag:
+                    tag["TagName"] = sys.intern(tag["TagName"])
+    return posts
+
+
+def _make_decoder(backend, validate, intern, projection: Projection = None):
+    if projection is None:
+        decode = get_decoder(backend, List[PostDict] if validate else None)
+    else:
+        schema = List[_projected_type(PostDict, projection, validate)]
+        if (backend or default_backend()) == "msgspec":
+            decode = get_decoder(backend, schema)
+        else:
+            decode_all = get_decoder(backend, schema if validate else None)
+            decode = lambda data: project(decode_all(data), projection)
+
+    if not intern:
+        return decode
+    return lambda data: intern_strings(decode(data))
+
+
+_decoder_settings = (None, bool(os.environ.get('CS565_JSON_VALIDATE')), True)
+_decode_posts = _make_decoder(*_decoder_settings)
+_projected_decoders = {}
+
+
+def posts_decoder(fields: Iterable[str] = None):
+    '''
+    The function parse_row decodes PostsX with, keeping only the given
+    post fields (default: all of them)
+    '''
+    if fields is None:
+        return _decode_posts
+
+    key = tuple(sorted(fields))
+    if key not in _projected_decoders:
+        _projected_decoders[key] = _make_decoder(*_decoder_settings, compile_projection(key))
+    return _projected_decoders[key]
+
+
+def set_decoder(backend=None, validate=False, intern=True):
+    '''
+    Picks the JSON backend that parse_row decodes PostsX with (default:
+    the fastest installed, see lib.json_backend), and whether to check
+    the posts against PostDict, raising json_backend.ValidationError if
+    they don't match. Worker processes of load_data follow this setting.
+    Both can also be set with the CS565_JSON_BACKEND/CS565_JSON_VALIDATE
+    environment variables. With intern, repeated strings are shared (see
+    intern_strings)
+    '''
+    global _decoder_settings, _decode_posts
+    _decode_posts = _make_decoder(backend, validate, intern)
+    _decoder_settings = (backend, validate, intern)
+    _projected_decoders.clear()
+
+
+def decoder_settings() -> tuple:
+    '''
+    The arguments of the last set_decoder call, for passing on to worker
+    processes that parse rows
+    '''
+    return _decoder_settings
+
+
+def parse_row(row, fields: Iterable[str] = None) -> UserDict:
+    '''
+    Decodes a raw row, keeping only the given post fields (see load_data)
+    '''
+    decode = _decode_posts if fields is None else posts_decoder(fields)
+    if instrument.ENABLED:
+        return _parse_row_timed(row, decode)
+
     return {
         "UserId": int(row["UserId"]),
         "AccountCreationDate": datetime.fromisoformat(row["AccountCreationDate"]),
         "FirstPostDate": datetime.fromisoformat(row["FirstPostDate"]),
         "NumFuturePosts": int(row["NumFuturePosts"]),
-        "Posts": loads(decompress(b64decode(row["PostsX"])))
+        "Posts": decode(decompress(b64decode(row["PostsX"])))
+    }
+
+
+def _parse_row_timed(row, decode) -> UserDict:
+    with instrument.timer('parse.b64decode'):
+        data = b64decode(row["PostsX"])
+    with instrument.timer('parse.decompress'):
+        data = decompress(data)
+    with instrument.timer('parse.loads'):
+        posts = decode(data)
+    instrument.count('parse.bytes', len(data))
+
+    return {
+        "UserId": int(row["UserId"]),
+        "AccountCreationDate": datetime.fromisoformat(row["AccountCreationDate"]),
+        "FirstPostDate": datetime.fromisoformat(row["FirstPostDate"]),
+        "NumFuturePosts": int(row["NumFuturePosts"]),
+        "Posts": posts
     }
 
 
@@ -75,15 +252,173 @@ while True:
         field_size_limit //= 2
 
 
-def load_data():
-    user_ids = set()
-    for filename in glob(os.path.join(DIR, 'raw_data/*')):
+DEFAULT_CHUNK_SIZE = 4 * 2**20
+'''
+Size (in bytes) of the byte ranges that raw files are split into when
+loading in parallel. Up to 2 chunks per worker are in flight, each
+decoding to roughly 10x its size in dicts, so this is kept small enough
+that peak memory stays modest even with many workers
+'''
+
+
+def raw_files(raw_dir=None) -> List[str]:
+    '''
+    Lists the raw data files, in the order they are loaded (by name, so
+    that it's the same on every run and matches the cached shards)
+    '''
+    return sorted(glob(os.path.join(raw_dir or os.path.join(DIR, 'raw_data'), '*')))
+
+
+def plan_chunks(filenames: List[str], chunk_size=DEFAULT_CHUNK_SIZE):
+    '''
+    Splits each file into (filename, start, end) byte ranges of roughly
+    chunk_size bytes each, not counting the header row
+    '''
+    chunks = []
+    for filename in filenames:
+        size = os.path.getsize(filename)
+        with open(filename, 'rb') as f:
+            f.readline()
+            start = f.tell()
+
+        while start < size:
+            end = min(start + chunk_size, size)
+            chunks.append((filename, start, end))
+            start = end
+
+    return chunks
+
+
+def _read_range(chunk) -> Tuple[List[str], str]:
+    '''
+    The column names of a raw file and the text of every row that starts
+    within the byte range [start, end). Rows straddling a boundary belong
+    to the chunk they start in, which is safe because no field of the
+    export contains a newline
+    '''
+    filename, start, end = chunk
+    with open(filename, 'rb') as f:
+        header = f.readline().decode()
+
+        f.seek(max(start - 1, f.tell()))
+        if f.tell() == start - 1:
+            f.readline()
+        begin = f.tell()
+
+        f.seek(max(end - 1, begin))
+        if f.tell() == end - 1:
+            f.readline()
+        stop = f.tell()
+
+        f.seek(begin)
+        data = f.read(stop - begin).decode()
+
+    return next(csv.reader([header])), data
+
+
+def read_chunk(chunk, fields: Iterable[str] = None, skip: Container[int] = ()) \
+        -> List[UserDict]:
+    '''
+    Parses every row that starts within the byte range [start, end) of a
+    raw file, except the rows at the positions (within the chunk) in skip
+    '''
+    fieldnames, data = _read_range(chunk)
+    csv_reader = csv.DictReader(io.StringIO(data, newline=''), fieldnames=fieldnames)
+    return [parse_row(row, fields) for i, row in enumerate(csv_reader) if i not in skip]
+
+
+def read_chunk_ids(chunk) -> List[int]:
+    '''
+    The UserId of every row of a chunk, in order, without decoding the posts
+    '''
+    fieldnames, data = _read_range(chunk)
+    column = fieldnames.index("UserId")
+    # Blank lines are skipped, as DictReader does in read_chunk
+    return [int(row[column]) for row in csv.reader(io.StringIO(data, newline='')) if row]
+
+
+def _read_task(task, fields: Iterable[str] = None) -> List[UserDict]:
+    chunk, skip = task
+    return read_chunk(chunk, fields, skip)
+
+
+def duplicate_rows(chunks, workers=None) -> List[FrozenSet[int]]:
+    '''
+    For each chunk, the positions of its rows whose UserId already appeared
+    in an earlier row (in file order), found from the UserIds alone
+    '''
+    user_ids = IdSet()
+    skips = []
+    ids = bounded_map(read_chunk_ids, chunks, workers=workers)
+    for chunk_ids in instrument.timed_iter('load.ids', ids):
+        skips.append(frozenset(i for i, user_id in enumerate(chunk_ids)
+                               if user_ids.check_add(user_id)))
+        instrument.count('load.duplicates', len(skips[-1]))
+    return skips
+
+
+def read_file(filename, fields: Iterable[str] = None):
+    '''
+    Yields every row of a single raw file, without any deduplication
+    '''
+    with open(filename) as csv_file:
+        for row in csv.DictReader(csv_file):
+            yield parse_row(row, fields)
+
+
+def load_data(workers=1, ordered=True, chunk_size=DEFAULT_CHUNK_SIZE, raw_dir=None,
+              fields: Iterable[str] = None):
+    '''
+    Yields every user in the raw data, skipping any UserId that has
+    already been seen.
+
+    If fields is given, posts only keep those fields, e.g. ["Tags"] or
+    METADATA_FIELDS. A field of the Votes, Edits, Answers or Tags records
+    is written as "Answers.Score", and a bare "Answers" keeps the whole
+    answers. Dropped fields are discarded as soon as a row is decoded, or
+    never built at all with the msgspec backend.
+
+    With workers != 1 (None means one per core), files are split into
+    byte ranges of chunk_size bytes and decoded across a process pool.
+    If ordered, users come out in the same order as the serial loader.
+    Otherwise they come out as soon as their chunk is done, after a first
+    pass over just the UserIds (about a fifth of the time of decoding)
+    works out which rows are duplicates, so the copy that is kept is
+    still the first one in file order
+    '''
+    fields = tuple(fields) if fields is not None else None
+    if workers == 1:
+        yield from _load_data_serial(raw_dir, fields)
+        return
+
+    chunks = plan_chunks(raw_files(raw_dir), chunk_size)
+    pool = dict(workers=workers, initializer=set_decoder, initargs=_decoder_settings)
+    if not ordered:
+        tasks = zip(chunks, duplicate_rows(chunks, workers))
+        results = bounded_map(partial(_read_task, fields=fields), tasks, ordered=False, **pool)
+        for users in instrument.timed_iter('load.chunks', results):
+            yield from users
+        return
+
+    user_ids = IdSet()
+    results = bounded_map(partial(read_chunk, fields=fields), chunks, **pool)
+    for users in instrument.timed_iter('load.chunks', results):
+        for user in users:
+            if user_ids.check_add(user["UserId"]):
+                instrument.count('load.duplicates')
+                continue
+
+            yield user
+
+
+def _load_data_serial(raw_dir=None, fields=None):
+    user_ids = IdSet()
+    for filename in raw_files(raw_dir):
         with open(filename) as csv_file:
             csv_reader = csv.DictReader(csv_file)
-            for row in csv_reader:
-                user_id = row["UserId"]
-                if user_id in user_ids:
+            for row in instrument.timed_iter('load.csv', csv_reader):
+                if user_ids.check_add(int(row["UserId"])):
+                    instrument.count('load.duplicates')
                     continue
 
-                user_ids.add(user_id)
-                yield parse_row(row)
+                yield parse_row(row, fields)
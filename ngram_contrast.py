@@ -0,0 +1,188 @@
+'''
+n-gram features associated with retention, from both the original
+poster's own posts and the answers they received.
+
+A single pass over the data tokenizes every body once and accumulates
+its n-gram counts, split by User.f_retention, into sparse integer-indexed
+tables. Each n-gram is then scored with the log-odds ratio with an
+informative Dirichlet prior (Monroe, Colaresi & Quinn, 2008) and a 2x2
+chi-squared test.
+'''
+
+import argparse
+from itertools import tee
+from typing import Dict, Iterable, Tuple
+import numpy as np
+import pandas as pd
+from scipy import stats
+from features import User, tokenize_many
+from lib import instrument
+from lib.ngram_counter import ID_BITS, Vocabulary, pack, unpack
+from loader import UserDict, load_data
+
+SOURCES = ("posts", "answers")
+'''
+posts: bodies of the user's own initial posts
+answers: bodies of the answers the user received
+'''
+
+GROUPS = ("not_retained", "retained")
+'''
+Group names, indexed by User.f_retention
+'''
+
+
+class GroupedNgramCounts:
+    '''
+    n-gram counts per group. Each distinct n-gram gets a row index the
+    first time it is seen, and counts[row, group] holds its count
+    '''
+
+    FLUSH_SIZE = 2**16
+
+    def __init__(self, n=3, num_groups=2, vocab: Vocabulary = None):
+        self.n = n
+        self.vocab = vocab or Vocabulary()
+        self.rows: Dict[int, int] = {}
+        self.keys = []
+        self.counts = np.zeros((1024, num_groups), dtype=np.int64)
+
+        self._rows, self._groups = [], []
+
+    def add(self, tokens: Iterable[str], group: int):
+        n = self.n
+        ids = self.vocab.encode(tokens)
+        if len(ids) < n:
+            return
+
+        rows, keys = self.rows, self.keys
+        window_mask = (1 << (ID_BITS * (n - 1))) - 1
+        key = pack(ids[:n - 1])
+        for tid in ids[n - 1:]:
+            key = ((key & window_mask) << ID_BITS) | tid
+            row = rows.get(key)
+            if row is None:
+                row = rows[key] = len(keys)
+                keys.append(key)
+            self._rows.append(row)
+
+        self._groups.extend([group] * (len(ids) - n + 1))
+        if len(self._rows) >= self.FLUSH_SIZE:
+            self.flush()
+
+    def flush(self):
+        if not self._rows:
+            return
+
+        if len(self.keys) > len(self.counts):
+            grown = np.zeros((max(len(self.keys), 2 * len(self.counts)), self.counts.shape[1]),
+                             dtype=np.int64)
+            grown[:len(self.counts)] = self.counts
+            self.counts = grown
+
+        np.add.at(self.counts, (self._rows, self._groups), 1)
+        self._rows, self._groups = [], []
+
+    def table(self) -> np.ndarray:
+        '''
+        The (num_ngrams, num_groups) count table
+        '''
+        self.flush()
+        return self.counts[:len(self.keys)]
+
+    def decode(self, row: int) -> Tuple[str, ...]:
+        return tuple(self.vocab.tokens[tid] for tid in unpack(self.keys[row], self.n))
+
+
+def contrast_scores(counts: GroupedNgramCounts, min_count=5, alpha0=None) -> pd.DataFrame:
+    '''
+    Scores every n-gram seen at least min_count times on how strongly it
+    is associated with group 1 over group 0: the z-score of the
+    log-odds ratio with an informative Dirichlet prior of total weight
+    alpha0 (default: one pseudo-count per n-gram), and the chi-squared
+    statistic of the 2x2 table of (this n-gram, all others) x group
+    '''
+    table = counts.table().astype(np.float64)
+    y0, y1 = table[:, 0], table[:, 1]
+    n0, n1 = y0.sum(), y1.sum()
+
+    total = y0 + y1
+    if alpha0 is None:
+        alpha0 = float(len(total))
+    alpha = alpha0 * total / total.sum()
+
+    delta = np.log((y1 + alpha) / (n1 + alpha0 - y1 - alpha)) \
+        - np.log((y0 + alpha) / (n0 + alpha0 - y0 - alpha))
+    var = 1 / (y1 + alpha) + 1 / (y0 + alpha)
+
+    # 2x2 table [[y1, n1 - y1], [y0, n0 - y0]]
+    a, b, c, d = y1, n1 - y1, y0, n0 - y0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        chi2 = (n0 + n1) * (a * d - b * c) ** 2 / ((a + b) * (c + d) * (a + c) * (b + d))
+    chi2 = np.nan_to_num(chi2)
+
+    keep = np.flatnonzero(total >= min_count)
+    return pd.DataFrame({
+        "ngram": [' '.join(counts.decode(row)) for row in keep],
+        GROUPS[0]: y0[keep].astype(np.int64),
+        GROUPS[1]: y1[keep].astype(np.int64),
+        "log_odds": delta[keep],
+        "z": delta[keep] / np.sqrt(var[keep]),
+        "chi2": chi2[keep],
+        "p": stats.chi2.sf(chi2[keep], 1),
+    }).sort_values("z", ascending=False, ignore_index=True)
+
+
+def count_by_retention(user_data: Iterable[UserDict], n=3, workers=None) \
+        -> Dict[str, GroupedNgramCounts]:
+    '''
+    Counts n-grams of every source, split by retention, in one pass
+    over the users
+    '''
+    vocab = Vocabulary()
+    counts = {source: GroupedNgramCounts(n, len(GROUPS), vocab) for source in SOURCES}
+
+    def labelled_bodies():
+        for raw_data in user_data:
+            user = User(raw_data)
+            group = user.f_retention
+            for post in raw_data["Posts"]:
+                yield "posts", group, post["Body"]
+            for answer in user.get_answers_by_others():
+                yield "answers", group, answer["Body"]
+
+    labels, bodies = tee(labelled_bodies())
+    tokens = instrument.timed_iter('tokenize', tokenize_many((body for _, _, body in bodies),
+                                                             workers=workers))
+    for (source, group, _), body_tokens in zip(labels, tokens):
+        counts[source].add(body_tokens, group)
+
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='n-grams associated with retention')
+    parser.add_argument('-n', type=int, default=3, help='n-gram length')
+    parser.add_argument('-k', '--top', type=int, default=20, help='number of n-grams to show')
+    parser.add_argument('--min-count', type=int, default=5,
+                        help='ignore n-grams seen fewer times than this')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='tokenizer processes (default: one per core)')
+    parser.add_argument('--profile', choices=instrument.MODES, default=None,
+                        help='time each stage (and cProfile the run) and print a JSON summary')
+    args = parser.parse_args()
+
+    if args.profile:
+        instrument.enable(args.profile)
+
+    counts = count_by_retention(load_data(fields=["Body", "Answers.Body"]), args.n, args.workers)
+    with pd.option_context('display.width', None, 'display.max_columns', None):
+        for source in SOURCES:
+            scores = contrast_scores(counts[source], args.min_count)
+            print(f'--- {source}: most associated with retention ---')
+            print(scores.head(args.top))
+            print(f'\n--- {source}: most associated with non-retention ---')
+            print(scores.tail(args.top).iloc[::-1])
+            print()
+
+    instrument.report()
@@ -1,15 +1,95 @@
-from itertools import islice
-from features import Answer, User, tokenize_body
+import argparse
+from features import User, tokenize_many
+from lib import instrument
+from lib.ngram_counter import NgramCounter, pack
+from lib.sketches import HeavyHitters, error_report
 from loader import load_data
-from nltk import ngrams, FreqDist
 
-answers = (Answer(answer)
-           for raw_data in load_data()
-           for answer in User(raw_data).get_answers_by_others())
 
-ngram_samples = [ngram for answer in islice(answers, 10000) for ngram in ngrams(
-    tokenize_body(answer.Body), 3)]
+def answer_bodies():
+    return (answer.Body
+            for raw_data in load_data(fields=["Answers.Body"])
+            for answer in User(raw_data).iter_answers())
 
-fd = FreqDist(ngram_samples)
-for ng, f in fd.most_common(10):
-    print(f, ng)
+
+def count_ngrams(bodies, n=3, memory_limit=512 * 2**20, workers=None) -> NgramCounter:
+    '''
+    Exact n-gram counts over every body, spilling to disk whenever the
+    counts outgrow memory_limit bytes
+    '''
+    counter = NgramCounter(n, memory_limit=memory_limit)
+    for tokens in instrument.timed_iter('tokenize', tokenize_many(bodies, workers=workers)):
+        counter.add(tokens)
+    return counter
+
+
+def approx_ngrams(bodies, n=3, capacity=1000, epsilon=1e-4, delta=1e-3,
+                  workers=None) -> HeavyHitters:
+    '''
+    Approximate n-gram counts over every body in fixed memory. Sketches
+    built over separate shards of the data can be combined with merge()
+    '''
+    sketch = HeavyHitters(n, capacity, epsilon, delta)
+    for tokens in instrument.timed_iter('tokenize', tokenize_many(bodies, workers=workers)):
+        sketch.add(tokens)
+    return sketch
+
+
+def compare(sketch: HeavyHitters, counter: NgramCounter, k: int) -> dict:
+    '''
+    Error of the sketch's top k against the exact counts
+    '''
+    approx = sketch.most_common(k)
+    exact_top = counter.most_common(k)
+
+    vocab = counter.vocab.ids
+    keys = {pack(vocab[t] for t in ngram): ngram for ngram, _ in approx}
+    exact_counts = {keys[key]: count for key, count in counter.items() if key in keys}
+
+    report = error_report(approx, exact_top, exact_counts)
+    report["error_bound"] = sketch.cms.error_bound
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Most common n-grams in answer bodies')
+    parser.add_argument('-n', type=int, default=3, help='n-gram length')
+    parser.add_argument('-k', '--top', type=int, default=10, help='number of n-grams to show')
+    parser.add_argument('--memory-mb', type=int, default=512,
+                        help='memory budget for the exact counts before spilling to disk')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='tokenizer processes (default: one per core)')
+    parser.add_argument('--approx', action='store_true',
+                        help='use Count-Min + Space-Saving instead of exact counts')
+    parser.add_argument('--capacity', type=int, default=1000,
+                        help='number of Space-Saving candidates (--approx)')
+    parser.add_argument('--epsilon', type=float, default=1e-4,
+                        help='Count-Min overcount bound, as a fraction of all n-grams (--approx)')
+    parser.add_argument('--delta', type=float, default=1e-3,
+                        help='probability the Count-Min bound is exceeded (--approx)')
+    parser.add_argument('--compare', action='store_true',
+                        help='also count exactly and report the error of --approx')
+    parser.add_argument('--profile', choices=instrument.MODES, default=None,
+                        help='time each stage (and cProfile the run) and print a JSON summary')
+    args = parser.parse_args()
+
+    if args.profile:
+        instrument.enable(args.profile)
+
+    if not args.approx:
+        with count_ngrams(answer_bodies(), args.n, args.memory_mb * 2**20, args.workers) as counter:
+            for ng, f in counter.most_common(args.top):
+                print(f, ng)
+    else:
+        sketch = approx_ngrams(answer_bodies(), args.n, args.capacity,
+                               args.epsilon, args.delta, args.workers)
+        for ng, f in sketch.most_common(args.top):
+            print(f, ng)
+
+        if args.compare:
+            with count_ngrams(answer_bodies(), args.n, args.memory_mb * 2**20, args.workers) as counter:
+                print()
+                for name, value in compare(sketch, counter, args.top).items():
+                    print(f'{name}: {value}')
+
+    instrument.report()
@@ -0,0 +1,25 @@
+'''
+The batch feature engine gives the same values as analysis2.user_to_vec,
+user by user
+
+    python -m pytest tests/test_batch_features.py
+'''
+
+import numpy as np
+import pytest
+from analysis2 import F_ANSWERED, F_BASIC, user_to_vec
+from batch_features import FEATURE_NAMES, compute_features
+from benchmarks.synthetic import make_users
+
+
+@pytest.mark.parametrize('columns', [FEATURE_NAMES, F_BASIC, F_ANSWERED])
+def test_matches_user_to_vec(columns):
+    users = make_users(300)
+    batch = compute_features(users, columns)
+    assert list(batch) == list(columns)
+
+    for i, user in enumerate(users):
+        expected = user_to_vec(user, columns)
+        for column in columns:
+            value = np.nan if expected[column] is None else expected[column]
+            assert np.array_equal(batch[column][i], value, equal_nan=True), (i, column)
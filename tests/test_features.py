@@ -0,0 +1,68 @@
+'''
+Feature columns only depend on, and only compute, the helper aggregates
+they declare, and match the original per-property User
+
+    python -m pytest tests/test_features.py
+'''
+
+import inspect
+import numpy as np
+import dataset_cache
+from benchmarks.bench_user_features import OriginalUser, all_props
+from benchmarks.synthetic import make_users
+from features import FEATURES, HELPERS, User, vectorize_users
+
+AGGREGATES = {dep: helpers[0] for dep, helpers in HELPERS.items()}
+
+getsource = inspect.getsource
+
+
+def fingerprints_with_changed_source(monkeypatch, changed) -> dict:
+    '''
+    Every column's fingerprint, as if the source of `changed` were edited
+    '''
+    monkeypatch.setattr(inspect, 'getsource',
+                        lambda obj: getsource(obj) + ('# edited' if obj is changed else ''))
+    monkeypatch.setattr(dataset_cache, '_fingerprints', {})
+    return {name: dataset_cache.column_fingerprint(name) for name in FEATURES}
+
+
+def test_editing_a_helper_only_changes_columns_that_declare_it(monkeypatch):
+    original = fingerprints_with_changed_source(monkeypatch, None)
+    for dep, aggregate in AGGREGATES.items():
+        edited = fingerprints_with_changed_source(monkeypatch, aggregate)
+        changed = {name for name in FEATURES if edited[name] != original[name]}
+        assert changed == {name for name, f in FEATURES.items() if dep in f.deps}, dep
+
+    for name, feature in FEATURES.items():
+        edited = fingerprints_with_changed_source(monkeypatch, feature.fget)
+        assert {c for c in FEATURES if edited[c] != original[c]} == {name}
+
+
+def test_only_declared_aggregates_are_built(monkeypatch):
+    built = set()
+    for dep, aggregate in AGGREGATES.items():
+        init = aggregate.__init__
+
+        def tracked(self, user_dict, _init=init, _dep=dep):
+            built.add(_dep)
+            _init(self, user_dict)
+        monkeypatch.setattr(aggregate, '__init__', tracked)
+
+    users = make_users(50)
+    for name, feature in FEATURES.items():
+        built.clear()
+        vectorize_users(users, [name])
+        assert built <= set(feature.deps), name
+
+
+def test_aggregates_match_per_property_passes():
+    users = make_users(200)
+    columns = list(FEATURES)
+    expected = np.array([[np.nan if value is None else value
+                          for value in (getattr(OriginalUser(u), 'f_' + c) for c in columns)]
+                         for u in users])
+    assert np.array_equal(vectorize_users(users, columns), expected, equal_nan=True)
+
+    for u in users:
+        assert all_props(User(u)) == all_props(OriginalUser(u))
@@ -0,0 +1,76 @@
+'''
+lib.logit gives the same fits as statsmodels' Logit(...).fit(), whether
+the subsets are fitted together (warm-started from each other) or the
+rows are streamed in chunks
+
+    python -m pytest tests/test_logit.py
+'''
+
+import numpy as np
+import pandas as pd
+import pytest
+import statsmodels.api as sm
+from lib.logit import CONST, fit_logit, fit_logit_chunked, fit_subsets
+
+SUBSETS = [("a", "b"), ("a", "b", "c"), ("b", "d"), ("a", "b", "c", "d"), ("d",)]
+
+
+def synthetic_frame(num_rows=2000, seed=0) -> pd.DataFrame:
+    '''
+    Correlated columns a-d with some nan in c, and a 0/1 column y drawn
+    from a logistic model of them
+    '''
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size=(num_rows, 4)) @ np.array([[1, .3, 0, 0], [0, 1, .5, 0],
+                                                    [0, 0, 1, .2], [0, 0, 0, 1]])
+    eta = -.4 + X @ np.array([.8, -.5, .3, 0])
+    data = pd.DataFrame(X, columns=["a", "b", "c", "d"])
+    data["y"] = (rng.random(num_rows) < 1 / (1 + np.exp(-eta))).astype(float)
+    data.loc[rng.random(num_rows) < .1, "c"] = np.nan
+    return data
+
+
+def assert_same_fit(result, expected):
+    assert list(result.params.index) == list(expected.params.index)
+    for attr in ("params", "bse", "pvalues"):
+        np.testing.assert_allclose(getattr(result, attr), getattr(expected, attr),
+                                   rtol=1e-7, atol=1e-12, err_msg=attr)
+    np.testing.assert_allclose(result.conf_int(), expected.conf_int(), rtol=1e-7, atol=1e-12)
+    assert result.llf == pytest.approx(expected.llf, rel=1e-10)
+
+
+def test_fit_subsets_matches_statsmodels():
+    data = synthetic_frame()
+    results = fit_subsets(data, "y", SUBSETS)
+
+    assert len(results) == len(SUBSETS)
+    for subset, result in zip(SUBSETS, results):
+        rows = data[[*subset, "y"]].dropna()
+        expected = sm.Logit(rows["y"], sm.add_constant(rows[list(subset)])).fit(disp=0)
+        assert result.converged
+        assert result.nobs == len(rows)
+        assert_same_fit(result, expected)
+
+
+@pytest.mark.parametrize('weighted', [False, True])
+def test_chunked_matches_in_memory(weighted):
+    data = synthetic_frame().dropna()
+    names = [CONST, "a", "b", "c", "d"]
+    design = sm.add_constant(data[names[1:]])
+    X, y = design.to_numpy(), data["y"].to_numpy()
+    weights = np.random.default_rng(1).integers(1, 4, len(y)).astype(float) \
+        if weighted else None
+
+    bounds = np.linspace(0, len(y), 8).astype(int)
+
+    def chunks():
+        for a, b in zip(bounds, bounds[1:]):
+            yield X[a:b], y[a:b], None if weights is None else weights[a:b]
+
+    expected = fit_logit(X, y, names, weights=weights)
+    result = fit_logit_chunked(chunks, names)
+
+    assert result.converged and result.nobs == expected.nobs
+    assert_same_fit(result, expected)
+    if not weighted:
+        assert_same_fit(result, sm.Logit(data["y"], design).fit(disp=0))
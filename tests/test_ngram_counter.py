@@ -0,0 +1,46 @@
+'''
+NgramCounter gives exact counts, whether or not it spills to disk
+
+    python -m pytest tests/test_ngram_counter.py
+'''
+
+import random
+from collections import Counter
+import pytest
+from lib.ngram_counter import NgramCounter
+
+
+def random_docs(rng: random.Random, num_docs=300, vocab_size=12):
+    '''
+    Documents over a small vocabulary, so n-grams repeat, including
+    some shorter than n
+    '''
+    vocab = [f'w{i}' for i in range(vocab_size)]
+    return [[rng.choice(vocab) for _ in range(rng.randrange(12))] for _ in range(num_docs)]
+
+
+def exact_counts(docs, n) -> Counter:
+    return Counter(tuple(doc[i:i + n]) for doc in docs for i in range(len(doc) - n + 1))
+
+
+@pytest.mark.parametrize('n', [1, 2, 3])
+@pytest.mark.parametrize('max_entries', [1, 7, 10**6])
+def test_counts_match_counter(tmp_path, n, max_entries):
+    docs = random_docs(random.Random(n))
+    expected = exact_counts(docs, n)
+
+    with NgramCounter(n, memory_limit=max_entries * NgramCounter.BYTES_PER_ENTRY,
+                      spill_dir=tmp_path) as counter:
+        for doc in docs:
+            counter.add(doc)
+
+        if max_entries < len(expected):
+            assert len(counter.runs) > 1
+        assert counter.total == sum(expected.values())
+        assert {counter.decode(key): count for key, count in counter.items()} == expected
+
+        top = counter.most_common(10)
+        assert [count for _, count in top] == [count for _, count in expected.most_common(10)]
+        assert all(expected[ngram] == count for ngram, count in top)
+
+    assert not list(tmp_path.iterdir())
@@ -0,0 +1,82 @@
+'''
+HeavyHitters only ever overcounts, by at most the Count-Min error bound,
+whether built in one pass or merged from shards, and never counts an
+n-gram that spans two documents
+
+    python -m pytest tests/test_sketches.py
+'''
+
+import random
+from collections import Counter
+import numpy as np
+from lib.sketches import HeavyHitters, ngram_hashes, stable_hash
+
+N = 2
+
+
+def skewed_docs(seed=0, num_docs=2000, vocab_size=40):
+    '''
+    Documents whose tokens follow a Zipf-like distribution, so that some
+    n-grams are far more common than the rest
+    '''
+    rng = random.Random(seed)
+    vocab = [f'w{i}' for i in range(vocab_size)]
+    weights = [1 / (i + 1) for i in range(vocab_size)]
+    return [rng.choices(vocab, weights, k=rng.randrange(15)) for _ in range(num_docs)]
+
+
+def exact_counts(docs, n=N) -> Counter:
+    return Counter(tuple(doc[i:i + n]) for doc in docs for i in range(len(doc) - n + 1))
+
+
+def build(docs, capacity=50, flush_size=500) -> HeavyHitters:
+    sketch = HeavyHitters(N, capacity, epsilon=1e-3, delta=1e-3)
+    sketch.FLUSH_SIZE = flush_size
+    for doc in docs:
+        sketch.add(doc)
+    return sketch
+
+
+def test_top_k_never_undercounts():
+    docs = skewed_docs()
+    exact = exact_counts(docs)
+    sketch = build(docs)
+
+    top = sketch.most_common(20)
+    assert sketch.total == sum(exact.values())
+    for ngram, estimate in top:
+        assert exact[ngram] <= estimate <= exact[ngram] + sketch.cms.error_bound, ngram
+
+
+def test_merged_halves_match_single_pass():
+    docs = skewed_docs()
+    exact = exact_counts(docs)
+    single = build(docs)
+    merged = build(docs[:len(docs) // 2])
+    merged.merge(build(docs[len(docs) // 2:]))
+
+    single_top = dict(single.most_common(20))
+    assert merged.total == single.total
+    assert np.array_equal(merged.cms.table, single.cms.table)
+
+    for ngram, estimate in merged.most_common(20):
+        assert exact[ngram] <= estimate <= exact[ngram] + merged.cms.error_bound, ngram
+        if ngram in single_top:
+            assert abs(estimate - single_top[ngram]) <= merged.cms.error_bound, ngram
+
+
+def test_flush_skips_ngrams_across_documents():
+    # Every document has its own tokens, so any n-gram spanning two
+    # documents would be one that doesn't occur in either
+    docs = [[f'd{k}t{i}' for i in range(k % 5)] for k in range(200)]
+    sketch = build(docs, capacity=10_000, flush_size=7)
+
+    within = exact_counts(docs)
+    assert sketch.total == sum(within.values())
+    assert dict(sketch.most_common(10_000)) == within
+
+    tokens = [token for doc in docs for token in doc]
+    hashes = ngram_hashes(np.array([stable_hash(t) for t in tokens], dtype=np.uint64), N)
+    across = [h for i, h in enumerate(hashes.tolist()) if tuple(tokens[i:i + N]) not in within]
+    assert across
+    assert not sketch.cms.estimate(np.array(across, dtype=np.uint64)).any()
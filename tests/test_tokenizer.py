@@ -0,0 +1,235 @@
+'''
+Golden outputs of tokenize_body, taken from the original step-by-step
+implementation (before features.Tokenizer), for every combination of
+remove_stopwords and remove_smallwords
+
+    python -m pytest tests/test_tokenizer.py
+'''
+
+import random
+import re
+import pytest
+from nltk.corpus import stopwords
+from features import Tokenizer, tokenize_body, tokenize_many
+
+FLAGS = [(True, True), (True, False), (False, True), (False, False)]
+
+GOLDEN = [
+    ('', {
+        (True, True): [],
+        (True, False): [],
+        (False, True): [],
+        (False, False): [],
+    }),
+    ('   \n\t  ', {
+        (True, True): [],
+        (True, False): [],
+        (False, True): [],
+        (False, False): [],
+    }),
+    ("<p>How do I reverse a list in Python? I've tried everything.</p>", {
+        (True, True): ['reverse', 'list', 'python', 'ive', 'tried', 'everything'],
+        (True, False): ['reverse', 'list', 'python', 'ive', 'tried', 'everything'],
+        (False, True): ['how', 'reverse', 'list', 'python', 'ive', 'tried', 'everything'],
+        (False, False): ['how', 'do', 'i', 'reverse', 'a', 'list', 'in', 'python', 'ive', 'tried', 'everything'],
+    }),
+    ("<p>I have this code:</p>\n<pre><code>for i in range(10):\n    print(i)\n</code></pre>\n<p>but it doesn't work</p>", {
+        (True, True): ['code', '<code>', 'doesnt', 'work'],
+        (True, False): ['code', '<code>', 'doesnt', 'work'],
+        (False, True): ['have', 'this', 'code', '<code>', 'but', 'doesnt', 'work'],
+        (False, False): ['i', 'have', 'this', 'code', '<code>', 'but', 'it', 'doesnt', 'work'],
+    }),
+    ('<p>Two blocks <code>x = 1</code> and <code>y = 2</code> in one line</p>', {
+        (True, True): ['two', 'blocks', '<code>', 'one', 'line'],
+        (True, False): ['two', 'blocks', '<code>', 'one', 'line'],
+        (False, True): ['two', 'blocks', '<code>', 'and', '<code>', 'one', 'line'],
+        (False, False): ['two', 'blocks', '<code>', 'and', '<code>', 'in', 'one', 'line'],
+    }),
+    ('<p>Unclosed <code>int main() { return 0; }</p>', {
+        (True, True): ['unclosed', '<code>', 'int', 'main', 'return', '<num>'],
+        (True, False): ['unclosed', '<code>', 'int', 'main', 'return', '<num>'],
+        (False, True): ['unclosed', '<code>', 'int', 'main', 'return', '<num>'],
+        (False, False): ['unclosed', '<code>', 'int', 'main', 'return', '<num>'],
+    }),
+    ('<p>See <a href="https://example.com/a?b=1&amp;c=2" rel="nofollow">the docs</a> and <a href="x">this\nmultiline link</a>.</p>', {
+        (True, True): ['see', '<a>'],
+        (True, False): ['see', '<a>'],
+        (False, True): ['see', '<a>', 'and', '<a>'],
+        (False, False): ['see', '<a>', 'and', '<a>'],
+    }),
+    ('<p>A < 5 > 3 comparison and <a href unclosed link</p>', {
+        (True, True): ['<num>', 'comparison', 'href', 'unclosed', 'link'],
+        (True, False): ['<num>', 'comparison', '<a', 'href', 'unclosed', 'link'],
+        (False, True): ['<num>', 'comparison', 'and', 'href', 'unclosed', 'link'],
+        (False, False): ['a', '<num>', 'comparison', 'and', '<a', 'href', 'unclosed', 'link'],
+    }),
+    ('<p>Entities: &amp; &lt;code&gt; &quot;quoted&quot; &nbsp;space &#39;numeric&#39; &amp;amp;</p>', {
+        (True, True): ['entities', 'code', 'quoted', 'space', '<num>', 'numeric', '<num>', 'amp'],
+        (True, False): ['entities', 'code', 'quoted', 'space', '<num>', 'numeric', '<num>', 'amp'],
+        (False, True): ['entities', 'code', 'quoted', 'space', '<num>', 'numeric', '<num>', 'amp'],
+        (False, False): ['entities', 'code', 'quoted', 'space', '<num>', 'numeric', '<num>', 'amp'],
+    }),
+    ('<p>Numbers 1,000.50 and .5 and 3.10.4 and 42nd, 1e10, -7</p>', {
+        (True, True): ['numbers', '<num>'],
+        (True, False): ['numbers', '<num>', 'nd', '<num>', 'e', '<num>'],
+        (False, True): ['numbers', '<num>', 'and', '<num>', 'and', '<num>', 'and', '<num>'],
+        (False, False): ['numbers', '<num>', 'and', '<num>', 'and', '<num>', 'and', '<num>', 'nd', '<num>', 'e', '<num>'],
+    }),
+    ('<p>Version 2 2 2 repeated numbers 10 20 30 collapse</p>', {
+        (True, True): ['version', '<num>', 'repeated', 'numbers', '<num>', 'collapse'],
+        (True, False): ['version', '<num>', 'repeated', 'numbers', '<num>', 'collapse'],
+        (False, True): ['version', '<num>', 'repeated', 'numbers', '<num>', 'collapse'],
+        (False, False): ['version', '<num>', 'repeated', 'numbers', '<num>', 'collapse'],
+    }),
+    ('<p>Café naïve résumé — “smart quotes” and ‘single’ it’s don’t</p>', {
+        (True, True): ['caf', 'sum', 'smart', 'quotes', 'single', 'dont'],
+        (True, False): ['caf', 'na', 'r', 'sum', 'smart', 'quotes', 'single', 'dont'],
+        (False, True): ['caf', 'sum', 'smart', 'quotes', 'and', 'single', 'its', 'dont'],
+        (False, False): ['caf', 'na', 've', 'r', 'sum', 'smart', 'quotes', 'and', 'single', 'its', 'dont'],
+    }),
+    ('<p>Emoji 😀 and CJK 漢字 テスト mixed with English words</p>', {
+        (True, True): ['emoji', 'cjk', 'mixed', 'english', 'words'],
+        (True, False): ['emoji', 'cjk', 'mixed', 'english', 'words'],
+        (False, True): ['emoji', 'and', 'cjk', 'mixed', 'with', 'english', 'words'],
+        (False, False): ['emoji', 'and', 'cjk', 'mixed', 'with', 'english', 'words'],
+    }),
+    ('<P>UPPER CASE <B>Bold</B> <BR/> Tags <DIV CLASS="x">inside</DIV></P>', {
+        (True, True): ['upper', 'case', 'bold', 'tags', 'inside'],
+        (True, False): ['upper', 'case', 'bold', 'tags', 'inside'],
+        (False, True): ['upper', 'case', 'bold', 'tags', 'inside'],
+        (False, False): ['upper', 'case', 'bold', 'tags', 'inside'],
+    }),
+    ('<p>Literal special tokens <num> <num> <code> <a> <unknown> in text</p>', {
+        (True, True): ['literal', 'special', 'tokens', '<code>', '<a>', 'text'],
+        (True, False): ['literal', 'special', 'tokens', '<code>', '<a>', 'text'],
+        (False, True): ['literal', 'special', 'tokens', '<code>', '<a>', 'text'],
+        (False, False): ['literal', 'special', 'tokens', '<code>', '<a>', 'in', 'text'],
+    }),
+    ('<!-- comment --><p>after comment</p><br><hr/><img src="a.png" alt="pic">', {
+        (True, True): ['comment'],
+        (True, False): ['comment'],
+        (False, True): ['after', 'comment'],
+        (False, False): ['after', 'comment'],
+    }),
+    ('<blockquote><p>The the THE a an is it of to in on at by for with</p></blockquote>', {
+        (True, True): [],
+        (True, False): [],
+        (False, True): ['the', 'the', 'the', 'for', 'with'],
+        (False, False): ['the', 'the', 'the', 'a', 'an', 'is', 'it', 'of', 'to', 'in', 'on', 'at', 'by', 'for', 'with'],
+    }),
+    ('<ul><li>item one</li><li>item two</li></ul><ol><li>first</li></ol>', {
+        (True, True): ['item', 'one', 'item', 'two', 'first'],
+        (True, False): ['item', 'one', 'item', 'two', 'first'],
+        (False, True): ['item', 'one', 'item', 'two', 'first'],
+        (False, False): ['item', 'one', 'item', 'two', 'first'],
+    }),
+    ('a<b>c</b>d e&f g_h i-j k/l m\\n o@p q#r', {
+        (True, True): [],
+        (True, False): ['c', 'e', 'f', 'g', 'h', 'j', 'k', 'l', 'n', 'p', 'q', 'r'],
+        (False, True): [],
+        (False, False): ['a', 'c', 'd', 'e', 'f', 'g', 'h', 'i', 'j', 'k', 'l', 'm', 'n', 'o', 'p', 'q', 'r'],
+    }),
+    ('<pre><code>&lt;div&gt;escaped html&lt;/div&gt;</code></pre><p>tail text here</p>', {
+        (True, True): ['<code>', 'tail', 'text'],
+        (True, False): ['<code>', 'tail', 'text'],
+        (False, True): ['<code>', 'tail', 'text', 'here'],
+        (False, False): ['<code>', 'tail', 'text', 'here'],
+    }),
+    ("<a href='x'><code>code inside link</code></a> <code><a href='y'>link inside code</a></code>", {
+        (True, True): ['<a>', '<code>'],
+        (True, False): ['<a>', '<code>'],
+        (False, True): ['<a>', '<code>'],
+        (False, False): ['<a>', '<code>'],
+    }),
+    ('Plain text with no html at all, just words and punctuation!?;:', {
+        (True, True): ['plain', 'text', 'html', 'words', 'punctuation'],
+        (True, False): ['plain', 'text', 'html', 'words', 'punctuation'],
+        (False, True): ['plain', 'text', 'with', 'html', 'all', 'just', 'words', 'and', 'punctuation'],
+        (False, False): ['plain', 'text', 'with', 'no', 'html', 'at', 'all', 'just', 'words', 'and', 'punctuation'],
+    }),
+    ('<p>x</p><p>x</p><p>x</p><p>x</p><p>x</p>', {
+        (True, True): [],
+        (True, False): ['x', 'x', 'x', 'x', 'x'],
+        (False, True): [],
+        (False, False): ['x', 'x', 'x', 'x', 'x'],
+    }),
+    ('<code>a</code><code>b</code> <a href=x>1</a><a href=y>2</a> 1 2 3', {
+        (True, True): ['<code>', '<a>', '<num>'],
+        (True, False): ['<code>', '<a>', '<num>'],
+        (False, True): ['<code>', '<a>', '<num>'],
+        (False, False): ['<code>', '<a>', '<num>'],
+    }),
+]
+
+
+def original_tokenize_body(body: str, remove_stopwords=True, remove_smallwords=True):
+    '''
+    tokenize_body as it was before it was compiled into Tokenizer
+    '''
+    body = body.lower()
+    body = re.sub(r'\<a.*?\>.*?\</a\>', '<a>', body, flags=re.DOTALL)
+    body = re.sub(r'\<code\>.*?\</code\>', '<code>', body, flags=re.DOTALL)
+    body = re.sub(r'\</.*?\>', ' ', body)
+    known_tags = {'a', 'code'}
+    body = re.sub(r'\<(.*?)\>', lambda m: m.group(0)
+                  if m.group(1) in known_tags else ' ', body)
+    body = re.sub(r'[,.]?[0-9][0-9,.]*', '<num>', body)
+    body = re.sub(r'\<.*?\>', r' \g<0> ', body)
+    body = re.sub(r'&[a-z]+;', '', body)
+    body = re.sub(r'[\'`"’‘]', '', body)
+    body = re.sub(r'[^a-z\s<>]', ' ', body)
+
+    tokens = body.split()
+
+    if remove_stopwords:
+        _stopwords = stopwords.words('english')
+        tokens = [token for token in tokens if token not in _stopwords]
+
+    if remove_smallwords:
+        tokens = [token for token in tokens if len(token) >= 3]
+
+    for i in range(1, len(tokens))[::-1]:
+        if re.match(r'\<.*\>', tokens[i]) and tokens[i] == tokens[i - 1]:
+            del tokens[i]
+
+    return tokens
+
+
+def random_body(rng: random.Random) -> str:
+    '''
+    A body glued together from fragments that exercise the edge cases of
+    every step: tags, entities, numbers, quotes and unicode
+    '''
+    fragments = ['<p>', '</p>', '<code>', '</code>', '<a href="x">', '</a>', '<', '>', '</',
+                 '&amp;', '&lt;', '&gt;', '&', ';', '1', '2,5', '.3', '10.0.1', ',', '.', "'",
+                 '"', '’', '‘', '`', ' ', '\n', 'the', 'a', 'is', 'to', 'no', 'word', 'Python',
+                 'CODE', 'num', '<num>', 'é', '漢', '😀', '_', '-', 'x']
+    return ''.join(rng.choice(fragments) for _ in range(rng.randrange(40)))
+
+
+@pytest.mark.parametrize('flags', FLAGS)
+@pytest.mark.parametrize('body, expected', GOLDEN)
+def test_golden(body, expected, flags):
+    assert tokenize_body(body, *flags) == expected[flags]
+
+
+@pytest.mark.parametrize('flags', FLAGS)
+def test_golden_matches_original(flags):
+    for body, expected in GOLDEN:
+        assert original_tokenize_body(body, *flags) == expected[flags]
+
+
+@pytest.mark.parametrize('flags', FLAGS)
+def test_random_bodies_match_original(flags):
+    rng = random.Random(565)
+    tokenizer = Tokenizer(*flags)
+    for _ in range(2000):
+        body = random_body(rng)
+        assert tokenizer.tokenize(body) == original_tokenize_body(body, *flags), body
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_tokenize_many(workers):
+    bodies = [body for body, _ in GOLDEN]
+    assert list(tokenize_many(bodies, workers=workers, chunksize=5)) == \
+        [expected[(True, True)] for _, expected in GOLDEN]